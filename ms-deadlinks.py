@@ -8,6 +8,9 @@ Wikipedysta:MastiBot/Statystyka martwych linków/ogólne
 Call: 
 python pwb.py masti/ms-deadlinks.py -cat:"Niezweryfikowane martwe linki" -ns:1 -outpage:"Wikipedysta:MastiBot/Statystyka martwych linków" -summary:"Bot uaktualnia stronę" -maxlines:3000
 
+or, without crawling the talk pages:
+python pwb.py masti/ms-deadlinks.py -history -outpage:"Wikipedysta:MastiBot/Statystyka martwych linków" -summary:"Bot uaktualnia stronę" -maxlines:3000
+
 The following parameters are supported:
 
 &params;
@@ -29,6 +32,21 @@ The following parameters are supported:
 
 -includes:        Link to be searched for
 -progress:        Display progress
+
+-history          Take the dead links from the history of wlc.py instead of
+                  the talk pages given by the generator: the links found
+                  dead first more than weblink_dead_days ago, which are
+                  those wlc.py reports. The default is the history file of
+                  the site, deadlinks/deadlinks-wikipedia-pl.sqlite; another
+                  one can be given as -history:file. The file is only read,
+                  so wlc.py may be running; it must exist. References are
+                  counted for every spelling of a link.
+
+-refsage:         With -history the number of references to each link is
+                  counted once per article and kept in
+                  deadlinks/refcounts-wikipedia-pl.sqlite; only articles
+                  counted more than this many days ago are loaded again.
+                  Default 30
 """
 #
 # (C) Pywikibot team, 2006-2016
@@ -47,7 +65,10 @@ from pywikibot.bot import (
     SingleSiteBot, ExistingPageBot, NoRedirectPageBot, AutomaticTWSummaryBot)
 from pywikibot.tools import issue_deprecation_warning
 import re
+import bisect
 import datetime
+import sqlite3
+import time
 #import api
 
 
@@ -100,6 +121,8 @@ class BasicBot(
             'test': False, #test options
             'progress':False, #display progress
             'includes' : False, #only include links that include this text
+            'history': False, #take links from wlc.py history (True or file)
+            'refsage': 30, #days after which references are counted again
         })
 
         # call constructor of the super class
@@ -112,6 +135,9 @@ class BasicBot(
         # assign the generator to the bot
         self.generator = generator
 
+        # RefIndex of the last article text given to getRefsNumber
+        self.refIndex = None
+
     def _handle_dry_param(self, **kwargs):
         """
         Read the dry parameter and set the simulate variable instead.
@@ -158,7 +184,9 @@ class BasicBot(
         deadlinksfuse = {} #full links
         deadlinkssuse = {} #summary links
         licznik = 0
-        for page in self.generator:
+        if self.getOption('history'):
+            deadlinksf, deadlinksfuse, licznik = self.historyStats()
+        for page in self.generator or []:
             licznik += 1
             if self.getOption('progress'):
                 pywikibot.output(u'[%s]Treating #%i: %s' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),licznik, page.title()))
@@ -200,6 +228,78 @@ class BasicBot(
         #if not self.getOption('includes'):
         result = self.generateresultspage(deadlinkss,deadlinkssuse,self.getOption('outpage')+u'/ogólne',headersum,footer)
 
+    def historyStats(self):
+        """
+        Count dead links and their references from the wlc.py history.
+
+        @return: pages per link, references per link, number of articles
+        @rtype: tuple of (dict, dict, int)
+        """
+        # only needed here; the crawl of the talk pages works without wlc.py
+        import wlc
+
+        site = pywikibot.Site()
+        filename = self.getOption('history')
+        if filename is True:
+            filename = pywikibot.config.datafilepath(
+                'deadlinks', 'deadlinks-%s-%s.sqlite' % (site.family.name,
+                                                         site.code))
+        # readonly: wlc.py may be running, and a wrong path must not give
+        # an empty history
+        store = wlc.DeadLinkStore(filename, readonly=True)
+        reported = (time.time()
+                    - 60 * 60 * 24 * pywikibot.config.weblink_dead_days)
+        deadlinksf = {}
+        deadlinksfuse = {}
+        articles = {} # title -> spellings of the dead links reported in it
+        spelledAs = {} # spelling -> the link it is counted for
+        try:
+            for url, entries in store.items():
+                if min(entry.date for entry in entries) > reported:
+                    continue
+                deadlinksf[url] = len(set(entry.title for entry in entries))
+                deadlinksfuse[url] = 0
+                # a page may spell the link unlike the first one found
+                for title, spelling in store.spellings(url):
+                    spelledAs[spelling] = url
+                    articles.setdefault(title, []).append(spelling)
+        finally:
+            store.close()
+        pywikibot.output(u'[%s] %i dead links in %i articles read from %s'
+                         % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(deadlinksf), len(articles),
+                            filename))
+
+        cache = RefCountCache(site, float(self.getOption('refsage')))
+        missing = []
+        try:
+            for title, urls in articles.items():
+                counts = cache.get(title, urls)
+                if counts is None:
+                    missing.append(title)
+                    continue
+                for url in urls:
+                    deadlinksfuse[spelledAs[url]] += counts[url]
+            pywikibot.output(u'[%s] References of %i articles cached, %i to count'
+                             % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(articles) - len(missing),
+                                len(missing)))
+            gen = pagegenerators.PreloadingGenerator(
+                pywikibot.Page(site, title) for title in missing)
+            for licznik, page in enumerate(gen, 1):
+                if self.getOption('progress'):
+                    pywikibot.output(u'[%s]Counting #%i: %s' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),licznik, page.title()))
+                try:
+                    text = page.text if page.exists() else u''
+                except pywikibot.Error:
+                    text = u''
+                counts = dict((url, self.getRefsNumber(url, text))
+                              for url in articles[page.title()])
+                cache.put(page.title(), counts)
+                for url, count in counts.items():
+                    deadlinksfuse[spelledAs[url]] += count
+        finally:
+            cache.close()
+        return(deadlinksf, deadlinksfuse, len(articles))
+
     def getDomainStats(self,dl,dluse):
         deadlinksf = {}
         deadlinksfuse = {}
@@ -222,41 +322,20 @@ class BasicBot(
         return(deadlinksf,deadlinksfuse)           
 
     def getRefsNumber(self,weblink,text):
-        #find how many times link is referenced on the page
-        # ref names including group
-        #refR = re.compile(r'(?i)<ref (group *?= *?"?(?P<group>[^>"]*)"?)?(name *?= *?"?(?P<name>[^>"]*)"?)?>\.?\[?(?P<url>http[s]?:(\/\/[^:\s\?]+?)(\??[^\s<]*?)[^\]\.])(\]|\]\.)?[ \t]*<\/ref>')
-        refR = re.compile(r'(?im)<ref (group *?= *?"?(?P<group>[^>"]*)"?)?(name *?= *?"?(?P<name>[^>"]*)"?)?>.*?%s.*?<\/ref>' % re.escape(weblink).strip())
-
-        """
-        opcje wywołania: <ref name="BVL2006" /> {{u|BVL2006}} {{r|BVL2006}}
         """
+        Count how many times weblink is referenced in text.
 
-        #check if weblink is in named ref
-        linkscount = 0
-        #for r in refR.finditer(text):
-        r = refR.search(text)
-        if r:
-            if r.group('name'):
-                if self.getOption('test'):
-                    pywikibot.output('Treat:NamedRef:%s' % r.group('name'))
-                #template to catch note/ref with {{u}} or {{r}}
-                ruR = re.compile(r'(?i)(?:{{[ur] *?(?:[^\|}]*\|)*|<ref *?name *?= *?\"?)(%s)(?:[^}\/]*}}|\"? \/>)' % re.escape(r.group('name').strip()))
-                if self.getOption('test'):
-                    pywikibot.output('Treat:Regex:(?i)(?:{{[ur] *?(?:[^\|}]*\|)*|<ref *?name *?= *?\"?)(%s)(?:[^}\/]*}}|\"? \/>)' % re.escape(r.group('name').strip()))
-                match = ruR.findall(text)
-                linkscount += len(match)
-                if self.getOption('test'):
-                    pywikibot.output('Treat:Templates matched:%s' % match)
-        if self.getOption('test'):
-            pywikibot.output('Treat:links count:%s' % linkscount)
-
-        #catch unnamed links
-        match = re.findall(re.escape(weblink),text)
-        linkscount += len(match)
+        Every occurrence of the link counts, and so does every reuse of
+        the first named reference containing it: <ref name="..." />,
+        {{u|...}} or {{r|...}}. The references of the text are found once
+        by RefIndex; the index is kept for the next link of the same text.
+        """
+        if self.refIndex is None or self.refIndex.text is not text:
+            self.refIndex = RefIndex(text)
+        linkscount = self.refIndex.count(weblink)
         if self.getOption('test'):
-            pywikibot.output('Treat:Loose links matched:%s' % match)
+            pywikibot.output('Treat:NamedRef:%s' % self.refIndex.refName(weblink))
             pywikibot.output('Treat:links count:%s' % linkscount)
-
         return(linkscount)
 
     def treat(self, page):
@@ -374,6 +453,152 @@ class BasicBot(
 
 
 
+class RefIndex(object):
+    """
+    References of an article text, found once for all its links.
+
+    The counts are those of searching the text with regexes for every
+    link: every occurrence of the link, plus every reuse of the name of
+    the first reference whose opening tag is followed on the same line by
+    the link and then by </ref>. The opening tags and the </ref> tags are
+    found once, the occurrences of a link are looked up among them with
+    bisect, and the reuses of a name are counted once per text.
+    """
+
+    # <ref name="...">, <ref group="..." name=...>
+    openR = re.compile(r'(?im)<ref (group *?= *?"?(?P<group>[^>"]*)"?)?'
+                       r'(name *?= *?"?(?P<name>[^>"]*)"?)?>')
+    startR = re.compile(r'(?i)<ref ')
+    closeR = re.compile(r'(?i)<\/ref>')
+    # <ref name="..." />, {{u|...}}, {{r|...}}
+    reuseR = (r'(?i)(?:{{[ur] *?(?:[^\|}]*\|)*|<ref *?name *?= *?\"?)(%s)'
+              r'(?:[^}\/]*}}|\"? \/>)')
+    asciiLetterR = re.compile(r'(?i)[a-z]')
+    # A-Z -> a-z
+    lowerTable = dict((i, i + 32) for i in range(ord('A'), ord('Z') + 1))
+
+    def __init__(self, text):
+        """Index text."""
+        self.text = text
+        self.tagEnds = []  # ends of the opening tags
+        self.names = []  # names of the references, or None
+        for start in self.startR.finditer(text):
+            tag = self.openR.match(text, start.start())
+            if tag:
+                self.tagEnds.append(tag.end())
+                self.names.append(tag.group('name'))
+        self.closes = [match.start() for match in self.closeR.finditer(text)]
+        self.reuses = {}  # name -> number of reuses
+        # links are found ignoring case with str.find in a copy with ASCII
+        # lowered, unless another character matches an ASCII letter
+        if any(ord(c) > 127 and self.asciiLetterR.match(c)
+               for c in set(text)):
+            self.folded = None
+        else:
+            self.folded = text.translate(self.lowerTable)
+
+    def find(self, url):
+        """Yield where url starts in the text, ignoring case."""
+        if self.folded is None or any(ord(c) > 127 for c in url):
+            for match in re.finditer('(?i)(?=%s)' % re.escape(url),
+                                     self.text):
+                yield match.start()
+            return
+        url = url.translate(self.lowerTable)
+        found = self.folded.find(url)
+        while found >= 0:
+            yield found
+            found = self.folded.find(url, found + 1)
+
+    def refName(self, url):
+        """
+        Return the name of the first reference with url.
+
+        @return: the name, or None if the reference has none or there is
+            no reference with url
+        """
+        checkedLine = -1
+        for found in self.find(url):
+            if found < checkedLine:
+                continue
+            lineStart = self.text.rfind('\n', 0, found) + 1
+            # the first reference of the line opened before the link
+            i = bisect.bisect_left(self.tagEnds, lineStart)
+            if i == len(self.tagEnds) or self.tagEnds[i] > found:
+                continue
+            lineEnd = self.text.find('\n', found)
+            if lineEnd < 0:
+                lineEnd = len(self.text)
+            j = bisect.bisect_left(self.closes, found + len(url))
+            if j < len(self.closes) and self.closes[j] + 6 <= lineEnd:
+                return self.names[i]
+            # later references of the line have even less room
+            checkedLine = lineEnd
+        return None
+
+    def count(self, url):
+        """Return how many times url is referenced."""
+        count = self.text.count(url)
+        name = self.refName(url)
+        if name:
+            name = name.strip()
+            if name not in self.reuses:
+                self.reuses[name] = len(re.findall(
+                    self.reuseR % re.escape(name), self.text))
+            count += self.reuses[name]
+        return count
+
+
+class RefCountCache(object):
+    """
+    Numbers of references to dead links counted in articles.
+
+    Kept in an SQLite file in the deadlinks subdirectory, so that an article
+    is loaded again only when its counts are older than maxAge days or it
+    has dead links which were not counted.
+    """
+
+    def __init__(self, site, maxAge=30):
+        """Constructor."""
+        self.maxAge = maxAge
+        self.filename = pywikibot.config.datafilepath(
+            'deadlinks', 'refcounts-%s-%s.sqlite' % (site.family.name,
+                                                     site.code))
+        self.db = sqlite3.connect(self.filename)
+        self.db.execute('CREATE TABLE IF NOT EXISTS refcounts ('
+                        'title TEXT, url TEXT, count INTEGER, counted REAL, '
+                        'PRIMARY KEY (title, url))')
+        self.db.commit()
+
+    def get(self, title, urls):
+        """
+        Return the counts of urls in title if all are fresh, else None.
+
+        @rtype: dict or None
+        """
+        rows = self.db.execute('SELECT url, count FROM refcounts '
+                               'WHERE title = ? AND counted > ?',
+                               (title,
+                                time.time() - self.maxAge * 24 * 60 * 60))
+        counts = dict(rows)
+        if any(url not in counts for url in urls):
+            return None
+        return counts
+
+    def put(self, title, counts):
+        """Store counts, a dict of url: number of references, of title."""
+        now = time.time()
+        self.db.execute('DELETE FROM refcounts WHERE title = ?', (title, ))
+        self.db.executemany('INSERT INTO refcounts VALUES (?, ?, ?, ?)',
+                            [(title, url, count, now)
+                             for url, count in counts.items()])
+        self.db.commit()
+
+    def close(self):
+        """Close the database."""
+        self.db.close()
+
+
 def templateArg(param):
         """
         return name,value for each template param
@@ -428,20 +653,24 @@ def main(*args):
         # Now pick up your own options
         arg, sep, value = arg.partition(':')
         option = arg[1:]
-        if option in ('summary', 'text', 'outpage', 'maxlines', 'includes'):
+        if option in ('summary', 'text', 'outpage', 'maxlines', 'includes',
+                      'refsage'):
             if not value:
                 pywikibot.input('Please enter a value for ' + arg)
             options[option] = value
+        elif option == 'history':
+            options[option] = value or True
         # take the remaining options as booleans.
         # You will get a hint if they aren't pre-definded in your bot class
         else:
             options[option] = True
 
     gen = genFactory.getCombinedGenerator()
-    if gen:
+    if gen or options.get('history'):
         # The preloading generator is responsible for downloading multiple
         # pages from the wiki simultaneously.
-        gen = pagegenerators.PreloadingGenerator(gen)
+        if gen:
+            gen = pagegenerators.PreloadingGenerator(gen)
         # pass generator and private options to the bot
         bot = BasicBot(gen, **options)
         bot.run()  # guess what it does
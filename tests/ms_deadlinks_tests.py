@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tests of ms-deadlinks.py which need no wiki.
+
+Call: python -m unittest discover -s tests -p '*_tests.py'
+"""
+from __future__ import absolute_import, unicode_literals
+
+import importlib.util
+import os
+import re
+import unittest
+
+spec = importlib.util.spec_from_file_location('msdeadlinks', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'ms-deadlinks.py'))
+msdeadlinks = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(msdeadlinks)
+
+
+def former_refs_number(weblink, text):
+    """Count the references to weblink as getRefsNumber did before."""
+    refR = re.compile(r'(?im)<ref (group *?= *?"?(?P<group>[^>"]*)"?)?(name *?= *?"?(?P<name>[^>"]*)"?)?>.*?%s.*?<\/ref>' % re.escape(weblink).strip())
+    linkscount = 0
+    r = refR.search(text)
+    if r:
+        if r.group('name'):
+            ruR = re.compile(r'(?i)(?:{{[ur] *?(?:[^\|}]*\|)*|<ref *?name *?= *?\"?)(%s)(?:[^}\/]*}}|\"? \/>)' % re.escape(r.group('name').strip()))
+            linkscount += len(ruR.findall(text))
+    linkscount += len(re.findall(re.escape(weblink), text))
+    return linkscount
+
+
+class RefIndexTests(unittest.TestCase):
+
+    """RefIndex counts as the former regexes did."""
+
+    link = 'http://foo.pl/a'
+
+    # text, number of references to link
+    texts = [
+        ('<ref name="a">[%s Foo]</ref> <ref name="a" />', 2),
+        ('<ref name=a>[%s Foo]</ref> <ref name=a />', 2),
+        ('<ref group="uwagi" name="a">%s</ref> {{u|a}}', 1),
+        ("<ref name='a'>%s</ref> <ref name='a' />", 2),
+        ('<ref name="a">http://www.foo.pl/a/</ref> <ref name="a" />', 0),
+        ('<ref name="a">{{cytuj stronę | url = http://web.archive.org/web/'
+         '2019/%s | tytuł = Foo}}</ref>\n* [%s Foo] {{r|a|b}}', 3),
+        ('<ref name="a">%s0</ref> <ref name="a" />', 2),
+        ('<ref name="b">Foo</ref> %s <ref>Bar</ref> {{u|b}}', 2),
+        ('<ref name="b">Foo\n%s</ref> {{u|b}}', 1),
+        ('<ref>%s</ref> <ref name="c">%s</ref> {{u|c}}', 3),
+        ('<REF NAME="d">HTTP://FOO.PL/A</REF> <ref name="d" /> %s', 2),
+        ('<ref name=" e ">%s</ref> {{r| e }} {{r|e}}', 2),
+        ('%s', 1),
+        ('', 0),
+    ]
+
+    def test_counts(self):
+        """The counts are pinned and equal to the former ones."""
+        for text, count in self.texts:
+            text = text.replace('%s', self.link)
+            index = msdeadlinks.RefIndex(text)
+            self.assertEqual(former_refs_number(self.link, text), count,
+                             text)
+            self.assertEqual(index.count(self.link), count, text)
+
+    def test_several_links(self):
+        """One index gives the former counts of all links of a text."""
+        links = ['http://foo.pl/%i' % i for i in range(12)]
+        lines = []
+        for i, link in enumerate(links):
+            if i % 3 == 0:
+                lines.append('Foo.<ref name="r%i">[%s Foo]</ref>'
+                             % (i, link))
+            elif i % 3 == 1:
+                lines.append('Bar.<ref>%s</ref> {{u|r%i}}' % (link, i - 1))
+            else:
+                lines.append('* [%s Baz] <ref name="r%i" />' % (link, i - 2))
+        text = '\n'.join(lines)
+        index = msdeadlinks.RefIndex(text)
+        for link in links:
+            self.assertEqual(index.count(link),
+                             former_refs_number(link, text), link)
+
+
+if __name__ == '__main__':
+    unittest.main()
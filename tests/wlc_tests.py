@@ -0,0 +1,413 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Tests of wlc.py which need no network and no wiki.
+
+Call: python -m unittest discover -s tests -p '*_tests.py'
+"""
+from __future__ import absolute_import, unicode_literals
+
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import wlc  # noqa: E402
+
+
+class FakePage(object):
+
+    """Page with just a title."""
+
+    def __init__(self, title):
+        """Constructor."""
+        self._title = title
+
+    def title(self):
+        """Return the title."""
+        return self._title
+
+
+class FakeHistory(object):
+
+    """History which keeps the recorded links in lists."""
+
+    def __init__(self):
+        """Constructor."""
+        self.dead = []
+        self.alive = []
+
+    def setLinkDead(self, url, error, page, weblink_dead_days):
+        """Remember a dead link."""
+        self.dead.append((url, error, page.title()))
+
+    def setLinkAlive(self, url):
+        """Remember a link found alive."""
+        self.alive.append(url)
+        return False
+
+
+class FakeCache(object):
+
+    """URLCheckCache which only remembers what was put."""
+
+    def __init__(self):
+        """Constructor."""
+        self.cached = []
+
+    def get(self, url):
+        """Return no result."""
+        return None
+
+    def put(self, url, result):
+        """Remember url."""
+        self.cached.append(url)
+
+
+class InvalidURLTests(unittest.TestCase):
+
+    """Links which cannot even be parsed."""
+
+    url = 'http://[foo.pl/'
+
+    def test_submit(self):
+        """A bracketed host is recorded as invalid, not raised."""
+        history = FakeHistory()
+        engine = wlc.LinkCheckEngine(history, [], 7)
+        engine.submit(FakePage('Foo'), self.url)
+        self.assertEqual(history.dead, [
+            (self.url, 'Podany link nie jest prawidłowym adresem URL',
+             'Foo')])
+        self.assertEqual(engine.pending(), 0)
+        self.assertEqual(engine.inflight(), [])
+
+    def test_canonical_url(self):
+        """A URL which cannot be parsed is its own key."""
+        self.assertEqual(wlc.canonical_url(self.url + '#a'), self.url)
+
+
+class FakeResponse(object):
+
+    """Answer of comms.http.fetch."""
+
+    def __init__(self, status, data):
+        """Constructor."""
+        self.status = status
+        self.text = json.dumps(data)
+
+
+class WaybackTests(unittest.TestCase):
+
+    """The Wayback availability API asked without weblib."""
+
+    def setUp(self):
+        """Answer requests with self.response."""
+        self.fetch = wlc.comms.http.fetch
+        self.requested = []
+
+        def fetch(url, *args, **kwargs):
+            self.requested.append(url)
+            return self.response
+        wlc.comms.http.fetch = fetch
+
+    def tearDown(self):
+        """Restore comms.http.fetch."""
+        wlc.comms.http.fetch = self.fetch
+
+    def test_found(self):
+        """The closest snapshot is returned."""
+        self.response = FakeResponse(200, {'archived_snapshots': {'closest': {
+            'available': True, 'status': '200',
+            'url': 'http://web.archive.org/web/2019/http://foo.pl/a?b=c'}}})
+        self.assertEqual(wlc.get_wayback_url('http://foo.pl/a?b=c'),
+                         'http://web.archive.org/web/2019/http://foo.pl/a?b=c')
+        self.assertEqual(self.requested, [
+            'https://archive.org/wayback/available?url='
+            'http%3A%2F%2Ffoo.pl%2Fa%3Fb%3Dc'])
+
+    def test_not_found(self):
+        """No snapshot gives None."""
+        self.response = FakeResponse(200, {'archived_snapshots': {}})
+        self.assertIsNone(wlc.get_wayback_url('http://foo.pl/'))
+
+    def test_error(self):
+        """Another status than 200 raises."""
+        self.response = FakeResponse(503, {})
+        self.assertRaises(Exception, wlc.get_wayback_url, 'http://foo.pl/')
+
+
+class ArchiveLookupTests(unittest.TestCase):
+
+    """Archive lookup is disabled after failures in a row."""
+
+    def setUp(self):
+        """Make every lookup of the availability API fail."""
+        self.weblib = wlc.weblib
+        self.getWaybackURL = wlc.get_wayback_url
+        self.calls = []
+
+        def get_wayback_url(url):
+            self.calls.append(url)
+            raise requests.exceptions.ConnectionError()
+        wlc.weblib = ImportError('weblib')
+        wlc.get_wayback_url = get_wayback_url
+
+    def tearDown(self):
+        """Restore weblib and get_wayback_url."""
+        wlc.weblib = self.weblib
+        wlc.get_wayback_url = self.getWaybackURL
+
+    def test_failures(self):
+        """Failures are counted per lookup, by all its threads."""
+        archive = wlc.ArchiveLookup(workers=4)
+        for i in range(2 * archive.maxFailures):
+            archive.lookup('http://foo.pl/%i' % i, lambda archiveURL: None)
+        archive.executor.shutdown(wait=True)
+        # lookups already running when it is disabled still fail
+        calls = len(self.calls)
+        self.assertEqual(archive.failures, calls)
+        self.assertGreaterEqual(calls, archive.maxFailures)
+        self.assertLess(calls, archive.maxFailures + 4)
+        self.assertIsNone(archive.find('http://foo.pl/'))
+        self.assertEqual(len(self.calls), calls)
+        self.assertEqual(wlc.ArchiveLookup(workers=1).failures, 0)
+
+
+class HostBreakerTests(unittest.TestCase):
+
+    """Which failures make a host down."""
+
+    url = 'http://127.0.0.1:%i/a'
+
+    def setUp(self):
+        """Find a port nobody listens on."""
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.url = self.url % sock.getsockname()[1]
+        sock.close()
+
+    def failure(self, error):
+        """Return the failure for a check which raised error."""
+        return wlc.LinkCheckResult('dead', None, wlc.HostBreaker.message,
+                                   None, None, 0,
+                                   wlc.connection_failure(error))
+
+    def test_connection_failure(self):
+        """The cause is found in the exceptions wrapped by requests."""
+        try:
+            requests.get(self.url, timeout=5)
+        except Exception as e:
+            self.assertEqual(wlc.connection_failure(e), 'refused')
+        self.assertEqual(wlc.connection_failure(
+            requests.exceptions.ReadTimeout()), 'timeout')
+        self.assertEqual(wlc.connection_failure(
+            socket.gaierror(socket.EAI_AGAIN, 'again')), 'dns')
+        self.assertEqual(wlc.connection_failure(
+            socket.gaierror(socket.EAI_NONAME, 'no name')), 'unresolved')
+        self.assertIsNone(wlc.connection_failure(ValueError()))
+
+    def test_refused(self):
+        """Refused connections make the host down."""
+        breaker = wlc.HostBreaker(threshold=2)
+        refused = self.failure(ConnectionRefusedError(111, 'refused'))
+        self.assertEqual(refused.failure, 'refused')
+        breaker.record(self.url, refused)
+        self.assertFalse(breaker.down(self.url))
+        breaker.record(self.url, refused)
+        self.assertTrue(breaker.down(self.url))
+
+    def test_timeout(self):
+        """Timeouts do not make the host down."""
+        breaker = wlc.HostBreaker(threshold=2)
+        for i in range(3):
+            breaker.record(self.url, self.failure(
+                requests.exceptions.ConnectTimeout()))
+        self.assertFalse(breaker.down(self.url))
+
+    def test_not_loaded(self):
+        """URLs of a host that is down are recorded dead, not cached."""
+        history = FakeHistory()
+        breaker = wlc.HostBreaker(threshold=1)
+        breaker.record(self.url, self.failure(
+            ConnectionRefusedError(111, 'refused')))
+        engine = wlc.LinkCheckEngine(history, [], 7, breaker=breaker)
+        engine.cache = FakeCache()
+        recorded = []
+        engine.recorded = lambda page, url: recorded.append(url)
+        engine.submit(FakePage('Foo'), self.url)
+        engine.process(*engine.scheduler.get())
+        self.assertEqual(history.dead, [
+            (self.url, wlc.HostBreaker.message, 'Foo')])
+        self.assertEqual(engine.cache.cached, [])
+        self.assertEqual(recorded, [self.url])
+        self.assertEqual(engine.pending(), 0)
+
+
+class CheckpointTests(unittest.TestCase):
+
+    """Resuming at the checkpoint page."""
+
+    def setUp(self):
+        """Make a checkpoint without a file."""
+        self.checkpoint = wlc.Checkpoint.__new__(wlc.Checkpoint)
+        self.checkpoint.title = None
+        self.pages = [FakePage(title) for title in 'ABC']
+
+    def titles(self):
+        """Return the titles of the pages not skipped."""
+        return [page.title() for page in self.checkpoint.skip(self.pages)]
+
+    def test_skip(self):
+        """The pages after the checkpoint page are yielded."""
+        self.checkpoint.title = 'A'
+        self.assertEqual(self.titles(), ['B', 'C'])
+
+    def test_no_title(self):
+        """Without a checkpoint page all pages are yielded."""
+        self.assertEqual(self.titles(), ['A', 'B', 'C'])
+
+    def test_not_found(self):
+        """A checkpoint page which is not found gives a warning."""
+        warnings = []
+        warning = wlc.pywikibot.warning
+        wlc.pywikibot.warning = warnings.append
+        try:
+            self.checkpoint.title = 'D'
+            self.assertEqual(self.titles(), [])
+        finally:
+            wlc.pywikibot.warning = warning
+        self.assertEqual(len(warnings), 1)
+
+    def test_skip_first(self):
+        """A generator starting at the checkpoint page does not repeat it."""
+        self.checkpoint.title = 'A'
+        self.assertEqual([page.title() for page in self.checkpoint.skipFirst(
+            self.pages, lambda page: page.title())], ['B', 'C'])
+        self.checkpoint.title = 'B'
+        self.assertEqual([page.title() for page in self.checkpoint.skipFirst(
+            self.pages, lambda page: page.title())], ['A', 'B', 'C'])
+
+
+class DeadLinkStoreTests(unittest.TestCase):
+
+    """The SQLite history."""
+
+    def setUp(self):
+        """Make a temporary directory."""
+        self.tempDir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempDir, 'deadlinks.sqlite')
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        shutil.rmtree(self.tempDir)
+
+    def test_spellings(self):
+        """Every spelling of a URL is kept with its page."""
+        store = wlc.DeadLinkStore(self.filename)
+        store.append('http://foo.pl/a', ('A', 1.0, '404'))
+        store.append('HTTP://Foo.pl/a#b', ('B', 2.0, '404'))
+        store.append('http://foo.pl/a', ('B', 3.0, '404'))
+        self.assertEqual([url for url, entries in store.items()],
+                         ['http://foo.pl/a'])
+        self.assertEqual(store.spellings('http://foo.pl/a'), [
+            ('A', 'http://foo.pl/a'), ('B', 'HTTP://Foo.pl/a#b'),
+            ('B', 'http://foo.pl/a')])
+        store.close()
+
+    def test_items(self):
+        """items() reads in batches and holds no transaction open."""
+        store = wlc.DeadLinkStore(self.filename)
+        store.batchSize = 2
+        for i in range(5):
+            store.append('http://foo.pl/%i' % i, ('A', float(i), '404'))
+            store.append('http://foo.pl/%i#b' % i, ('B', float(i), '410'))
+        items = []
+        for url, entries in store.items():
+            self.assertFalse(store.db.in_transaction)
+            store.append('http://bar.pl/%s' % url, ('C', 0.0, '404'))
+            items.append((url, entries))
+        self.assertEqual([(url, entries) for url, entries in items
+                          if url.startswith('http://foo.pl/')],
+                         [('http://foo.pl/%i' % i, [('A', float(i), '404'),
+                                                    ('B', float(i), '410')])
+                          for i in range(5)])
+        store.close()
+
+    def test_readonly(self):
+        """A readonly store is neither created nor changed."""
+        self.assertRaises(IOError, wlc.DeadLinkStore, self.filename,
+                          readonly=True)
+        self.assertFalse(os.path.exists(self.filename))
+        store = wlc.DeadLinkStore(self.filename)
+        store.append('http://foo.pl/a', ('A', 1.0, '404'))
+        store.close()
+        store = wlc.DeadLinkStore(self.filename, readonly=True)
+        self.assertEqual(store['http://foo.pl/a'], [('A', 1.0, '404')])
+        self.assertRaises(Exception, store.append, 'http://foo.pl/b',
+                          ('A', 2.0, '404'))
+        store.close()
+
+
+class FakeSite(object):
+
+    """Site with a family name and a code."""
+
+    class family(object):
+
+        """Family with a name."""
+
+        name = 'wikipedia'
+
+    code = 'pl'
+
+
+class JobQueueTests(unittest.TestCase):
+
+    """Jobs shared by a coordinator and workers."""
+
+    def setUp(self):
+        """Open a job queue in a temporary directory."""
+        self.baseDir = wlc.config.base_dir
+        wlc.config.base_dir = tempfile.mkdtemp()
+        self.jobs = wlc.JobQueue(FakeSite())
+
+    def tearDown(self):
+        """Remove the job queue."""
+        self.jobs.close()
+        shutil.rmtree(wlc.config.base_dir)
+        wlc.config.base_dir = self.baseDir
+
+    def test_coordinator_lease(self):
+        """A coordinator which stopped renewing its lease is dead."""
+        self.jobs.setEnumerating(True)
+        self.assertFalse(self.jobs.finished())
+        self.jobs.db.execute('UPDATE state SET value = ?',
+                             (time.time() - 1, ))
+        self.assertTrue(self.jobs.finished())
+
+    def test_release(self):
+        """Released jobs are claimed again until they are given up."""
+        self.jobs.add([('Foo', 'http://foo.pl/')])
+        for attempt in range(self.jobs.maxAttempts):
+            claimed = self.jobs.claim('worker', 10, 600)
+            self.assertEqual([job[1:] for job in claimed],
+                             [('Foo', 'http://foo.pl/')])
+            self.assertEqual(self.jobs.claim('other', 10, 600), [])
+            self.jobs.release([job[0] for job in claimed])
+        self.assertEqual(self.jobs.claim('worker', 10, 600), [])
+        self.assertEqual(self.jobs.failed(), 1)
+        self.jobs.setEnumerating(False)
+        self.assertTrue(self.jobs.finished())
+
+
+if __name__ == '__main__':
+    unittest.main()
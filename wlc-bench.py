@@ -0,0 +1,767 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks for wlc.py.
+
+Call: python pwb.py masti/wlc-bench.py -ignorelist -urls:urls.txt
+
+The following parameters are supported:
+
+-ignorelist       Compare IgnoreListMatcher with matching every ignorelist
+                  regex in turn. Both must give the same answers.
+
+-urls:            File with one URL per line used as the corpus, e.g. URLs
+                  cut from a results-wikipedia-pl.txt file. Without it a
+                  synthetic corpus is built from the ignorelist domains and
+                  common domains linked from plwiki.
+
+-count:           Number of URLs in the synthetic corpus; default 20000
+
+-extract          Compare weblinksIn with the former template-rewriting
+                  implementation on wikitext.
+
+-textfile:        File with the wikitext of a page for -extract, e.g. one of
+                  the biggest list articles. Can be used several times.
+                  Without it a synthetic list article is used.
+
+-rows:            Number of table rows of the synthetic list article;
+                  default 2000
+
+-web              Run WeblinkCheckerRobot on synthetic pages whose links
+                  point to a fake web server started on 127.0.0.1, and
+                  compare the links it finds dead with the expected ones.
+                  The server simulates slow hosts, redirect chains, 404,
+                  410, 429 with Retry-After, timeouts and huge bodies; some
+                  links go to hosts in a top-level domain which does not
+                  exist or to a port where connections are refused.
+                  No network is used and the history is kept in a
+                  temporary directory.
+
+-pages:           Number of synthetic pages for -web; default 200
+
+-links:           Number of links per page for -web; default 10
+
+-engine:          Check engine for -web, as for wlc.py; default thread
+
+-method:          Request method for -web, as for wlc.py; default get
+
+-perhost:         Checks per host at once for -web; default 4
+
+-fixed            Do not adapt the number of checks at once for -web, as
+                  for wlc.py
+
+-breaker:         Failures after which a host is down for -web, as for
+                  wlc.py; 0 disables the breaker; default 3
+
+-timeout:         Read timeout in seconds for -web; the server hangs longer
+                  on timeout links; default 3
+
+-verbose          Show the output of the bot during -web
+
+-history          Compare the memory taken by the dead link history as a
+                  dictionary of lists of tuples, as former versions kept it,
+                  and as the History of wlc.py, whose entries stay in its
+                  SQLite file; every URL is looked up in both and they must
+                  give the same entries. Give a history file, e.g.
+                  -history:deadlinks/deadlinks-wikipedia-pl.sqlite or a .dat
+                  file; it is copied first and left alone. Without a file a
+                  synthetic history is used.
+
+-entries:         Number of entries of the synthetic history; default 200000
+"""
+#
+# (C) Pywikibot team, 2006-2020
+#
+# Distributed under the terms of the MIT license.
+#
+from __future__ import absolute_import, unicode_literals
+
+import codecs
+import gc
+import multiprocessing
+import os
+import pickle
+import random
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import pywikibot
+
+from pywikibot import config, textlib
+
+import wlc
+
+if sys.version_info[0] > 2:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+else:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# domains often linked from plwiki which are not on the ignorelist
+common_domains = [
+    'stat.gov.pl', 'www.sports-reference.com', 'www.bbc.co.uk',
+    'wyborcza.pl', 'www.rp.pl', 'isap.sejm.gov.pl', 'www.imdb.com',
+    'www.nytimes.com', 'teryt.stat.gov.pl', 'www.worldfootball.net',
+]
+
+
+def synthetic_urls(count):
+    """Build a corpus of URLs; roughly one in five is on the ignorelist."""
+    random.seed(count)
+    ignored = []
+    for regex in wlc.ignorelist:
+        domain = re.sub(r'^\\?\.\*\[\\\./@\]', '', regex.pattern)
+        ignored.append(domain.replace('(/.*)?', '').replace('\\', ''))
+    urls = []
+    for i in range(count):
+        if random.random() < 0.2:
+            domain = random.choice(ignored)
+        else:
+            domain = random.choice(common_domains)
+        urls.append('%s://%s/%s' % (
+            random.choice(('http', 'https')), domain,
+            random.choice(('', 'index.html', 'artykul/%i.html' % i,
+                           'search?q=%i&lang=pl' % i))))
+    return urls
+
+
+def bench_ignorelist(urls):
+    """Time both ways of matching the ignorelist on urls."""
+    start = time.time()
+    matcher = wlc.IgnoreListMatcher(wlc.ignorelist)
+    pywikibot.output('IgnoreListMatcher built from %i patterns in %.3f s'
+                     % (matcher.size, time.time() - start))
+
+    start = time.time()
+    expected = [any(ignoreR.match(url) for ignoreR in wlc.ignorelist)
+                for url in urls]
+    loopTime = time.time() - start
+
+    start = time.time()
+    result = [matcher.match(url) for url in urls]
+    matcherTime = time.time() - start
+
+    mismatches = [url for url, old, new in zip(urls, expected, result)
+                  if old != new]
+    pywikibot.output('%i URLs, %i ignored' % (len(urls), sum(expected)))
+    pywikibot.output('regex loop:        %8.3f s (%8.1f URLs/s)'
+                     % (loopTime, len(urls) / loopTime))
+    pywikibot.output('IgnoreListMatcher: %8.3f s (%8.1f URLs/s)'
+                     % (matcherTime, len(urls) / matcherTime))
+    pywikibot.output('speedup: %.1fx' % (loopTime / matcherTime))
+    for url in mismatches:
+        pywikibot.error('Different answer for %s' % url)
+    return not mismatches
+
+
+def synthetic_list_article(rows):
+    """Build wikitext of a list article with a cited table row per entry."""
+    lines = ['{| class="wikitable sortable"', '! Nazwa !! Data !! Przypisy']
+    for i in range(rows):
+        domain = common_domains[i % len(common_domains)]
+        cite = ('{{Cytuj stronę |url=http://%s/wyniki/%i.html '
+                '|tytuł=Wyniki {{lang|en|%i}} |data={{dts|2019|%i|1}}'
+                % (domain, i, i, i % 12 + 1))
+        if i % 4 == 0:
+            cite += (' |archiwum=https://web.archive.org/web/2019/'
+                     'http://%s/wyniki/%i.html' % (domain, i))
+        lines.append('|-\n| [[Miejscowość %i|%i]] || {{dts|2020|1|%i}} '
+                     '|| <ref>%s}}</ref> [http://%s/%i opis]'
+                     % (i, i, i % 28 + 1, cite, domain, i))
+    lines.append('|}')
+    return '\n'.join(lines)
+
+
+def former_weblinksIn(text):
+    """Yield web links from text as weblinksIn did before the scanner."""
+    text = textlib.removeDisabledParts(text)
+    text = re.sub(r'{{\s?fullurl:.[^}]*}}', '', text)
+    nestedTemplateR = re.compile(r'{{([^}]*?){{(.*?)}}(.*?)}}')
+    while nestedTemplateR.search(text):
+        text = nestedTemplateR.sub(r'{{\1 \2 \3}}', text)
+    templateWithParamsR = re.compile(r'{{([^}]*?[^ ])\|([^ ][^}]*?)}}',
+                                     re.DOTALL)
+    while templateWithParamsR.search(text):
+        text = templateWithParamsR.sub(r'{{ \1 | \2 }}', text)
+    text = text.replace('}}', ' }}')
+    text = textlib.removeDisabledParts(text)
+    linkR = re.compile(r'(?m)(?P<url>http[s]?:(\/\/[^\s\?]+?)'
+                       r'(\??[^\s<\|\}\]]*))(?:[\]\s\.<\|\}])')
+    for m in linkR.finditer(text):
+        if not wlc.citeArchivedLink(m.group('url'), text):
+            yield m.group('url')
+
+
+def bench_extract(texts):
+    """Time the former and the current weblinksIn on texts."""
+    output = pywikibot.output
+    success = True
+    for name, text in texts:
+        # both implementations log every skipped archived link
+        pywikibot.output = lambda *args, **kwargs: None
+        try:
+            start = time.time()
+            expected = list(former_weblinksIn(text))
+            formerTime = time.time() - start
+            start = time.time()
+            result = list(wlc.weblinksIn(text))
+            scannerTime = time.time() - start
+        finally:
+            pywikibot.output = output
+        pywikibot.output('%s: %i characters, %i links' % (name, len(text),
+                                                           len(result)))
+        pywikibot.output('former weblinksIn: %8.3f s' % formerTime)
+        pywikibot.output('weblinksIn:        %8.3f s' % scannerTime)
+        pywikibot.output('speedup: %.1fx' % (formerTime / scannerTime))
+        if expected != result:
+            success = False
+            pywikibot.output('Different links:\n  only former: %s\n'
+                             '  only current: %s'
+                             % (sorted(set(expected) - set(result)),
+                                sorted(set(result) - set(expected))))
+    return success
+
+
+class FakeWebHandler(BaseHTTPRequestHandler):
+
+    """
+    Answer requests as told by the path.
+
+    /ok/<n>              200
+    /status/<code>/<n>   the given status
+    /redirect/<hops>/<n> a redirect chain of hops redirects ending at /ok/<n>
+    /busy/<n>            429 with Retry-After: 1 to the first HEAD and the
+                         first GET, then 200
+    /timeout/<n>         hangs longer than the read timeout, then 200
+    /huge/<n>            200 with a body of server.hugeSize bytes
+
+    Every answer is delayed by server.delay seconds.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        """Do not log requests."""
+
+    def do_HEAD(self):
+        """Answer a HEAD request."""
+        self.answer(False)
+
+    def do_GET(self):
+        """Answer a GET request."""
+        self.answer(True)
+
+    def answer(self, withBody):
+        """Send the answer for self.path."""
+        kind, sep, rest = self.path.lstrip('/').partition('/')
+        time.sleep(self.server.delay)
+        if kind == 'status':
+            self.reply(int(rest.split('/')[0]), withBody)
+        elif kind == 'redirect':
+            hops, sep, name = rest.partition('/')
+            if int(hops) > 1:
+                location = '/redirect/%i/%s' % (int(hops) - 1, name)
+            else:
+                location = '/ok/' + name
+            self.reply(302, withBody, [('Location', location)])
+        elif kind == 'busy':
+            with self.server.lock:
+                first = (self.command, rest) not in self.server.busySeen
+                self.server.busySeen.add((self.command, rest))
+            if first:
+                self.reply(429, withBody, [('Retry-After', '1')])
+            else:
+                self.reply(200, withBody)
+        elif kind == 'timeout':
+            time.sleep(self.server.hang)
+            self.reply(200, withBody)
+        elif kind == 'huge':
+            self.reply(200, withBody, length=self.server.hugeSize)
+        else:
+            self.reply(200, withBody)
+
+    def reply(self, status, withBody, headers=(), length=None):
+        """Send status, headers and a body of length bytes."""
+        body = b'<html><body>fake</body></html>'
+        if length is None:
+            length = len(body)
+        try:
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(length))
+            self.end_headers()
+            if withBody:
+                chunk = body if length == len(body) else b'x' * 65536
+                while length > 0:
+                    self.wfile.write(chunk[:length])
+                    length -= len(chunk)
+        except socket.error:
+            # the checker closed the connection without reading the body
+            self.close_connection = True
+
+
+class FakeWebServer(ThreadingMixIn, HTTPServer):
+
+    """A host of the fake web."""
+
+    daemon_threads = True
+
+    def __init__(self, delay=0, hang=10, hugeSize=8 << 20):
+        """Constructor."""
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeWebHandler)
+        self.delay = delay
+        self.hang = hang
+        self.hugeSize = hugeSize
+        self.lock = threading.Lock()
+        self.busySeen = set()
+
+
+def serve_fake_web(conn, delays, hang):
+    """Run a FakeWebServer for each delay until conn gets a message."""
+    servers = [FakeWebServer(delay, hang) for delay in delays]
+    for server in servers:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+    conn.send([server.server_address[1] for server in servers])
+    conn.recv()
+
+
+class FakeWeb(object):
+
+    """
+    Hosts of the fake web served by a separate process.
+
+    The servers do not run in the benchmarked process, so they do not add
+    to its threads and memory.
+    """
+
+    # kind of link -> (weight, expected to be dead)
+    kinds = {
+        'ok': (60, False),
+        'redirect': (10, False),
+        'slow': (5, False),
+        'busy': (2, False),
+        'huge': (2, False),
+        '404': (8, True),
+        '410': (3, True),
+        'timeout': (3, True),
+        'chain': (2, True),
+        'unresolvable': (5, True),
+        'refused': (3, True),
+    }
+
+    def __init__(self, hosts=4, slowDelay=0.5, hang=10):
+        """Start the servers: hosts fast ones, a slow and a hanging one."""
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=serve_fake_web, args=(child, [0] * hosts + [slowDelay, 0],
+                                         hang))
+        self.process.daemon = True
+        self.process.start()
+        ports = ['127.0.0.1:%i' % port for port in self.conn.recv()]
+        self.fastHosts = ports[:hosts]
+        self.slowHost = ports[hosts]
+        self.brokenHost = ports[hosts + 1]
+        # a port nobody listens on
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.refusedHost = '127.0.0.1:%i' % sock.getsockname()[1]
+        sock.close()
+
+    def url(self, kind, n):
+        """Return the URL of the n-th link of kind."""
+        fast = 'http://%s' % self.fastHosts[n % len(self.fastHosts)]
+        if kind == 'redirect':
+            return '%s/redirect/%i/%i' % (fast, n % 5 + 1, n)
+        if kind in ('404', '410'):
+            return '%s/status/%s/%i' % (fast, kind, n)
+        if kind in ('busy', 'huge'):
+            return '%s/%s/%i' % (fast, kind, n)
+        if kind == 'slow':
+            return 'http://%s/ok/%i' % (self.slowHost, n)
+        if kind == 'timeout':
+            return 'http://%s/timeout/%i' % (self.brokenHost, n)
+        if kind == 'chain':
+            # more redirects than requests follows
+            return 'http://%s/redirect/40/%i' % (self.brokenHost, n)
+        if kind == 'unresolvable':
+            # .invalid would be on the ignorelist
+            return 'http://host%i.wlcbench/ok/%i' % (n, n)
+        if kind == 'refused':
+            return 'http://%s/ok/%i' % (self.refusedHost, n)
+        return '%s/ok/%i' % (fast, n)
+
+    def pages(self, site, count, links):
+        """
+        Build count pages with links links each.
+
+        @return: the pages and a dict of URL: expected to be dead
+        @rtype: tuple of (list of SyntheticPage, dict)
+        """
+        random.seed(count * links)
+        kinds = [kind for kind in sorted(self.kinds)
+                 for i in range(self.kinds[kind][0])]
+        pages = []
+        expected = {}
+        for i in range(count):
+            lines = ['Strona testowa %i.' % i]
+            for j in range(links):
+                kind = random.choice(kinds)
+                url = self.url(kind, len(expected))
+                expected[url] = self.kinds[kind][1]
+                lines.append('* [%s opis %s]' % (url, kind))
+            pages.append(SyntheticPage(site, 'Strona %i' % i,
+                                       '\n'.join(lines)))
+        return pages, expected
+
+    def stop(self):
+        """Stop the servers."""
+        self.conn.send(None)
+        self.process.join(5)
+
+
+class SyntheticPage(object):
+
+    """A page which is not on the wiki, with the text given."""
+
+    def __init__(self, site, title, text):
+        """Constructor."""
+        self.site = site
+        self._title = title
+        self.text = text
+
+    def title(self, asLink=False, **kwargs):
+        """Return the title of the page."""
+        return '[[%s]]' % self._title if asLink else self._title
+
+    def get(self, *args, **kwargs):
+        """Return the text of the page."""
+        return self.text
+
+    def exists(self):
+        """Return True."""
+        return True
+
+    def isRedirectPage(self):
+        """Return False."""
+        return False
+
+    def isTalkPage(self):
+        """Return False."""
+        return False
+
+
+class Sampler(threading.Thread):
+
+    """Record the peak number of threads and asyncio tasks of a run."""
+
+    def __init__(self, engine, interval=0.05):
+        """Constructor."""
+        super(Sampler, self).__init__(name='Sampler')
+        self.daemon = True
+        self.engine = engine
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.threads = 0
+        self.tasks = 0
+
+    def run(self):
+        """Sample until stopped."""
+        loop = getattr(self.engine, 'loop', None)
+        while not self.stopped.wait(self.interval):
+            # without this sampler
+            self.threads = max(self.threads, threading.active_count() - 1)
+            if loop:
+                try:
+                    self.tasks = max(self.tasks,
+                                     len(wlc.asyncio.all_tasks(loop)))
+                except RuntimeError:
+                    # the set of tasks changed while it was read
+                    pass
+
+    def stop(self):
+        """Stop sampling."""
+        self.stopped.set()
+        self.join()
+
+
+def peak_memory():
+    """Return the peak resident memory of this process in MB, or None."""
+    if resource is None:
+        return None
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def bench_web(options):
+    """Check the links of synthetic pages against the fake web."""
+    timeout = float(options.get('timeout', 3))
+    web = FakeWeb(hang=timeout + 5)
+    site = pywikibot.Site()
+    pages, expected = web.pages(site, int(options.get('pages', 200)),
+                                int(options.get('links', 10)))
+    pywikibot.output('%i pages with %i links, %i expected dead'
+                     % (len(pages), len(expected), sum(expected.values())))
+
+    baseDir = config.base_dir
+    socketTimeout = config.socket_timeout
+    reportOnTalk = config.report_dead_links_on_talk
+    tempDir = tempfile.mkdtemp()
+    config.base_dir = tempDir
+    config.socket_timeout = (timeout, timeout)
+    config.report_dead_links_on_talk = False
+    output = pywikibot.output
+    threshold = int(options.get('breaker', 3))
+    memoryBefore = peak_memory()
+    try:
+        bot = wlc.WeblinkCheckerRobot(
+            iter(pages), engine=options.get('engine', 'thread'),
+            maxPerHost=int(options.get('perhost', 4)),
+            method=options.get('method', 'get'),
+            breaker=wlc.HostBreaker(threshold) if threshold else None,
+            adaptive=not options.get('fixed'))
+        # timeouts are retried once; do not wait half a minute for that
+        bot.engine.scheduler.backoff = 1
+        sampler = Sampler(bot.engine)
+        sampler.start()
+        if not options.get('verbose'):
+            pywikibot.output = lambda *args, **kwargs: None
+        start = time.time()
+        try:
+            bot.run()
+            while bot.engine.pending():
+                time.sleep(0.05)
+        finally:
+            elapsed = time.time() - start
+            pywikibot.output = output
+            sampler.stop()
+            bot.engine.shutdown()
+        dead = set(url for url in expected if url in bot.history.historyDict)
+        bot.history.historyDict.close()
+        breaker = bot.engine.breaker
+        notLoaded = sum(breaker.skipped.values()) if breaker else 0
+    finally:
+        pywikibot.output = output
+        config.base_dir = baseDir
+        config.socket_timeout = socketTimeout
+        config.report_dead_links_on_talk = reportOnTalk
+        shutil.rmtree(tempDir, ignore_errors=True)
+        web.stop()
+
+    pywikibot.output('%i URLs in %.1f s: %.1f URLs/s'
+                     % (len(expected), elapsed, len(expected) / elapsed))
+    pywikibot.output('peak threads: %i' % sampler.threads)
+    if getattr(bot.engine, 'loop', None):
+        pywikibot.output('peak asyncio tasks: %i' % sampler.tasks)
+    if memoryBefore is not None:
+        pywikibot.output('peak memory: %.1f MB (%.1f MB before the run)'
+                         % (peak_memory(), memoryBefore))
+    falseDead = sorted(url for url in dead if not expected[url])
+    falseAlive = sorted(url for url, isDead in expected.items()
+                        if isDead and url not in dead)
+    pywikibot.output('verdicts: %i dead, %i wrongly dead, %i wrongly alive, '
+                     '%i not loaded' % (len(dead), len(falseDead),
+                                        len(falseAlive), notLoaded))
+    for url in falseDead:
+        pywikibot.error('Found dead, expected alive: %s' % url)
+    for url in falseAlive:
+        pywikibot.error('Found alive, expected dead: %s' % url)
+    return not (falseDead or falseAlive)
+
+
+def synthetic_history(store, count):
+    """Fill store with count entries spread like those of plwiki."""
+    random.seed(count)
+    titles = ['Artykuł %i' % i for i in range(max(1, count // 5))]
+    errors = ['404', '410', '403', 'Exception while connecting.',
+              'Podany link nie jest prawidłowym adresem URL']
+    start = time.time() - 365 * 24 * 60 * 60
+    with store.lock:
+        for i in range(count // 2):
+            url = 'http://%s/artykul/%i.html' % (
+                random.choice(common_domains), i)
+            # most dead links are found a few times on one or two pages
+            pages = random.sample(titles, min(len(titles),
+                                              random.choice((1, 1, 2))))
+            store._insert(url, [(random.choice(pages),
+                                 start + random.random() * 3e7,
+                                 random.choice(errors))
+                                for j in range(random.choice((1, 2, 3)))])
+        store.db.commit()
+
+
+def traced_memory(build):
+    """
+    Call build and return its result and the memory it took.
+
+    @rtype: tuple of (object, int)
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_history(filename, count):
+    """Compare the memory of the history as dictionary and as History."""
+    if tracemalloc is None:
+        pywikibot.error('tracemalloc is needed to measure memory')
+        return False
+    site = pywikibot.Site()
+    baseDir = config.base_dir
+    tempDir = tempfile.mkdtemp()
+    config.base_dir = tempDir
+    try:
+        # where History opens the store of site
+        dbfilename = config.datafilepath(
+            'deadlinks', 'deadlinks-%s-%s.sqlite' % (site.family.name,
+                                                     site.code))
+        store = wlc.DeadLinkStore(dbfilename)
+        if not filename:
+            synthetic_history(store, count)
+            name = 'synthetic history'
+        elif filename.endswith('.dat'):
+            copy = os.path.join(tempDir, 'history.dat')
+            shutil.copy(filename, copy)
+            store.migrate(copy)
+            name = filename
+        else:
+            store.close()
+            shutil.copy(filename, dbfilename)
+            store = wlc.DeadLinkStore(dbfilename)
+            name = filename
+
+        start = time.time()
+        if filename and filename.endswith('.dat'):
+            with open(filename, 'rb') as datfile:
+                historyDict, dictMemory = traced_memory(
+                    lambda: pickle.load(datfile))
+        else:
+            historyDict, dictMemory = traced_memory(
+                lambda: dict((url, [tuple(entry) for entry in entries])
+                             for url, entries in store.items()))
+        dictTime = time.time() - start
+        store.close()
+
+        start = time.time()
+        history, historyMemory = traced_memory(
+            lambda: wlc.History(None, site=site))
+        historyTime = time.time() - start
+
+        expected = {}
+        for url, entries in historyDict.items():
+            expected.setdefault(wlc.canonical_url(url), []).extend(
+                tuple(entry) for entry in entries)
+        # the bot looks the URLs up one at a time
+        start = time.time()
+        mismatches = [key for key, entries in expected.items()
+                      if sorted(entries) != sorted(
+                          tuple(entry) for entry
+                          in history.historyDict.get(key, []))]
+        lookupTime = time.time() - start
+        urlCount = len(history.historyDict)
+        titleCount = len(history.historyDict.titles())
+        history.historyDict.close()
+        fileSize = os.path.getsize(dbfilename)
+    finally:
+        config.base_dir = baseDir
+        shutil.rmtree(tempDir, ignore_errors=True)
+
+    entryCount = sum(len(entries) for entries in expected.values())
+    pywikibot.output('%s: %i URLs, %i entries, %i titles'
+                     % (name, urlCount, entryCount, titleCount))
+    pywikibot.output('dictionary of tuples: %8.1f MB, loaded in %6.2f s'
+                     % (dictMemory / 1048576.0, dictTime))
+    pywikibot.output('History:              %8.1f MB, opened in %6.2f s; '
+                     '%.1f MB on disk'
+                     % (historyMemory / 1048576.0, historyTime,
+                        fileSize / 1048576.0))
+    pywikibot.output('%i URLs looked up in %.2f s'
+                     % (len(expected), lookupTime))
+    pywikibot.output('%.1fx less memory' % (float(dictMemory)
+                                            / max(historyMemory, 1)))
+    if urlCount != len(expected):
+        pywikibot.error('%i URLs in History, %i in the dictionary'
+                        % (urlCount, len(expected)))
+    for url in mismatches:
+        pywikibot.error('Different entries for %s' % url)
+    return not mismatches and urlCount == len(expected)
+
+
+def main(*args):
+    """
+    Process command line arguments and run the benchmarks.
+
+    If args is an empty list, sys.argv is used.
+
+    @param args: command line arguments
+    @type args: list of unicode
+    """
+    options = {}
+    textfiles = []
+    for arg in pywikibot.handle_args(args):
+        arg, sep, value = arg.partition(':')
+        if arg == '-textfile':
+            textfiles.append(value)
+        else:
+            options[arg[1:]] = value or True
+
+    success = True
+    if options.get('ignorelist'):
+        if options.get('urls'):
+            with codecs.open(options['urls'], 'r', 'utf-8') as f:
+                urls = [line.strip() for line in f if line.strip()]
+        else:
+            urls = synthetic_urls(int(options.get('count', 20000)))
+        success = bench_ignorelist(urls) and success
+
+    if options.get('extract'):
+        texts = []
+        for filename in textfiles:
+            with codecs.open(filename, 'r', 'utf-8') as f:
+                texts.append((filename, f.read()))
+        if not texts:
+            rows = int(options.get('rows', 2000))
+            texts.append(('synthetic list of %i rows' % rows,
+                          synthetic_list_article(rows)))
+        success = bench_extract(texts) and success
+
+    if options.get('web'):
+        success = bench_web(options) and success
+
+    if options.get('history'):
+        success = bench_history(
+            options['history'] if options['history'] is not True else None,
+            int(options.get('entries', 200000))) and success
+
+    if not (options.get('ignorelist') or options.get('extract')
+            or options.get('web') or options.get('history')):
+        pywikibot.bot.suggest_help(additional_text='No benchmark selected.')
+        return False
+    return success
+
+
+if __name__ == '__main__':
+    main()
@@ -7,17 +7,23 @@ masti's personalized version for polish projects
 
 Call: python pwb.py masti/wlc.py -ignore:401 -ignore:403 -ignore:451 -ignore:500 -ignore:503 -ignore:429 -talk -pt:0 -talk -start:'!'
 
-It checks several pages at once, with a limit set by the config variable
-max_external_links, which defaults to 50.
+It checks several pages at once. How many is adapted during the run: the
+number grows while the checks go well and is halved when connection
+failures or slow answers show that the network is congested. It never
+exceeds the config variable max_external_links, which defaults to 50.
 
 The bot won't change any wiki pages, it will only report dead links such that
 people can fix or remove the links themselves.
 
-The bot will store all links found dead in a .dat file in the deadlinks
-subdirectory. To avoid the removing of links which are only temporarily
-unavailable, the bot ONLY reports links which were reported dead at least
-two times, with a time lag of at least one week. Such links will be logged to a
-.txt file in the deadlinks subdirectory.
+The bot will store all links found dead in a .sqlite file in the deadlinks
+subdirectory; a .dat file written by former versions is migrated to it.
+To avoid the removing of links which are only temporarily unavailable, the
+bot ONLY reports links which were reported dead at least two times, with a
+time lag of at least one week. Such links will be logged to a
+.txt file in the deadlinks subdirectory, together with an archived copy if
+the Internet Archive or WebCite has one. These lookups run in the
+background; their results are kept in deadlinks/archivecache.sqlite, and
+that no copy was found is remembered for a week.
 
 The .txt file uses wiki markup and so it may be useful to post it on the
 wiki and then exclude that page from subsequent runs. For example if the
@@ -32,7 +38,7 @@ feature, set report_dead_links_on_talk = True in your user-config.py, or
 specify "-talk" on the command line. Adding "-notalk" switches this off
 irrespective of the configuration variable.
 
-When a link is found alive, it will be removed from the .dat file.
+When a link is found alive, it will be removed from the .sqlite file.
 
 These command line parameters can be used to specify which pages to work on:
 
@@ -43,6 +49,25 @@ These command line parameters can be used to specify which pages to work on:
              least one week), which is required before the script will report
              the problem.
 
+-repeaturls  Check again only the URLs found dead before, not all links of
+             their pages. A page is loaded only to make sure a link that is
+             due to be reported is still there.
+
+-extlinks    Take the links of the pages from the API (prop=extlinks, 50
+             pages per request) instead of loading and scanning their
+             text. Only pages linking to a web archive are loaded, to
+             leave out the links of archived citations.
+
+-rcfollow    Check the links of changed pages as long as the bot runs. Every
+             minute the recent changes are read through the API and the
+             external links of the changed pages are compared with the
+             ones seen before; added links are checked, and so are links
+             whose cached result is out of date (see -cachealive). The
+             links seen and the last change read are kept in
+             deadlinks/extlinks-<family>-<lang>.sqlite, so a new run
+             goes on where the last one stopped. Only the main namespace
+             is followed unless -namespace is given.
+
 -namespace   Only process templates in the namespace with the given number or
              name. This parameter may be used multiple times.
 
@@ -51,11 +76,27 @@ These command line parameters can be used to specify which pages to work on:
 
 -xmlstart    Page to start with when using an XML dump
 
+-xmlprocs    Number of processes extracting the links of the XML dump,
+             e.g. -xmlprocs:8. A .bz2 dump must be a multistream dump; its
+             -index.txt.bz2 file is used if it lies next to it. The links
+             are checked as they are in the dump, without loading the
+             pages from the wiki again. Pages/s of every process are
+             logged every minute.
+
 -ignore      HTTP return codes to ignore. Can be provided several times :
                 -ignore:401 -ignore:500
 
 Furthermore, the following command line parameters are supported:
 
+-resume      Continue a run that was interrupted or crashed. Use the same
+             parameters again and add -resume. Every minute the last
+             page done and the URLs still being checked are saved to
+             deadlinks/checkpoint-<family>-<lang>.json, together with the
+             history. -start: and -xmlstart are moved to that page, which
+             is not checked again; any other generator is read again up
+             to it, without checking its pages. The unfinished URLs are
+             checked first.
+
 -talk        Overrides the report_dead_links_on_talk config variable, enabling
              the feature.
 
@@ -65,15 +106,69 @@ Furthermore, the following command line parameters are supported:
 -day         Do not report broken link if the link is there only since
              x days or less. If not set, the default is 7 days.
 
+-engine      How links are checked. 'thread' (default) starts a new thread
+             for every URL, 'async' feeds the URLs to a fixed set of
+             max_external_links workers in an asyncio event loop:
+                -engine:async
+
+-fixed       Always check max_external_links URLs at once instead of
+             adapting the number to the network.
+
+-perhost     Maximum number of URLs of one host checked at the same time.
+             Default is 4. URLs answered with 429 or 503 are checked again
+             later, honouring Retry-After, instead of being reported; so
+             there is no need to -ignore these codes any more.
+
+-method      How a URL is loaded. 'get' (default) downloads the page,
+             'head' only asks for the headers: HEAD first and, if that does
+             not give 200, a GET whose body is not read. Hosts which answer
+             such a GET differently from HEAD get the GET straight away for
+             the rest of the run:
+                -method:head
+
+-breaker     Number of refused connections in a row after which a host is
+             taken as down, default 3; -breaker:0 switches this off. URLs
+             of a host that is down, or whose name does not exist, are
+             not loaded for -cooloff minutes (default 10); they are
+             recorded dead, but not cached. Timeouts do not make a host
+             down; such URLs are loaded once more after a backoff.
+
+-coordinator Do not check the links, but put them into a job table in
+             deadlinks/jobs-<family>-<lang>.sqlite for -worker processes.
+             Any page source can be used, e.g. -start:! or -xml.
+
+-worker      Check the links put into the job table by -coordinator. Start
+             as many workers as there are cores, together with the
+             coordinator or later; all of them write to the same history.
+             A worker claims a batch of links for ten minutes and renews
+             the claim while it works on them, so the links of a worker
+             that died are taken over by the others; a link whose check
+             failed three times is given up. A worker stops when the
+             coordinator has finished, or has not been heard of for five
+             minutes, and the table is empty.
+
+-metrics     File to write metrics to every minute in the Prometheus text
+             format, e.g. -metrics:/var/lib/node_exporter/wlc.prom: URLs
+             and pages per second, check latency histograms overall and
+             for the 20 busiest hosts, counts of status codes, checks
+             running, URLs queued, bytes received and time spent waiting
+             for the history lock. At the end a JSON summary is written
+             to the same name with .json as extension.
+
+-nocache     Check every URL again. Otherwise results are kept in
+             deadlinks/urlcache.sqlite and a URL found alive is not
+             checked again for -cachealive days (default 7), a URL found
+             dead not for -cachedead hours (default 24).
+
 The following config variables are supported:
 
 max_external_links        - The maximum number of web pages that should be
                             loaded simultaneously. You should change this
                             according to your Internet connection speed.
-                            Be careful: if it is set too high, the script
-                            might get socket errors because your network
-                            is congested, and will then think that the page
-                            is offline.
+                            Be careful: with -fixed, if it is set too high,
+                            the script might get socket errors because your
+                            network is congested, and will then think that
+                            the page is offline.
 
 report_dead_links_on_talk - If set to true, causes the script to report dead
                             links on the article's talk page if (and ONLY if)
@@ -109,18 +204,36 @@ Syntax examples:
 #
 from __future__ import absolute_import, unicode_literals
 
+import bisect
+import bz2
 import codecs
 import datetime
+import email.utils
+import errno
+import json
+import multiprocessing
+import os
 import pickle
 import re
 import socket
+import sqlite3
+import string
 import sys
 import threading
 import time
 
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from itertools import groupby
 from time import sleep
 from warnings import warn
+from xml.sax.saxutils import unescape
+
+try:
+    import asyncio
+except ImportError as e:
+    asyncio = e
 
 try:
     import memento_client
@@ -129,21 +242,29 @@ except ImportError as e:
 
 import pywikibot
 
+try:
+    from pywikibot import weblib
+except ImportError as e:
+    # not in every pywikibot release; get_wayback_url() is used instead
+    weblib = e
+
 from pywikibot import (
     comms, i18n, config, pagegenerators, textlib, config2,
 )
 
 from pywikibot.bot import ExistingPageBot, SingleSiteBot
+from pywikibot.data import api
 from pywikibot.pagegenerators import (
     XMLDumpPageGenerator as _XMLDumpPageGenerator,
 )
-from pywikibot.tools import deprecated
+from pywikibot.tools import deprecated, itergroup
 from pywikibot.tools.formatter import color_format
 
 import requests
 
 if sys.version_info[0] > 2:
     import http.client as httplib
+    import queue
     import urllib.parse as urlparse
     import urllib.request as urllib
 
@@ -151,6 +272,7 @@ if sys.version_info[0] > 2:
     unicode = str
 else:
     import httplib
+    import Queue as queue
     import urllib
     import urlparse
 
@@ -1666,6 +1788,112 @@ ignorelist = [
 ]
 
 
+class IgnoreListMatcher(object):
+
+    """
+    Check URLs against a list of ignore regexes in one pass.
+
+    Nearly every ignorelist entry has the form ``.*[\./@]domain(/.*)?``. As
+    the patterns are used with match() and not anchored at the end, such an
+    entry matches when the domain (plus the optional path) follows any of
+    the ``./@`` separators in the URL. These entries are indexed by the text
+    following the separator in a radix trie which is compiled into a single
+    regex, so a URL is scanned once instead of once per entry. Entries
+    which do not start with the separator are joined into one alternation.
+
+    The answers are the same as matching every pattern on its own.
+    """
+
+    separator = r'.*[\./@]'
+    # an unescaped character which ends the literal part of a pattern
+    metachars = '.^$*+?{}[]|()'
+    quantifiers = '*+?{'
+
+    def __init__(self, patterns):
+        """Constructor."""
+        trie = {}
+        others = []
+        for regex in patterns:
+            pattern = regex.pattern
+            if pattern.endswith('(/.*)?'):
+                # optional tail, it never changes the result of match()
+                pattern = pattern[:-len('(/.*)?')]
+            if not pattern.startswith(self.separator):
+                others.append(pattern)
+                continue
+            literal, rest = self._split_literal(pattern[len(self.separator):])
+            node = trie
+            for char in literal:
+                node = node.setdefault(char, {})
+            node.setdefault(None, set()).add(rest)
+
+        self.size = len(patterns)
+        self.trieR = None
+        self.othersR = None
+        if trie:
+            self.trieR = re.compile(self.separator + self._trie_regex(trie))
+        if others:
+            self.othersR = re.compile('|'.join('(?:%s)' % pattern
+                                               for pattern in others))
+
+    @classmethod
+    def _split_literal(cls, pattern):
+        """
+        Split pattern into its literal head and the regex remainder.
+
+        @rtype: tuple of (unicode, unicode)
+        """
+        literal = []
+        i = 0
+        while i < len(pattern):
+            char = pattern[i]
+            if char == '\\':
+                if i + 1 == len(pattern) or pattern[i + 1].isalnum():
+                    break
+                literal.append(pattern[i + 1])
+                i += 2
+            elif char in cls.metachars:
+                if char in cls.quantifiers and literal:
+                    # the quantifier belongs to the last character
+                    literal.pop()
+                    i -= 2 if pattern[i - 2:i - 1] == '\\' else 1
+                break
+            else:
+                literal.append(char)
+                i += 1
+        return ''.join(literal), pattern[i:]
+
+    @classmethod
+    def _trie_regex(cls, node):
+        """Build a regex matching every path of the trie below node."""
+        branches = []
+        for char, child in node.items():
+            if char is None:
+                continue
+            # merge chains of single children into one literal
+            label = char
+            while len(child) == 1 and None not in child:
+                (next_char, child), = child.items()
+                label += next_char
+            branches.append(re.escape(label) + cls._trie_regex(child))
+        rests = node.get(None, ())
+        if '' in rests:
+            # an entry ends here, nothing more is needed to match
+            return ''
+        branches.extend('(?:%s)' % rest for rest in sorted(rests))
+        if len(branches) == 1:
+            return '(?:%s)' % branches[0]
+        return '(?:%s)' % '|'.join(sorted(branches))
+
+    def match(self, url):
+        """Return True if url matches any of the ignore patterns."""
+        if self.trieR and self.trieR.match(url):
+            return True
+        return bool(self.othersR and self.othersR.match(url))
+
+
+ignore_matcher = IgnoreListMatcher(ignorelist)
+
 
 def _get_closest_memento_url(url, when=None, timegate_uri=None):
     """Get most recent memento for url."""
@@ -1723,6 +1951,24 @@ def get_archive_url(url):
         archive = archive.replace('http://', 'https://', 1)
     return archive
 
+
+def get_wayback_url(url):
+    """
+    Return the newest copy of url in the Internet Archive, or None.
+
+    The Wayback availability API is asked directly, for pywikibot releases
+    without weblib.
+    """
+    r = comms.http.fetch('https://archive.org/wayback/available?url='
+                         + urlparse.quote(url, safe=''))
+    if r.status != 200:
+        raise pywikibot.Error('Wayback availability API answered %s'
+                              % r.status)
+    closest = json.loads(r.text).get('archived_snapshots', {}).get('closest')
+    if closest and closest.get('available'):
+        return closest['url']
+    return None
+
 def citeArchivedLink(link, text):
         #look if link is in cite template with non empty archive param
         #or link itself is an archive
@@ -1787,66 +2033,423 @@ def citeArchivedLink(link, text):
         return(archived)
 '''
 
-def weblinksIn(text, withoutBracketed=False, onlyBracketed=False):
+class ArchivedLinks(object):
+
     """
-    Yield web links from text.
+    Links of a page which are covered by an archived citation.
 
-    TODO: move to textlib
+    These are the values of the url and archiwum parameters of {{cytuj}}
+    templates which have a non-empty archiwum parameter. A link is archived
+    if it is the start of any of these values, as citeArchivedLink did it.
     """
-    text = textlib.removeDisabledParts(text)
 
-    # Ignore links in fullurl template
-    text = re.sub(r'{{\s?fullurl:.[^}]*}}', '', text)
-    # TODO search for links within cite with filled-in archiwum parameter
-    
+    def __init__(self):
+        """Constructor."""
+        self.values = []
+        self.sorted = True
+
+    def add(self, value):
+        """Add the value of a url or archiwum parameter."""
+        self.values.append(value)
+        self.sorted = False
+
+    def __contains__(self, link):
+        """Return True if a value starts with link."""
+        if not self.sorted:
+            self.values.sort()
+            self.sorted = True
+        # the smallest value not less than link starts with it if any does
+        i = bisect.bisect_left(self.values, link)
+        return i < len(self.values) and self.values[i].startswith(link)
+
+    def __len__(self):
+        """Return the number of values."""
+        return len(self.values)
+
+
+class _TemplateFrame(object):
+
+    """A template opened but not yet closed while scanning wikitext."""
+
+    __slots__ = ('name', 'partStart', 'linkDepth', 'params', 'skip')
+
+    def __init__(self, partStart, linkDepth, skip):
+        """Constructor."""
+        self.name = None
+        self.partStart = partStart
+        self.linkDepth = linkDepth
+        self.params = {}
+        self.skip = skip
 
-    # MediaWiki parses templates before parsing external links. Thus, there
-    # might be a | or a } directly after a URL which does not belong to
-    # the URL itself.
 
-    # First, remove the curly braces of inner templates:
-    nestedTemplateR = re.compile(r'{{([^}]*?){{(.*?)}}(.*?)}}')
-    while nestedTemplateR.search(text):
-        text = nestedTemplateR.sub(r'{{\1 \2 \3}}', text)
+# URLs end at template and link boundaries: MediaWiki expands templates
+# before it parses external links, so a | or }} after a URL does not belong
+# to it, and neither does an inner template.
+linkTokenR = re.compile(r'(?P<open>\{\{)|(?P<close>\}\})|(?P<pipe>\|)'
+                        r'|(?P<linkopen>\[\[)|(?P<linkclose>\]\])'
+                        r'|(?P<url>https?://(?:[^\s<|{}\]]|\{(?!\{))+)')
+fullurlR = re.compile(r'\s?fullurl:')
 
-    # Then blow up the templates with spaces so that the | and }} will not
-    # be regarded as part of the link:.
-    templateWithParamsR = re.compile(r'{{([^}]*?[^ ])\|([^ ][^}]*?)}}',
-                                     re.DOTALL)
-    while templateWithParamsR.search(text):
-        text = templateWithParamsR.sub(r'{{ \1 | \2 }}', text)
 
-    # Add <blank> at the end of a template
-    # URL as last param of multiline template would not be correct
-    text = text.replace('}}', ' }}')
+def scan_weblinks(text):
+    """
+    Find the web links of text and its archived citations in one pass.
+
+    Templates are tracked on a stack while scanning, so that links in
+    {{fullurl:}} are skipped and the url and archiwum parameters of
+    {{cytuj}} templates are collected on the way.
 
+    @return: the links in order of appearance and the archived links
+    @rtype: tuple of (list of unicode, ArchivedLinks)
+    """
     # Remove HTML comments in URLs as well as URLs in HTML comments.
     # Also remove text inside nowiki links etc.
     text = textlib.removeDisabledParts(text)
-    #linkR = textlib.compileLinkR(withoutBracketed, onlyBracketed)
-    #linkR = re.compile(r'(?P<url>http[s]?:(\/\/[^:\s\?]+?)(\??[^\s;<>\"\|\)]*))(?:[\]\s\.:;,<>\"\|\)])')
-    linkR = re.compile(r'(?m)(?P<url>http[s]?:(\/\/[^\s\?]+?)(\??[^\s<\|\}\]]*))(?:[\]\s\.<\|\}])')
-    for m in linkR.finditer(text):
-        if m.group('url'):
-            #pywikibot.output('URL to YIELD:%s' % m.group('url'))
-            if not citeArchivedLink(m.group('url'),text):
-                yield m.group('url')
-            else:
-                #test output
-                pywikibot.output('[%s] WebLinksIn: link skipped:%s' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),m.group('url')))
-        #else:
-        #    yield m.group('urlb')
+    urls = []
+    archived = ArchivedLinks()
+    stack = []
+    linkDepth = 0
+    skipDepth = 0
+    for m in linkTokenR.finditer(text):
+        token = m.lastgroup
+        if token == 'url':
+            if not skipDepth:
+                urls.append(m.group())
+        elif token == 'open':
+            skip = bool(fullurlR.match(text, m.end()))
+            stack.append(_TemplateFrame(m.end(), linkDepth, skip))
+            skipDepth += skip
+        elif token == 'linkopen':
+            linkDepth += 1
+        elif token == 'linkclose':
+            if stack and linkDepth == stack[-1].linkDepth:
+                # unbalanced ]] inside a template
+                continue
+            linkDepth = max(linkDepth - 1, 0)
+        elif stack:
+            frame = stack[-1]
+            if token == 'pipe' and linkDepth != frame.linkDepth:
+                # the | of a wikilink inside the template
+                continue
+            part = text[frame.partStart:m.start()]
+            frame.partStart = m.end()
+            if frame.name is None:
+                frame.name = part.strip().lower()
+            elif frame.name.startswith('cytuj') and '=' in part:
+                name, value = part.split('=', 1)
+                frame.params[name.strip()] = value.strip()
+            if token == 'close':
+                stack.pop()
+                skipDepth -= frame.skip
+                linkDepth = frame.linkDepth
+                if frame.params.get('archiwum'):
+                    archived.add(frame.params['archiwum'])
+                    if frame.params.get('url'):
+                        archived.add(frame.params['url'])
+    return urls, archived
+
+
+def weblinksIn(text, withoutBracketed=False, onlyBracketed=False):
+    """
+    Yield web links from text.
+
+    Links covered by an archived {{cytuj}} citation are skipped.
+
+    TODO: move to textlib
+    """
+    urls, archived = scan_weblinks(text)
+    for url in urls:
+        if url not in archived:
+            yield url
+        else:
+            #test output
+            pywikibot.output('[%s] WebLinksIn: link skipped:%s' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), url))
 
 
 XmlDumpPageGenerator = partial(
     _XMLDumpPageGenerator, text_predicate=weblinksIn)
 
 
+dumpPageR = re.compile(r'<page>(.*?)</page>', re.DOTALL)
+dumpTitleR = re.compile(r'<title>(.*?)</title>')
+dumpNamespaceR = re.compile(r'<ns>(-?\d+)</ns>')
+dumpTextR = re.compile(r'<text[^>]*>(.*?)</text>', re.DOTALL)
+
+
+def _dump_task_text(filename, ranges):
+    """Return the XML of the pages which start in the byte ranges."""
+    with open(filename, 'rb') as f:
+        if filename.endswith('.bz2'):
+            data = []
+            for start, end in ranges:
+                f.seek(start)
+                # every range is a complete bz2 stream
+                data.append(bz2.decompress(f.read(end - start)))
+            return b''.join(data).decode('utf-8')
+        (start, end), = ranges
+        f.seek(start)
+        data = f.read(end - start)
+        if start:
+            # the page cut at start belongs to the previous range
+            first = data.find(b'<page>')
+            data = data[first:] if first >= 0 else b''
+        # finish the last page begun before end
+        last = data.rfind(b'<page>')
+        if last >= 0:
+            while data.find(b'</page>', last) < 0:
+                more = f.read(1 << 20)
+                if not more:
+                    break
+                data += more
+            data = data[:data.find(b'</page>', last) + len(b'</page>')]
+    return data.decode('utf-8', 'replace')
+
+
+def _scan_dump_task(filename, ranges, namespaces, start=None):
+    """
+    Extract the web links of the pages of a part of an XML dump.
+
+    This runs in the worker processes of DumpLinkScanner.
+
+    @return: process id, number of pages, seconds used and a list of
+        (title, list of URLs) of the pages with links to check and of the
+        page called start
+    @rtype: tuple
+    """
+    started = time.time()
+    pages = 0
+    links = []
+    for page in dumpPageR.finditer(_dump_task_text(filename, ranges)):
+        page = page.group(1)
+        pages += 1
+        title = unescape(dumpTitleR.search(page).group(1), {'&quot;': '"'})
+        ns = dumpNamespaceR.search(page)
+        text = dumpTextR.search(page)
+        urls = []
+        if namespaces and (not ns or int(ns.group(1)) not in namespaces):
+            pass
+        elif text and '<redirect' not in page:
+            urls, archived = scan_weblinks(unescape(text.group(1),
+                                                    {'&quot;': '"'}))
+            urls = [url for url in urls
+                    if url not in archived and not ignore_matcher.match(url)]
+        if urls or title == start:
+            links.append((title, urls))
+    return os.getpid(), pages, time.time() - started, links
+
+
+class DumpLinkScanner(object):
+
+    """
+    Extract the web links of an XML dump in several processes.
+
+    A bz2 dump is cut into its streams, so it has to be a multistream dump
+    as published by Wikimedia. The stream offsets are read from the
+    multistream index next to the dump if there is one, else the dump is
+    searched for stream headers. An uncompressed dump is cut at page
+    boundaries.
+
+    The parts are scanned by a multiprocessing pool, but the pages are
+    yielded in dump order. Only a few parts per process are scanned ahead,
+    so memory use does not depend on the size of the dump.
+    """
+
+    streamMagic = b'BZh'
+    blockMagic = b'\x31\x41\x59\x26\x53\x59'
+    taskSize = 4 << 20
+
+    def __init__(self, filename, start=None, namespaces=None, processes=None,
+                 index=None):
+        """Constructor."""
+        self.filename = filename
+        self.start = start
+        self.namespaces = set(int(ns) for ns in namespaces or [])
+        self.processes = processes or multiprocessing.cpu_count()
+        if index is None and filename.endswith('.xml.bz2'):
+            index = filename[:-len('.xml.bz2')] + '-index.txt.bz2'
+            if not os.path.exists(index):
+                index = None
+        self.index = index
+        # process id -> [pages, seconds]
+        self.workers = {}
+
+    def _stream_offsets(self):
+        """Return the offsets of the bz2 streams of the dump."""
+        size = os.path.getsize(self.filename)
+        offsets = set([0, size])
+        if self.index:
+            startOffset = None
+            with bz2.BZ2File(self.index) as f:
+                for line in f:
+                    offset, pageid, title = line.decode('utf-8').rstrip(
+                        '\n').split(':', 2)
+                    offsets.add(int(offset))
+                    if title == self.start and startOffset is None:
+                        startOffset = int(offset)
+            if startOffset is not None:
+                offsets = set(offset for offset in offsets
+                              if offset >= startOffset)
+            return sorted(offsets)
+        magic = len(self.streamMagic) + 1 + len(self.blockMagic)
+        with open(self.filename, 'rb') as f:
+            position = 0
+            while position < size:
+                f.seek(position)
+                chunk = f.read((16 << 20) + magic)
+                i = chunk.find(self.streamMagic)
+                while 0 <= i <= len(chunk) - magic:
+                    if (chunk[i + 3:i + 4].isdigit()
+                            and chunk[i + 4:i + magic] == self.blockMagic):
+                        offsets.add(position + i)
+                    i = chunk.find(self.streamMagic, i + 1)
+                position += 16 << 20
+        return sorted(offsets)
+
+    def tasks(self):
+        """Yield the byte ranges scanned by one task each."""
+        if self.filename.endswith('.bz2'):
+            offsets = self._stream_offsets()
+            if len(offsets) == 2:
+                pywikibot.warning('%s has a single bz2 stream; use a '
+                                  'multistream dump to scan it in parallel'
+                                  % self.filename)
+            ranges = []
+            for start, end in zip(offsets, offsets[1:]):
+                ranges.append((start, end))
+                if end - ranges[0][0] >= self.taskSize:
+                    yield ranges
+                    ranges = []
+            if ranges:
+                yield ranges
+        else:
+            size = os.path.getsize(self.filename)
+            for start in range(0, size, self.taskSize):
+                yield [(start, min(start + self.taskSize, size))]
+
+    def __iter__(self):
+        """Yield (title, list of URLs) of the pages in dump order."""
+        started = time.time()
+        lastReport = started
+        skipping = self.start is not None
+        pool = multiprocessing.Pool(self.processes)
+        running = deque()
+        tasks = self.tasks()
+        try:
+            while True:
+                while len(running) < 2 * self.processes:
+                    ranges = next(tasks, None)
+                    if ranges is None:
+                        break
+                    running.append(pool.apply_async(
+                        _scan_dump_task,
+                        (self.filename, ranges, self.namespaces, self.start)))
+                if not running:
+                    break
+                pid, pages, seconds, links = running.popleft().get()
+                worker = self.workers.setdefault(pid, [0, 0])
+                worker[0] += pages
+                worker[1] += seconds
+                for title, urls in links:
+                    if skipping:
+                        if title != self.start:
+                            continue
+                        skipping = False
+                    if urls:
+                        yield title, urls
+                if time.time() - lastReport > 60:
+                    self.report(time.time() - started)
+                    lastReport = time.time()
+        finally:
+            pool.terminate()
+            pool.join()
+        self.report(time.time() - started)
+
+    def report(self, elapsed):
+        """Log the number of pages scanned per second by every worker."""
+        total = 0
+        for pid, (pages, seconds) in sorted(self.workers.items()):
+            total += pages
+            pywikibot.output('[%s] dump worker %i: %i pages, %.1f pages/s'
+                             % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                pid, pages, pages / seconds if seconds else 0))
+        pywikibot.output('[%s] dump: %i pages in %.0f s, %.1f pages/s'
+                         % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                            total, elapsed, total / elapsed if elapsed else 0))
+
+
 class NotAnURLError(BaseException):
 
     """The link is not an URL."""
 
 
+class ConnectionPool(object):
+
+    """
+    Keep-alive HTTP connections of LinkChecker, shared by all its instances.
+
+    At most maxPerHost idle connections are kept for a host, and only for
+    the maxHosts hosts used last. The encoding used by a server is
+    remembered here too, so it is asked for once per host.
+    """
+
+    def __init__(self, maxPerHost=4, maxHosts=100):
+        """Constructor."""
+        self.maxPerHost = maxPerHost
+        self.maxHosts = maxHosts
+        self.lock = threading.Lock()
+        # (scheme, host) -> idle connections
+        self.idle = OrderedDict()
+        # host -> encoding used by the server
+        self.encodings = {}
+        self.created = 0
+        self.reused = 0
+
+    def get(self, scheme, host):
+        """
+        Return an idle connection to host, or a new one.
+
+        @return: the connection and whether it was used before
+        @rtype: tuple of (httplib.HTTPConnection, bool)
+        """
+        with self.lock:
+            connections = self.idle.get((scheme, host))
+            if connections:
+                self.reused += 1
+                return connections.pop(), True
+            self.created += 1
+        if scheme == 'http':
+            return httplib.HTTPConnection(host), False
+        elif scheme == 'https':
+            return httplib.HTTPSConnection(host), False
+        raise NotAnURLError('%s://%s' % (scheme, host))
+
+    def release(self, scheme, host, conn, response):
+        """Keep conn for the next request if response allows it."""
+        if response.will_close or not response.isclosed():
+            conn.close()
+            return
+        closing = []
+        with self.lock:
+            key = (scheme, host)
+            connections = self.idle.pop(key, None) or deque()
+            connections.append(conn)
+            while len(connections) > self.maxPerHost:
+                closing.append(connections.popleft())
+            self.idle[key] = connections
+            while len(self.idle) > self.maxHosts:
+                closing.extend(self.idle.popitem(last=False)[1])
+        for conn in closing:
+            conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self.lock:
+            idle, self.idle = self.idle, OrderedDict()
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+
 @deprecated('requests')
 class LinkChecker(object):
 
@@ -1864,8 +2467,13 @@ class LinkChecker(object):
     Warning: Also returns false if your Internet connection isn't working
     correctly! (This will give a Socket Error)
 
+    Connections are kept alive in a ConnectionPool shared by all instances,
+    so the hops of a redirect chain and further links to the same host do
+    not open a new connection each.
     """
 
+    pool = ConnectionPool()
+
     def __init__(self, url, redirectChain=[], serverEncoding=None,
                  HTTPignore=[]):
         """
@@ -1900,24 +2508,52 @@ class LinkChecker(object):
 
     def getConnection(self):
         """Get a connection."""
-        if self.scheme == 'http':
-            return httplib.HTTPConnection(self.host)
-        elif self.scheme == 'https':
-            return httplib.HTTPSConnection(self.host)
-        else:
+        if self.scheme not in ('http', 'https'):
             raise NotAnURLError(self.url)
+        return self.pool.get(self.scheme, self.host)[0]
+
+    def request(self, method, path):
+        """
+        Send a request on a pooled connection and return the response.
+
+        A kept-alive connection may have been closed by the server in the
+        meantime; then the request is sent once more on a new connection.
+
+        @rtype: httplib.HTTPResponse
+        """
+        if self.scheme not in ('http', 'https'):
+            raise NotAnURLError(self.url)
+        while True:
+            conn, reused = self.pool.get(self.scheme, self.host)
+            try:
+                conn.request(method, path, None, self.header)
+                response = conn.getresponse()
+            except (httplib.error, socket.error):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            self.connection = conn
+            return response
+
+    def release(self, response, readBody=True):
+        """Give the connection of response back to the pool."""
+        if readBody:
+            response.read()
+        self.pool.release(self.scheme, self.host, self.connection, response)
 
     def getEncodingUsedByServer(self):
         """Get encodung used by server."""
+        if not self.serverEncoding:
+            self.serverEncoding = self.pool.encodings.get(self.host)
         if not self.serverEncoding:
             try:
                 pywikibot.output(
                     u'Contacting server %s to find out its default encoding...'
                     % self.host)
-                conn = self.getConnection()
-                conn.request('HEAD', '/', None, self.header)
-                self.response = conn.getresponse()
+                self.response = self.request('HEAD', '/')
                 self.readEncodingFromResponse(self.response)
+                self.release(self.response)
             except:
                 pass
             if not self.serverEncoding:
@@ -1937,6 +2573,7 @@ class LinkChecker(object):
                 charsetR = re.compile('charset=(.+)')
                 charset = charsetR.search(ct).group(1)
                 self.serverEncoding = charset
+                self.pool.encodings[self.host] = charset
             except:
                 pass
 
@@ -1971,15 +2608,9 @@ class LinkChecker(object):
 
         @rtype: unicode or None
         """
-        conn = self.getConnection()
         try:
-            if useHEAD:
-                conn.request('HEAD', '%s%s' % (self.path, self.query), None,
-                             self.header)
-            else:
-                conn.request('GET', '%s%s' % (self.path, self.query), None,
-                             self.header)
-            self.response = conn.getresponse()
+            self.response = self.request('HEAD' if useHEAD else 'GET',
+                                         '%s%s' % (self.path, self.query))
             # read the server's encoding, in case we need it later
             self.readEncodingFromResponse(self.response)
         except httplib.BadStatusLine:
@@ -1991,7 +2622,10 @@ class LinkChecker(object):
                 return self.resolveRedirect(useHEAD=False)
             else:
                 raise
-        if self.response.status >= 300 and self.response.status <= 399:
+        isRedirect = 300 <= self.response.status <= 399
+        # the body of a redirect is short; any other body is not needed
+        self.release(self.response, readBody=useHEAD or isRedirect)
+        if isRedirect:
             # to debug, print response.getheaders()
             redirTarget = self.response.getheader('Location')
             if redirTarget:
@@ -2100,20 +2734,16 @@ class LinkChecker(object):
                 return redirChecker.check(useHEAD=useHEAD)
         else:
             try:
-                conn = self.getConnection()
-            except httplib.error as error:
-                return False, u'HTTP Error: %s' % error.__class__.__name__
-            try:
-                conn.request('GET', '%s%s'
-                             % (self.path, self.query), None, self.header)
+                self.response = self.request('GET', '%s%s'
+                                             % (self.path, self.query))
             except socket.error as error:
-                return False, u'Socket Error: %s' % repr(error[1])
-            try:
-                self.response = conn.getresponse()
+                return False, u'Socket Error: %s' % repr(error.args[-1])
             except Exception as error:
                 return False, u'Error: %s' % error
             # read the server's encoding, in case we need it later
             self.readEncodingFromResponse(self.response)
+            # the page itself is not read, so the connection is closed
+            self.release(self.response, readBody=False)
             # site down if the server status is between 400 and 499
             alive = self.response.status not in range(400, 500)
             if self.response.status in self.HTTPignore:
@@ -2122,236 +2752,2388 @@ class LinkChecker(object):
                                      self.response.reason)
 
 
-class LinkCheckThread(threading.Thread):
-
-    """A thread responsible for checking one URL.
+class LinkCheckResult(namedtuple('LinkCheckResult',
+                                 'state status message retryAfter finalUrl '
+                                 'size failure')):
 
-    After checking the page, it will die.
+    """
+    The result of check_url.
+
+    state is 'alive', 'ignored' or 'dead', status the HTTP status (None if
+    the server could not be reached), message the text for the dead link
+    report, retryAfter the delay in seconds asked for by the server,
+    finalUrl the URL after following redirects, size the number of
+    bytes received and failure why the server could not be reached, as
+    returned by connection_failure().
     """
 
-    def __init__(self, page, url, history, HTTPignore, day):
-        """Constructor."""
-        threading.Thread.__init__(self)
-        self.page = page
-        self.url = url
-        self.history = history
-        self.header = {
-            'Accept': 'text/xml,application/xml,application/xhtml+xml,'
-                      'text/html;q=0.9,text/plain;q=0.8,image/png,*/*;q=0.5',
-            'Accept-Language': 'de-de,de;q=0.8,en-us;q=0.5,en;q=0.3',
-            'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.7',
-            'Keep-Alive': '30',
-            'Connection': 'keep-alive',
-        }
-        # identification for debugging purposes
-        self.setName((u'%s - %s' % (page.title(), url)).encode('utf-8',
-                                                               'replace'))
-        self.HTTPignore = HTTPignore
-        self._use_fake_user_agent = config.fake_user_agent_default.get(
-            'weblinkchecker', False)
-        self.day = day
 
-    def run(self):
-        """Run the bot."""
-        ok = False
-        exception = False
-        ignore = False
-        try:
-            header = self.header
-            r = comms.http.fetch(
-                self.url, headers=header,
-                use_fake_user_agent=self._use_fake_user_agent)
-        except requests.exceptions.InvalidURL:
-            exception = True
-            message = u'Podany link nie jest prawidłowym adresem URL'
-            #message = i18n.twtranslate(self.page.site,
-            #                           'weblinkchecker-badurl_msg',
-            #                           {'URL': self.url})
-        except:
-            pywikibot.output('[%s] Exception while processing URL %s in page %s'
-                             % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),self.url, self.page.title()))
-            exception = True
-            message = 'Exception while connecting.'
-            #raise
-            #return
+LinkCheckResult.__new__.__defaults__ = (None, )
 
-        if not exception:
-            #test output
-            pywikibot.output('[%s] HTTP status:%s in [%s - %s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),r.status,self.page.title(),self.url)) 
-
-            #if (r.status == requests.codes.ok and str(r.status) not in self.HTTPignore):
-            if r.status == requests.codes.ok:
-                #pywikibot.output(u'[%s] CODE [%s] OK in [%s - %s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),r.status,self.page.title(),self.url))
-                ok = True
-            elif r.status in self.HTTPignore:
-                ignore = True
-                #test output
-                #pywikibot.output(u'[%s] CODE [%s] ignored in [%s - %s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),r.status,self.page.title(),self.url))
-            else:
-                #test output
-                #pywikibot.output(u'[%s] CODE [%s] rejected in [%s - %s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),r.status,self.page.title(),self.url))
-                message = '{0}'.format(r.status)
-        if ok:
-            if self.history.setLinkAlive(self.url):
-                pywikibot.output('[%s] *Link to %s in [[%s]] is back alive.'
-                                 % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),self.url, self.page.title()))
-        elif ignore:
-            pywikibot.output(u'[%s] CODE [%s] ignored in [%s - %s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),r.status,self.page.title(),self.url))
-        else:
-            pywikibot.output('[%s] *[[%s]] links to %s - %s.'
-                             % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.page.title(), self.url, message))
-            self.history.setLinkDead(self.url, message, self.page,
-                                     config.weblink_dead_days)
 
+def connection_failure(error):
+    """
+    Return why error kept a server from being reached.
 
-class History(object):
+    The exceptions wrapped by requests and urllib3 are searched for the
+    cause: 'unresolved' if the host name does not exist, 'refused' if the
+    connection was refused, 'dns' if the name could not be resolved for
+    the time being and 'timeout' if the connection or the answer took too
+    long.
 
+    @rtype: str or None
     """
-    Store previously found dead links.
+    errors = [error]
+    seen = set()
+    while errors:
+        error = errors.pop()
+        if error is None or id(error) in seen:
+            continue
+        seen.add(id(error))
+        if isinstance(error, socket.gaierror):
+            if error.errno == socket.EAI_NONAME:
+                return 'unresolved'
+            if error.errno == socket.EAI_AGAIN:
+                return 'dns'
+        elif isinstance(error, (socket.timeout, requests.exceptions.Timeout)):
+            return 'timeout'
+        elif getattr(error, 'errno', None) == errno.ECONNREFUSED:
+            return 'refused'
+        errors.append(getattr(error, 'reason', None))
+        errors.append(getattr(error, '__context__', None))
+        errors.append(getattr(error, '__cause__', None))
+        errors.extend(arg for arg in getattr(error, 'args', ())
+                      if isinstance(arg, BaseException))
+    return None
+
+
+# query parameters which only track where a visitor came from
+trackingParamR = re.compile(
+    r'(?i)^(?:utm_\w+|fbclid|gclid|dclid|gbraid|wbraid|msclkid|yclid|'
+    r'mc_cid|mc_eid|igshid|_ga|_gl|_hsenc|_hsmi)$')
+escapeR = re.compile('%([0-9A-Fa-f]{2})')
+unreservedChars = frozenset(string.ascii_letters + string.digits + '-._~')
+
+
+def _normalize_escape(match):
+    """Decode an escaped unreserved character, uppercase other escapes."""
+    char = chr(int(match.group(1), 16))
+    if char in unreservedChars:
+        return char
+    return '%' + match.group(1).upper()
+
+
+def _normalize_escapes(text, safe):
+    """Escape text the same way however it was escaped before."""
+    return urlparse.quote(escapeR.sub(_normalize_escape, text),
+                          safe=safe + '%')
+
+
+def canonical_url(url):
+    """
+    Return the key under which the result of checking url is stored.
+
+    Spellings which lead to the same resource get the same key: scheme and
+    host are case insensitive, http and https are taken as the same, as
+    are a host with and without www., a path with and without a trailing
+    slash, an explicit default port, characters escaped or not, and
+    tracking parameters like utm_source in the query. The fragment is never
+    sent to the server. The key is not meant to be loaded; the URL as it
+    is spelled on the page is.
+
+    A URL which cannot be parsed, like http://[foo.pl/, is its own key
+    without the fragment.
+    """
+    try:
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    except ValueError:
+        return url.partition('#')[0]
+    scheme = scheme.lower()
+    netloc = netloc.lower()
+    if ((scheme == 'http' and netloc.endswith(':80'))
+            or (scheme == 'https' and netloc.endswith(':443'))):
+        netloc = netloc.rsplit(':', 1)[0]
+    if scheme in ('http', 'https'):
+        scheme = 'http'
+    userinfo, at, host = netloc.rpartition('@')
+    if host.startswith('www.'):
+        netloc = userinfo + at + host[4:]
+    path = _normalize_escapes(path, "/:@!$&'()*+,;=").rstrip('/')
+    params = [param for param in query.split('&')
+              if param and not trackingParamR.match(
+                  urlparse.unquote(param.partition('=')[0]))]
+    query = _normalize_escapes('&'.join(params), "/:@!$&'()*+,;=?")
+    return urlparse.urlunsplit((scheme, netloc, path, query, ''))
+
+
+def parse_retry_after(value):
+    """
+    Convert a Retry-After header value to seconds.
+
+    @rtype: int or None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0, int(email.utils.mktime_tz(date) - time.time()))
+
+
+def check_url(page, url, HTTPignore, header=None, use_fake_user_agent=False):
+    """
+    Load url and classify the answer.
 
-    The URLs are dictionary keys, and
-    values are lists of tuples where each tuple represents one time the URL was
-    found dead. Tuples have the form (title, date, error) where title is the
-    wiki page where the URL was found, date is an instance of time, and error
-    is a string with error code and message.
+    @rtype: LinkCheckResult
+    """
+    try:
+        r = comms.http.fetch(
+            url, headers=header,
+            use_fake_user_agent=use_fake_user_agent)
+    except requests.exceptions.InvalidURL:
+        return LinkCheckResult(
+            'dead', None, u'Podany link nie jest prawidłowym adresem URL',
+            None, None, 0)
+        #message = i18n.twtranslate(page.site,
+        #                           'weblinkchecker-badurl_msg',
+        #                           {'URL': url})
+    except:
+        pywikibot.output('[%s] Exception while processing URL %s in page %s'
+                         % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), url, page.title()))
+        return LinkCheckResult('dead', None, 'Exception while connecting.',
+                               None, None, 0,
+                               connection_failure(sys.exc_info()[1]))
+
+    #test output
+    pywikibot.output('[%s] HTTP status:%s in [%s - %s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), r.status, page.title(), url))
+
+    return classify_response(r.status, r.response_headers,
+                             getattr(r.data, 'url', None),
+                             response_size(r.response_headers)
+                             + len(getattr(r, 'raw', None) or b''),
+                             HTTPignore)
+
+
+def response_size(headers):
+    """Return the approximate size of the status line and headers."""
+    return 20 + sum(len(name) + len(value) + 4
+                    for name, value in headers.items())
+
+
+def classify_response(status, headers, finalUrl, size, HTTPignore):
+    """
+    Turn the answer of a server into a LinkCheckResult.
 
-    We assume that the first element in the list represents the first time we
-    found this dead link, and the last element represents the last time.
+    @rtype: LinkCheckResult
+    """
+    retryAfter = None
+    if status in HostScheduler.retryStatus:
+        retryAfter = parse_retry_after(headers.get('Retry-After'))
+    if status == requests.codes.ok:
+        return LinkCheckResult('alive', status, None, retryAfter, finalUrl,
+                               size)
+    elif status in HTTPignore:
+        return LinkCheckResult('ignored', status, None, retryAfter,
+                               finalUrl, size)
+    return LinkCheckResult('dead', status, '{0}'.format(status),
+                           retryAfter, finalUrl, size)
 
-    Example:
 
-    dict = {
-        'https://www.example.org/page': [
-            ('WikiPageTitle', DATE, '404: File not found'),
-            ('WikiPageName2', DATE, '404: File not found'),
-        ]
+class HeadChecker(object):
+
+    """
+    Check URLs without downloading their bodies.
 
+    A URL is loaded with HEAD first. If that does not give 200, a GET is
+    sent whose body is never read: the connection is closed as soon as the
+    headers have arrived. Hosts for which such a GET succeeds after HEAD
+    failed are remembered as mishandling HEAD and get the GET straight
+    away from then on.
     """
 
-    def __init__(self, reportThread, site=None):
+    def __init__(self, HTTPignore, header=None, use_fake_user_agent=False):
         """Constructor."""
-        self.reportThread = reportThread
-        if not site:
-            self.site = pywikibot.Site()
+        self.HTTPignore = HTTPignore
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=config.max_external_links,
+            pool_maxsize=config.max_external_links)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.header = dict(header or {})
+        if use_fake_user_agent and isinstance(use_fake_user_agent, str):
+            self.header['user-agent'] = use_fake_user_agent
+        elif use_fake_user_agent:
+            self.header['user-agent'] = comms.http.fake_user_agent()
         else:
-            self.site = site
-        self.semaphore = threading.Semaphore()
-        self.datfilename = pywikibot.config.datafilepath(
-            'deadlinks', 'deadlinks-%s-%s.dat' % (self.site.family.name,
-                                                  self.site.code))
-        # Count the number of logged links, so that we can insert captions
-        # from time to time
-        self.logCount = 0
+            self.header['user-agent'] = comms.http.user_agent()
+        self.headUnsupported = set()
+        self.lock = threading.Lock()
+        self.heads = 0
+        self.gets = 0
+
+    def _request(self, method, url):
+        """Send a request without reading the body."""
+        response = self.session.request(
+            method, url, headers=self.header, stream=True,
+            timeout=config.socket_timeout, allow_redirects=True)
+        # closing an unread body drops the connection instead of
+        # downloading the rest of it
+        response.close()
+        return response
+
+    def check(self, page, url):
+        """
+        Check url with HEAD, and with a body-free GET if needed.
+
+        @rtype: LinkCheckResult
+        """
+        host = HostScheduler.host(url)
+        size = 0
         try:
-            with open(self.datfilename, 'rb') as datfile:
-                self.historyDict = pickle.load(datfile)
-            pywikibot.output('DICTIONARY LOADED: %i elements' % len(self.historyDict.keys()))
-        except (IOError, EOFError):
-            # no saved history exists yet, or history dump broken
-            pywikibot.output('SKIPPING INITIAL LOAD OF DATA')
-            #pywikibot.output('DICTIONARY ERROR: %i elements' % len(self.historyDict.keys()))
-            #self.historyDict = {}
+            if host not in self.headUnsupported:
+                with self.lock:
+                    self.heads += 1
+                r = self._request('HEAD', url)
+                size += response_size(r.headers)
+                if r.status_code == requests.codes.ok:
+                    return classify_response(r.status_code, r.headers, r.url,
+                                             size, self.HTTPignore)
+                headStatus = r.status_code
+            else:
+                headStatus = None
+            with self.lock:
+                self.gets += 1
+            r = self._request('GET', url)
+            size += response_size(r.headers)
+        except requests.exceptions.InvalidURL:
+            return LinkCheckResult(
+                'dead', None, u'Podany link nie jest prawidłowym adresem URL',
+                None, None, size)
+        except Exception as e:
+            pywikibot.output('[%s] Exception while processing URL %s in page %s'
+                             % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), url, page.title()))
+            return LinkCheckResult('dead', None,
+                                   'Exception while connecting.', None, None,
+                                   size, connection_failure(e))
+
+        if headStatus is not None and r.status_code != headStatus:
+            pywikibot.output('[%s] Host %s mishandles HEAD (%s, GET: %s)'
+                             % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), host, headStatus, r.status_code))
+            self.headUnsupported.add(host)
+        #test output
+        pywikibot.output('[%s] HTTP status:%s in [%s - %s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), r.status_code, page.title(), url))
+        return classify_response(r.status_code, r.headers, r.url, size,
+                                 self.HTTPignore)
+
+    def report(self):
+        """Log how the URLs were checked."""
+        pywikibot.output('%i HEAD and %i GET requests sent; %i hosts '
+                         'mishandle HEAD'
+                         % (self.heads, self.gets, len(self.headUnsupported)))
+
+
+def record_link(history, page, url, result):
+    """Store the result of check_url in history."""
+    if result.state == 'alive':
+        if history.setLinkAlive(url):
+            pywikibot.output('[%s] *Link to %s in [[%s]] is back alive.'
+                             % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), url, page.title()))
+    elif result.state == 'ignored':
+        pywikibot.output(u'[%s] CODE [%s] ignored in [%s - %s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), result.status, page.title(), url))
+    else:
+        pywikibot.output('[%s] *[[%s]] links to %s - %s.'
+                         % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), page.title(), url, result.message))
+        history.setLinkDead(url, result.message, page,
+                            config.weblink_dead_days)
 
-    def log(self, url, error, containingPage, archiveURL):
-        """Log an error report to a text file in the deadlinks subdirectory."""
-        if archiveURL:
-            errorReport = u'* %s ([%s archiwum])\n' % (url, archiveURL)
-        else:
-            errorReport = u'* %s\n' % url
-        for (pageTitle, date, error) in self.historyDict[url]:
-            # ISO 8601 formulation
-            isoDate = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(date))
-            errorReport += "** In [[%s]] on %s, %s\n" % (pageTitle, isoDate,
-                                                         error)
-        pywikibot.output(u"** Logging link for deletion.")
-        txtfilename = pywikibot.config.datafilepath('deadlinks',
-                                                    'results-%s-%s.txt'
-                                                    % (self.site.family.name,
-                                                       self.site.lang))
-        txtfile = codecs.open(txtfilename, 'a', 'utf-8')
-        self.logCount += 1
-        if self.logCount % 30 == 0:
-            # insert a caption
-            txtfile.write('=== %s ===\n' % containingPage.title()[:3])
-        txtfile.write(errorReport)
-        txtfile.close()
 
-        if self.reportThread and not containingPage.isTalkPage():
-            self.reportThread.report(url, errorReport, containingPage,
-                                     archiveURL)
+class DeadLinkConfirmer(object):
 
-    def setLinkDead(self, url, error, page, weblink_dead_days):
-        """Add the fact that the link was found dead to the .dat file."""
-        #test output
-        #pywikibot.output('setLinkDead: SEM acquire [%s][%s][%s]' % (url,page.title(),error))
-        self.semaphore.acquire()
-        #test output
-        #pywikibot.output('[%s] setLinkDead: SEM acc DONE [%s][%s][%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), url, page.title(), error))
-        now = time.time()
-        if url in self.historyDict:
-            timeSinceFirstFound = now - self.historyDict[url][0][1]
-            timeSinceLastFound = now - self.historyDict[url][-1][1]
-            archiveURL = None
-            # if the last time we found this dead link is less than an hour
-            # ago, we won't save it in the history this time.
-            if timeSinceLastFound > 60 * 60:
-                self.historyDict[url].append((page.title(), now, error))
-            # if the first time we found this link longer than x day ago
-            # (default is a week), it should probably be fixed or removed.
-            # We'll list it in a file so that it can be removed manually.
-            if timeSinceFirstFound > 60 * 60 * 24 * weblink_dead_days:
-                # search for archived page
-                # skip memento search
-                """
-                try:
-                    #test output
-                    pywikibot.output('setlinkDead: Memento Archive [%s]' % url)
-                    archiveURL = get_archive_url(url)
-                except Exception as e:
-                    pywikibot.warning(
-                        'get_closest_memento_url({0}) failed: {1}'.format(
-                            url, e))
-                    archiveURL = None
-                """
-                if archiveURL is None:
-                    #test output
-                    pywikibot.output('[%s] setlinkDead: InternetArchive [%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), url))
-                    try:
-                        archiveURL = weblib.getInternetArchiveURL(url)
-                    except:
-                        pywikibot.output('[%s] EXCEPTION setlinkDead: InternetArchive [%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), url))
-                        pass
-                if archiveURL is None:
-                    #test output
-                    pywikibot.output('[%s] setlinkDead: WebCitation [%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),url))
-                    try:
-                        archiveURL = weblib.getWebCitationURL(url)
-                    except:
-                        pywikibot.output('[%s] EXCEPTION setlinkDead: WebCitation [%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),url))
-                        pass
-                #test output
-                pywikibot.output('[%s] setlinkDead: ArchiveLink received [%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),archiveURL))
-                self.log(url, error, page, archiveURL)
-        else:
-            self.historyDict[url] = [(page.title(), now, error)]
-        #test output
-        #pywikibot.output('[%s] setlinkDead: SEM release [%s][%s][%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),url,page.title(),error))
-        self.semaphore.release()
-        #test output
-        #pywikibot.output('[%s] setlinkDead: SEM rel DONE [%s][%s][%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),url,page.title(),error))
+    """
+    Make sure a dead link is still on its page before it is reported.
 
-    def setLinkAlive(self, url):
-        """
-        Record that the link is now alive.
+    Used when the URLs are taken from the history instead of the pages.
+    A page is loaded only if the link would now be reported, that is if it
+    was found dead first more than weblink_dead_days ago. The links of the
+    last loaded pages are kept, as most dead links share their page with
+    other ones.
+    """
 
-        If link was previously found dead, remove it from the .dat file.
+    def __init__(self, history, size=1000):
+        """Constructor."""
+        self.history = history
+        self.size = size
+        # page title -> (canonical links, archived links)
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+        self.loaded = 0
+        self.gone = 0
+
+    def links(self, page):
+        """Return the canonical links of page and its archived links."""
+        title = page.title()
+        with self.lock:
+            if title in self.pages:
+                self.pages[title] = self.pages.pop(title)
+                return self.pages[title]
+        try:
+            urls, archived = scan_weblinks(page.get())
+        except (pywikibot.NoPage, pywikibot.IsRedirectPage):
+            urls, archived = [], ArchivedLinks()
+        with self.lock:
+            self.loaded += 1
+            self.pages[title] = (set(canonical_url(url) for url in urls),
+                                 archived)
+            while len(self.pages) > self.size:
+                self.pages.popitem(last=False)
+            return self.pages[title]
+
+    def __call__(self, page, url):
+        """
+        Check whether the dead url may be recorded for page.
 
-        @return: True if previously found dead, else returns False.
+        @rtype: bool
         """
-        if url in self.historyDict:
-            #test output
+        dates = self.history.historyDict.dates(url)
+        if (not dates or time.time() - dates[0]
+                <= 60 * 60 * 24 * config.weblink_dead_days):
+            return True
+        urls, archived = self.links(page)
+        if canonical_url(url) in urls and url not in archived:
+            return True
+        with self.lock:
+            self.gone += 1
+        pywikibot.output('[%s] *Link to %s is no longer in [[%s]].'
+                         % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), url, page.title()))
+        return False
+
+    def report(self):
+        """Log how many pages were loaded."""
+        pywikibot.output('%i pages loaded to confirm dead links, %i links '
+                         'no longer found' % (self.loaded, self.gone))
+
+
+class HostScheduler(object):
+
+    """
+    Queue of URLs to check which is polite to every host.
+
+    get() only returns a URL of a host which has less than maxPerHost
+    checks running and is not in a backoff period, so other hosts keep the
+    checkers busy while one host is saturated. URLs answered with 429 or
+    503 are put back with retry() and the host pauses for the time given in
+    Retry-After, or for an exponentially growing time without it.
+    """
+
+    retryStatus = (429, 503)
+    # first backoff in seconds, doubled on every retry of the same URL
+    backoff = 30
+    maxBackoff = 60 * 60
+
+    def __init__(self, maxPerHost=4, maxQueued=None, maxRetries=4):
+        """Constructor."""
+        self.maxPerHost = maxPerHost
+        self.maxQueued = maxQueued or config.max_external_links * 10
+        self.maxRetries = maxRetries
+        self.condition = threading.Condition()
+        # host -> deque of (page, url, attempt)
+        self.queues = OrderedDict()
+        self.running = {}
+        self.notBefore = {}
+        self.queued = 0
+        self.retried = 0
+        self.finished = 0
+        self.lastReport = time.time()
+
+    @staticmethod
+    def host(url):
+        """Return the host part of url."""
+        return urlparse.urlsplit(url).netloc.lower()
+
+    def put(self, page, url, attempt=0, block=True):
+        """Add url to the queue, waiting while it is full."""
+        host = self.host(url)
+        with self.condition:
+            while block and self.queued >= self.maxQueued:
+                self.condition.wait(1)
+                if time.time() - self.lastReport > 60:
+                    self.report()
+            self.queues.setdefault(host, deque()).append((page, url, attempt))
+            self.queued += 1
+            self.condition.notify_all()
+
+    def _pop(self):
+        """Return an item of the first host ready for a check or None."""
+        now = time.time()
+        for host, pending in self.queues.items():
+            if (self.running.get(host, 0) < self.maxPerHost
+                    and self.notBefore.get(host, 0) <= now):
+                item = pending.popleft()
+                if not pending:
+                    del self.queues[host]
+                else:
+                    # round robin: the host goes to the end of the line
+                    self.queues.move_to_end(host)
+                self.running[host] = self.running.get(host, 0) + 1
+                self.queued -= 1
+                self.condition.notify_all()
+                return item
+        return None
+
+    def waitTime(self):
+        """Return seconds until a queued host may be ready, at most 1."""
+        now = time.time()
+        waits = [self.notBefore.get(host, 0) - now for host in self.queues]
+        return min([1] + [max(wait, 0.01) for wait in waits])
+
+    def get(self, block=True):
+        """
+        Return the next URL to check as a tuple (page, url, attempt).
+
+        The caller must call done() when the check is finished. Returns None
+        if block is False and no host is ready.
+        """
+        with self.condition:
+            while True:
+                item = self._pop()
+                if item or not block:
+                    return item
+                self.condition.wait(self.waitTime())
+
+    def done(self, url):
+        """Mark the check of url as finished."""
+        host = self.host(url)
+        with self.condition:
+            self.running[host] -= 1
+            if not self.running[host]:
+                del self.running[host]
+            self.finished += 1
+            self.condition.notify_all()
+
+    def retry(self, page, url, attempt, retryAfter=None):
+        """
+        Put url back to be checked again after a backoff.
+
+        @return: False if url was already retried maxRetries times
+        @rtype: bool
+        """
+        if attempt >= self.maxRetries:
+            return False
+        delay = min(self.backoff * 2 ** attempt, self.maxBackoff)
+        if retryAfter is not None:
+            delay = min(retryAfter, self.maxBackoff)
+        host = self.host(url)
+        with self.condition:
+            self.notBefore[host] = max(self.notBefore.get(host, 0),
+                                       time.time() + delay)
+            self.retried += 1
+        pywikibot.output('[%s] Host %s is busy, retrying %s in %i s'
+                         % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), host, url, delay))
+        self.put(page, url, attempt + 1, block=False)
+        return True
+
+    def pending(self):
+        """Return the number of URLs queued or being checked."""
+        with self.condition:
+            return self.queued + sum(self.running.values())
+
+    def backingOff(self):
+        """Return True if URLs are queued for a host in a backoff."""
+        now = time.time()
+        with self.condition:
+            return any(self.notBefore.get(host, 0) > now
+                       for host in self.queues)
+
+    def counts(self):
+        """Return the number of URLs queued and being checked."""
+        with self.condition:
+            return self.queued, sum(self.running.values())
+
+    def depths(self):
+        """Return a dict of host: number of queued URLs."""
+        with self.condition:
+            return dict((host, len(pending))
+                        for host, pending in self.queues.items())
+
+    def report(self, limit=10):
+        """Log the hosts with the most queued URLs."""
+        self.lastReport = time.time()
+        depths = self.depths()
+        pywikibot.output('[%s] %i URLs queued for %i hosts, %i retried'
+                         % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), sum(depths.values()),
+                            len(depths), self.retried))
+        for host in sorted(depths, key=depths.get, reverse=True)[:limit]:
+            pywikibot.output('    %5i %s%s' % (
+                depths[host], host,
+                ' (backoff)' if self.notBefore.get(host, 0) > time.time()
+                else ''))
+
+
+class HostBreaker(object):
+
+    """
+    Stop loading URLs of hosts which cannot be reached.
+
+    Every host name is resolved once per run. A host whose name does not
+    exist, or whose last threshold checks all had the connection refused,
+    is down: its URLs are not loaded until coolOff seconds have passed.
+    Then its URLs are loaded again, and a single further refusal makes the
+    host down again. Timeouts and temporary failures to resolve a name do
+    not make a host down; the check engine retries them.
+
+    URLs not loaded are recorded dead with message, but their result is
+    not cached, so they are loaded again once the host is back.
+    """
+
+    message = 'Exception while connecting.'
+    # connection failures which make a host down
+    downFailures = ('refused', 'unresolved')
+    # seconds to wait before resolving a name again after EAI_AGAIN
+    resolveRetries = (1, 5)
+
+    def __init__(self, threshold=3, coolOff=10 * 60):
+        """Constructor."""
+        self.threshold = threshold
+        self.coolOff = coolOff
+        self.lock = threading.Lock()
+        # host -> True, or the error if it does not resolve
+        self.resolved = {}
+        # host -> number of connection failures in a row
+        self.failures = {}
+        # host -> end of its cool-off
+        self.downUntil = {}
+        # host -> number of times it was found down
+        self.opened = {}
+        # host -> number of URLs not loaded
+        self.skipped = {}
+
+    def resolve(self, url):
+        """
+        Return False if the host name of url does not exist, else True.
+
+        Only a name found not to exist is remembered; a temporary failure
+        (EAI_AGAIN) is retried after resolveRetries seconds, and if it
+        persists the name is resolved again for the next URL.
+
+        @rtype: bool
+        """
+        host = HostScheduler.host(url)
+        with self.lock:
+            if host in self.resolved:
+                return self.resolved[host] is True
+        parts = urlparse.urlsplit(url)
+        for wait in self.resolveRetries + (None, ):
+            try:
+                socket.getaddrinfo(parts.hostname, parts.port or (
+                    443 if parts.scheme == 'https' else 80))
+                resolved = True
+            except socket.gaierror as error:
+                if error.errno == socket.EAI_AGAIN:
+                    if wait is None:
+                        return True
+                    time.sleep(wait)
+                    continue
+                # other errors are left for the check to report
+                resolved = error if error.errno == socket.EAI_NONAME else True
+            except (UnicodeError, ValueError, TypeError):
+                # not a valid host name; let the check report it
+                resolved = True
+            break
+        with self.lock:
+            self.resolved[host] = resolved
+        return resolved is True
+
+    def down(self, url):
+        """
+        Return why url must not be loaded as its host is down, or None.
+
+        @return: 'refused' or 'unresolved'
+        @rtype: str or None
+        """
+        host = HostScheduler.host(url)
+        with self.lock:
+            if self.downUntil.get(host, 0) > time.time():
+                self.skipped[host] = self.skipped.get(host, 0) + 1
+                return 'refused'
+        if not self.resolve(url):
+            with self.lock:
+                self.skipped[host] = self.skipped.get(host, 0) + 1
+            return 'unresolved'
+        return None
+
+    def record(self, url, result):
+        """Count a refused connection of the host of url, or reset it."""
+        host = HostScheduler.host(url)
+        with self.lock:
+            if result.status is not None:
+                self.failures.pop(host, None)
+                return
+            if result.failure not in self.downFailures:
+                return
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if self.failures[host] < self.threshold:
+                return
+            self.failures[host] = self.threshold - 1
+            self.downUntil[host] = time.time() + self.coolOff
+            self.opened[host] = self.opened.get(host, 0) + 1
+        pywikibot.output('[%s] Host %s is down for %i s'
+                         % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), host, self.coolOff))
+
+    def report(self):
+        """Log the hosts found down and the URLs not loaded for them."""
+        unresolved = sorted(host for host, resolved in self.resolved.items()
+                            if resolved is not True)
+        hosts = sorted(set(unresolved) | set(self.opened),
+                       key=lambda host: -self.skipped.get(host, 0))
+        pywikibot.output('%i hosts not resolved, %i found down; %i URLs '
+                         'not loaded'
+                         % (len(unresolved), len(self.opened),
+                            sum(self.skipped.values())))
+        for host in hosts:
+            if host in self.opened:
+                state = 'down %i times%s' % (
+                    self.opened[host],
+                    ', still down' if self.downUntil[host] > time.time()
+                    else '')
+            else:
+                state = 'not resolved: %s' % self.resolved[host]
+            pywikibot.output('    %5i %s (%s)'
+                             % (self.skipped.get(host, 0), host, state))
+
+
+class ConcurrencyController(object):
+
+    """
+    Choose how many URLs are checked at the same time.
+
+    The limit is adapted after every window of as many finished checks as
+    the limit allows at once, but at least window checks: if more than
+    maxFailureRate of them failed to connect, or the median time of the
+    successful ones rose above latencyFactor times the lowest median seen
+    in the run, the network is taken as congested and the limit is halved;
+    otherwise it is raised by one. Failures are counted once per host, so
+    a single dead host with many links does not look like congestion, and
+    medians below minLatency seconds are taken as minLatency, so jitter of
+    fast answers does not either. The limit stays between minimum and
+    maximum; if adaptive is False it is always maximum.
+    """
+
+    def __init__(self, maximum, minimum=4, adaptive=True, window=20,
+                 maxFailureRate=0.1, latencyFactor=3.0, minLatency=0.5,
+                 reportInterval=60):
+        """Constructor."""
+        self.maximum = maximum
+        self.minimum = min(minimum, maximum)
+        self.adaptive = adaptive
+        self.window = window
+        self.maxFailureRate = maxFailureRate
+        self.latencyFactor = latencyFactor
+        self.minLatency = minLatency
+        self.reportInterval = reportInterval
+        if adaptive:
+            self.limit = max(self.minimum, maximum // 4)
+        else:
+            self.limit = maximum
+        self.condition = threading.Condition()
+        self.running = 0
+        # seconds of the successful checks and hosts which failed to
+        # connect in the current window
+        self.times = []
+        self.failedHosts = set()
+        self.finished = 0
+        self.baseline = None
+        self.raised = 0
+        self.lowered = 0
+        self.lowest = self.highest = self.limit
+        self.started = self.changed = self.lastReport = time.time()
+        # seconds spent at each limit
+        self.timeAt = {}
+
+    def acquire(self, block=True):
+        """
+        Take a slot for a check, waiting while the limit is reached.
+
+        @return: False if block is False and no slot is free
+        @rtype: bool
+        """
+        with self.condition:
+            while self.running >= self.limit:
+                if not block:
+                    return False
+                self.condition.wait(1)
+            self.running += 1
+            return True
+
+    def release(self):
+        """Give back the slot of a finished check."""
+        with self.condition:
+            self.running -= 1
+            self.condition.notify()
+
+    def observe(self, url, result, seconds):
+        """Count a finished check and adapt the limit after a window."""
+        if not self.adaptive:
+            return
+        with self.condition:
+            if (result.status is None
+                    and result.message == HostBreaker.message):
+                self.failedHosts.add(HostScheduler.host(url))
+            elif result.status is not None:
+                self.times.append(seconds)
+            self.finished += 1
+            if self.finished >= max(self.limit, self.window):
+                self._adapt()
+            if time.time() - self.lastReport > self.reportInterval:
+                self.report()
+
+    def _adapt(self):
+        """Set the limit for the next window; the lock is held."""
+        failureRate = len(self.failedHosts) / float(self.finished)
+        median = None
+        if self.times:
+            self.times.sort()
+            median = max(self.times[len(self.times) // 2],
+                         self.minLatency)
+            if self.baseline is None or median < self.baseline:
+                self.baseline = median
+        if failureRate > self.maxFailureRate:
+            self._set(max(self.minimum, self.limit // 2),
+                      'checks on %i hosts of the last %i failed to '
+                      'connect' % (len(self.failedHosts), self.finished))
+        elif (median is not None
+              and median > self.latencyFactor * self.baseline):
+            self._set(max(self.minimum, self.limit // 2),
+                      'median check time %.2f s, lowest %.2f s'
+                      % (median, self.baseline))
+        elif self.limit < self.maximum:
+            self._set(self.limit + 1, None)
+        self.times = []
+        self.failedHosts = set()
+        self.finished = 0
+
+    def _set(self, limit, reason):
+        """Change the limit, logging why it was lowered."""
+        now = time.time()
+        self.timeAt[self.limit] = (self.timeAt.get(self.limit, 0)
+                                   + now - self.changed)
+        self.changed = now
+        if limit > self.limit:
+            self.raised += 1
+            pywikibot.log('Concurrency raised to %i' % limit)
+        elif limit < self.limit:
+            self.lowered += 1
+            pywikibot.output('[%s] Concurrency lowered from %i to %i: %s'
+                             % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.limit, limit, reason))
+        self.limit = limit
+        self.lowest = min(self.lowest, limit)
+        self.highest = max(self.highest, limit)
+        self.condition.notify_all()
+
+    def report(self):
+        """Log the current limit and how it changed since the last report."""
+        self.lastReport = time.time()
+        pywikibot.output('[%s] Concurrency %i (%i running), raised %i '
+                         'times and lowered %i times so far'
+                         % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.limit, self.running,
+                            self.raised, self.lowered))
+
+    def summary(self):
+        """Log the range of limits used and their mean over the run."""
+        if not self.adaptive:
+            pywikibot.output('Concurrency fixed at %i' % self.limit)
+            return
+        with self.condition:
+            timeAt = dict(self.timeAt)
+            timeAt[self.limit] = (timeAt.get(self.limit, 0)
+                                  + time.time() - self.changed)
+        total = sum(timeAt.values())
+        mean = (sum(limit * seconds for limit, seconds in timeAt.items())
+                / total if total else self.limit)
+        pywikibot.output('Concurrency between %i and %i, %.1f on average, '
+                         '%i at the end; raised %i times, lowered %i times'
+                         % (self.lowest, self.highest, mean, self.limit,
+                            self.raised, self.lowered))
+
+
+class URLCheckCache(object):
+
+    """
+    Results of URL checks kept on disk between runs.
+
+    The results are stored in an SQLite file in the deadlinks subdirectory,
+    keyed by canonical_url(). A result found alive is reused for aliveTTL
+    seconds, any other result for deadTTL seconds. Dead results are still
+    recorded in History for every page, so the weblink_dead_days counting
+    goes on; keep deadTTL well below weblink_dead_days so that a link is
+    really checked again before it is reported.
+    """
+
+    def __init__(self, aliveTTL=7 * 24 * 60 * 60, deadTTL=24 * 60 * 60,
+                 filename=None):
+        """Constructor."""
+        self.aliveTTL = aliveTTL
+        self.deadTTL = deadTTL
+        self.filename = filename or pywikibot.config.datafilepath(
+            'deadlinks', 'urlcache.sqlite')
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.filename, check_same_thread=False,
+                                  timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS results ('
+                        'url TEXT PRIMARY KEY, state TEXT, status INTEGER, '
+                        'message TEXT, finalUrl TEXT, checked REAL, '
+                        'spelling TEXT)')
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        # hits for a URL spelled differently from the one checked
+        self.respelled = 0
+
+    def get(self, url):
+        """
+        Return the stored result for url if it is still fresh.
+
+        @rtype: LinkCheckResult or None
+        """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT state, status, message, finalUrl, checked, spelling '
+                'FROM results WHERE url = ?', (canonical_url(url), )
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            state, status, message, finalUrl, checked, spelling = row
+            ttl = self.aliveTTL if state == 'alive' else self.deadTTL
+            if time.time() - checked > ttl:
+                self.expired += 1
+                return None
+            self.hits += 1
+            if spelling != url:
+                self.respelled += 1
+        return LinkCheckResult(state, status, message, None, finalUrl, 0)
+
+    def put(self, url, result):
+        """Store result of checking url."""
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (canonical_url(url), result.state, result.status,
+                 result.message, result.finalUrl, time.time(), url))
+            self.db.commit()
+
+    def report(self):
+        """Log the hit rate of the cache."""
+        lookups = self.hits + self.misses + self.expired
+        pywikibot.output('URL cache: %i lookups, %i hits (%.1f%%), '
+                         '%i expired, %i misses; %i hits for another '
+                         'spelling of the URL'
+                         % (lookups, self.hits,
+                            100.0 * self.hits / lookups if lookups else 0,
+                            self.expired, self.misses, self.respelled))
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            self.db.close()
+
+
+class Histogram(object):
+
+    """Counts of observed values in cumulative buckets, as Prometheus has."""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        """Constructor."""
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Add value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return a list of (upper bound, number of values up to it)."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + ('+Inf', ), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics(object):
+
+    """
+    Throughput, latency and status counts of a run.
+
+    With -metrics:filename they are written every interval seconds to
+    that file in the Prometheus text format (for the textfile collector
+    of the node exporter), and at the end of the run as a JSON summary to
+    the same name with .json instead of its extension.
+    """
+
+    def __init__(self, filename, interval=60, hosts=20):
+        """Constructor."""
+        self.filename = filename
+        self.interval = interval
+        # number of hosts with their own histogram in the text file
+        self.hosts = hosts
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.urls = 0
+        self.pages = 0
+        self.bytes = 0
+        self.statuses = {}
+        self.latency = Histogram()
+        self.hostLatency = {}
+        self.engine = None
+        self.history = None
+        self.last = (self.started, 0, 0)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._write_periodically)
+        self.thread.daemon = True
+
+    def start(self, engine, history):
+        """Start writing the metrics of engine and history."""
+        self.engine = engine
+        self.history = history
+        self.thread.start()
+
+    def observe(self, url, result, seconds):
+        """Count a finished check of url."""
+        host = HostScheduler.host(url)
+        status = str(result.status) if result.status else result.state
+        with self.lock:
+            self.urls += 1
+            self.bytes += result.size
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.latency.observe(seconds)
+            self.hostLatency.setdefault(host, Histogram()).observe(seconds)
+
+    def page(self, count=1):
+        """Count pages whose links were submitted."""
+        with self.lock:
+            self.pages += count
+
+    def gauges(self):
+        """Return the current gauges as a dict."""
+        queued, running = (self.engine.scheduler.counts()
+                           if hasattr(self.engine, 'scheduler') else (0, 0))
+        now = time.time()
+        last, urls, pages = self.last
+        elapsed = max(now - last, 1e-6)
+        self.last = (now, self.urls, self.pages)
+        controller = getattr(self.engine, 'controller', None)
+        return {
+            'inflight': running,
+            'queue_depth': queued,
+            'concurrency_limit': (controller.limit if controller
+                                  else config.max_external_links),
+            'urls_per_second': (self.urls - urls) / elapsed,
+            'pages_per_second': (self.pages - pages) / elapsed,
+            'history_lock_wait_seconds': (self.history.lockWait
+                                          if self.history else 0),
+            'history_lock_acquired': (self.history.lockCount
+                                      if self.history else 0),
+        }
+
+    @staticmethod
+    def _histogram_lines(name, histogram, labels=''):
+        """Return the lines of histogram in the text format."""
+        lines = []
+        for bound, count in histogram.cumulative():
+            lines.append('%s_bucket{%sle="%s"} %i'
+                         % (name, labels, bound, count))
+        labels = '{%s}' % labels.rstrip(',') if labels else ''
+        lines.append('%s_sum%s %f' % (name, labels, histogram.sum))
+        lines.append('%s_count%s %i' % (name, labels, histogram.count))
+        return lines
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text format."""
+        gauges = self.gauges()
+        with self.lock:
+            lines = [
+                '# TYPE wlc_urls_checked_total counter',
+                'wlc_urls_checked_total %i' % self.urls,
+                '# TYPE wlc_pages_total counter',
+                'wlc_pages_total %i' % self.pages,
+                '# TYPE wlc_bytes_total counter',
+                'wlc_bytes_total %i' % self.bytes,
+                '# TYPE wlc_responses_total counter',
+            ]
+            for status, count in sorted(self.statuses.items()):
+                lines.append('wlc_responses_total{status="%s"} %i'
+                             % (status, count))
+            lines.append('# TYPE wlc_check_seconds histogram')
+            lines += self._histogram_lines('wlc_check_seconds', self.latency)
+            lines.append('# TYPE wlc_host_check_seconds histogram')
+            for host in sorted(self.hostLatency,
+                               key=lambda host: -self.hostLatency[host].count
+                               )[:self.hosts]:
+                lines += self._histogram_lines(
+                    'wlc_host_check_seconds', self.hostLatency[host],
+                    'host="%s",' % host.replace('\\', '\\\\').replace(
+                        '"', '\\"'))
+        for name, value in sorted(gauges.items()):
+            kind = 'counter' if name.startswith('history') else 'gauge'
+            if kind == 'counter':
+                name += '_total'
+            lines.append('# TYPE wlc_%s %s' % (name, kind))
+            lines.append('wlc_%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        """Write the text file, replacing it at once."""
+        text = self.prometheus()
+        with codecs.open(self.filename + '.tmp', 'w', 'utf-8') as f:
+            f.write(text)
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def _write_periodically(self):
+        """Write the text file every interval seconds."""
+        while not self.stopping.wait(self.interval):
+            try:
+                self.write()
+            except Exception:
+                pywikibot.exception()
+
+    def summary(self):
+        """Return the metrics of the whole run as a dict."""
+        elapsed = time.time() - self.started
+        with self.lock:
+            hosts = sorted(self.hostLatency.items(),
+                           key=lambda item: -item[1].count)[:100]
+            return {
+                'seconds': elapsed,
+                'urls': self.urls,
+                'pages': self.pages,
+                'bytes': self.bytes,
+                'urls_per_second': self.urls / elapsed if elapsed else 0,
+                'pages_per_second': self.pages / elapsed if elapsed else 0,
+                'statuses': dict(self.statuses),
+                'latency': {
+                    'buckets': self.latency.cumulative(),
+                    'sum': self.latency.sum,
+                    'count': self.latency.count,
+                },
+                'hosts': dict((host, {
+                    'buckets': histogram.cumulative(),
+                    'sum': histogram.sum,
+                    'count': histogram.count,
+                }) for host, histogram in hosts),
+                'history_lock_wait_seconds': (self.history.lockWait
+                                              if self.history else 0),
+                'history_lock_acquired': (self.history.lockCount
+                                          if self.history else 0),
+            }
+
+    def stop(self):
+        """Stop writing periodically and write the JSON summary."""
+        self.stopping.set()
+        self.write()
+        filename = os.path.splitext(self.filename)[0] + '.json'
+        with codecs.open(filename, 'w', 'utf-8') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+        pywikibot.output('Metrics written to %s and %s'
+                         % (self.filename, filename))
+
+
+class LinkCheckEngine(object):
+
+    """
+    Base class of the check engines.
+
+    URLs are put on a HostScheduler by submit() and checked by process();
+    subclasses decide how process() is run. With a URLCheckCache, fresh
+    results from earlier checks are recorded without loading the URL.
+
+    A URL is loaded only once at a time: when it is submitted again while
+    its check is queued or running, the page just subscribes to that check
+    and the result is recorded for every subscribed page.
+    """
+
+    name = None
+    # connection failures worth another try, and how many
+    retryFailures = ('timeout', 'dns')
+    failureRetries = 1
+
+    def __init__(self, history, HTTPignore, day, maxPerHost=4, cache=None,
+                 method='get', breaker=None, adaptive=True):
+        """Constructor."""
+        self.history = history
+        self.cache = cache
+        self.HTTPignore = HTTPignore
+        self.day = day
+        self.header = {
+            'Accept': 'text/xml,application/xml,application/xhtml+xml,'
+                      'text/html;q=0.9,text/plain;q=0.8,image/png,*/*;q=0.5',
+            'Accept-Language': 'de-de,de;q=0.8,en-us;q=0.5,en;q=0.3',
+            'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.7',
+            'Keep-Alive': '30',
+            'Connection': 'keep-alive',
+        }
+        self._use_fake_user_agent = config.fake_user_agent_default.get(
+            'weblinkchecker', False)
+        self.scheduler = HostScheduler(maxPerHost)
+        self.controller = ConcurrencyController(config.max_external_links,
+                                                adaptive=adaptive)
+        # canonical URL -> list of (page, url) waiting for its check
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.duplicates = 0
+        # checks saved because another spelling of the URL was checked
+        self.respelled = 0
+        self.bytes = 0
+        # called with page and URL before a dead link is recorded
+        self.confirm = None
+        # called with page and URL of every result
+        self.recorded = None
+        # called with page and URL of every check which raised an exception
+        self.failed = None
+        self.metrics = None
+        self.breaker = breaker
+        if method == 'head':
+            self.headChecker = HeadChecker(self.HTTPignore, self.header,
+                                           self._use_fake_user_agent)
+        else:
+            self.headChecker = None
+
+    def submit(self, page, url):
+        """Queue url found on page, waiting while the queue is full."""
+        try:
+            HostScheduler.host(url)
+        except ValueError:
+            # e.g. 'Invalid IPv6 URL' for http://[foo.pl/; it has no host
+            # to be scheduled for, and loading it would fail the same way
+            with self.lock:
+                self.submitted += 1
+            self.record(page, url, LinkCheckResult(
+                'dead', None, u'Podany link nie jest prawidłowym adresem URL',
+                None, None, 0))
+            return
+        key = canonical_url(url)
+        with self.lock:
+            self.submitted += 1
+            if key in self.subscribers:
+                self.duplicates += 1
+                if all(spelling != url
+                       for subscriber, spelling in self.subscribers[key]):
+                    self.respelled += 1
+                if not any(subscriber.title() == page.title()
+                           for subscriber, spelling in self.subscribers[key]):
+                    self.subscribers[key].append((page, url))
+                return
+            if self.cache:
+                result = self.cache.get(url)
+                if result:
+                    pywikibot.output('[%s] CACHED status:%s in [%s - %s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), result.status, page.title(), url))
+            else:
+                result = None
+            if not result:
+                self.subscribers[key] = [(page, url)]
+        if result:
+            self.record(page, url, result)
+        else:
+            self.scheduler.put(page, url)
+
+    def process(self, page, url, attempt):
+        """
+        Check url and record the result.
+
+        It is put back on 429 and 503, and once after a timeout or a
+        temporary failure to resolve the host name. If the host is down,
+        url is not loaded and recorded dead, but the result is not cached.
+        """
+        try:
+            failure = self.breaker.down(url) if self.breaker else None
+            if failure:
+                pywikibot.output('[%s] Host down, not loaded: [%s - %s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), page.title(), url))
+                result = LinkCheckResult('dead', None, self.breaker.message,
+                                         None, None, 0, failure)
+                with self.lock:
+                    subscribers = self.subscribers.pop(canonical_url(url),
+                                                       [(page, url)])
+                for subscriber, spelling in subscribers:
+                    self.record(subscriber, spelling, result)
+                return
+            started = time.time()
+            if self.headChecker:
+                result = self.headChecker.check(page, url)
+            else:
+                result = check_url(page, url, self.HTTPignore,
+                                   self.header, self._use_fake_user_agent)
+            seconds = time.time() - started
+            self.controller.observe(url, result, seconds)
+            if self.metrics:
+                self.metrics.observe(url, result, seconds)
+            if self.breaker:
+                self.breaker.record(url, result)
+            with self.lock:
+                self.bytes += result.size
+            retry = (result.status in self.scheduler.retryStatus
+                     or (result.failure in self.retryFailures
+                         and attempt < self.failureRetries))
+            if (not retry
+                    or not self.scheduler.retry(page, url, attempt,
+                                                result.retryAfter)):
+                if self.cache:
+                    self.cache.put(url, result)
+                with self.lock:
+                    subscribers = self.subscribers.pop(canonical_url(url),
+                                                       [(page, url)])
+                for subscriber, spelling in subscribers:
+                    self.record(subscriber, spelling, result)
+        except Exception:
+            with self.lock:
+                subscribers = self.subscribers.pop(canonical_url(url),
+                                                   [(page, url)])
+            if self.failed:
+                for subscriber, spelling in subscribers:
+                    self.failed(subscriber, spelling)
+            raise
+        finally:
+            self.scheduler.done(url)
+
+    def inflight(self):
+        """
+        Return the URLs whose check has not been recorded yet.
+
+        @rtype: list of (page title, URL)
+        """
+        with self.lock:
+            return [(page.title(), url)
+                    for subscribers in self.subscribers.values()
+                    for page, url in subscribers]
+
+    def record(self, page, url, result):
+        """Store result in the history unless confirm rejects it."""
+        if self.recorded:
+            self.recorded(page, url)
+        if (result.state == 'dead' and self.confirm
+                and not self.confirm(page, url)):
+            return
+        record_link(self.history, page, url, result)
+
+    def pending(self):
+        """Return the number of URLs queued or being checked."""
+        return self.scheduler.pending()
+
+    def drain(self, stall=10 * 60):
+        """
+        Wait until all queued and running checks are finished.
+
+        There is no time limit as long as checks finish or URLs wait for
+        the backoff of their host, which may last up to an hour. Waiting
+        stops if neither happened for stall seconds, or on Ctrl-C.
+
+        @return: the number of URLs left unchecked
+        @rtype: int
+        """
+        finished = self.scheduler.finished
+        lastProgress = time.time()
+        lastReport = 0
+        try:
+            while self.pending() > 0:
+                now = time.time()
+                if (self.scheduler.finished != finished
+                        or self.scheduler.backingOff()):
+                    finished = self.scheduler.finished
+                    lastProgress = now
+                elif now - lastProgress > stall:
+                    pywikibot.output(u'No check finished for %i s, giving up.'
+                                     % stall)
+                    break
+                if now - lastReport >= 10:
+                    lastReport = now
+                    pywikibot.output(u"Waiting for remaining %i URLs to "
+                                     u"be checked, please wait..."
+                                     % self.pending())
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pywikibot.output(u'Interrupted.')
+        left = self.pending()
+        if left:
+            pywikibot.output(u'%i URLs were left unchecked.' % left)
+        return left
+
+    def stop(self):
+        """Stop checking; checks still running end with the bot."""
+        running = self.scheduler.counts()[1]
+        if running:
+            pywikibot.output(u'Remaining %i checks will be killed.' % running)
+
+    def shutdown(self, stall=10 * 60):
+        """Wait for queued and running checks, then log statistics."""
+        self.drain(stall)
+        self.stop()
+        self.summary()
+
+    def summary(self):
+        """Log statistics of the run."""
+        self.scheduler.report()
+        self.controller.summary()
+        pywikibot.output('%i URLs submitted, %i (%.1f%%) joined a check '
+                         'already in progress'
+                         % (self.submitted, self.duplicates,
+                            100.0 * self.duplicates / self.submitted
+                            if self.submitted else 0))
+        pywikibot.output('%i checks saved by canonical URLs: the URL was '
+                         'spelled differently from the one being checked'
+                         % self.respelled)
+        pywikibot.output('%.1f MB transferred' % (self.bytes / 1048576.0))
+        if self.headChecker:
+            self.headChecker.report()
+        if self.confirm:
+            self.confirm.report()
+        if self.breaker:
+            self.breaker.report()
+        if self.cache:
+            self.cache.report()
+
+
+class LinkCheckThread(threading.Thread):
+
+    """A thread responsible for checking one URL.
+
+    After checking the page, it will die.
+    """
+
+    def __init__(self, page, url, engine, attempt=0):
+        """Constructor."""
+        threading.Thread.__init__(self)
+        self.page = page
+        self.url = url
+        self.engine = engine
+        self.attempt = attempt
+        # identification for debugging purposes
+        self.setName((u'%s - %s' % (page.title(), url)).encode('utf-8',
+                                                               'replace'))
+
+    def run(self):
+        """Run the bot."""
+        try:
+            self.engine.process(self.page, self.url, self.attempt)
+        finally:
+            self.engine.controller.release()
+
+
+class ThreadCheckEngine(LinkCheckEngine):
+
+    """
+    Check links by starting a LinkCheckThread for every URL.
+
+    A dispatcher thread takes URLs from the scheduler and starts a thread
+    for each of them; no more run at the same time than the
+    ConcurrencyController allows.
+    """
+
+    name = 'thread'
+
+    def __init__(self, *args, **kwargs):
+        """Constructor."""
+        super(ThreadCheckEngine, self).__init__(*args, **kwargs)
+        self.dispatcher = threading.Thread(target=self.dispatch,
+                                           name='ThreadCheckEngine')
+        self.dispatcher.setDaemon(True)
+        self.dispatcher.start()
+
+    def dispatch(self):
+        """Start a LinkCheckThread for every URL from the scheduler."""
+        while True:
+            self.controller.acquire()
+            page, url, attempt = self.scheduler.get()
+            thread = LinkCheckThread(page, url, self, attempt)
+            # thread dies when program terminates
+            thread.setDaemon(True)
+            try:
+                thread.start()
+            except threading.ThreadError:
+                pywikibot.warning(
+                    "Can't start a new thread.\nPlease decrease "
+                    "max_external_links in your user-config.py or use\n"
+                    "'-max_external_links:' option with a smaller value. "
+                    "Default is 50.")
+                self.controller.release()
+                self.scheduler.done(url)
+                self.scheduler.put(page, url, attempt, block=False)
+                time.sleep(config.retry_wait)
+
+    def stop(self):
+        """Leave the threads still running to die with the bot."""
+        if countLinkCheckThreads() > 0:
+            pywikibot.output(u'Remaining %i threads will be killed.'
+                             % countLinkCheckThreads())
+            # Threads will die automatically because they are daemonic.
+
+
+class AsyncCheckEngine(LinkCheckEngine):
+
+    """
+    Check links with a fixed set of workers running in an asyncio loop.
+
+    The loop runs in its own thread with max_external_links long-lived
+    worker tasks which take URLs from the scheduler; those beyond the limit
+    of the ConcurrencyController wait for it to rise. The HTTP requests are
+    blocking calls of comms.http.fetch; they run in a thread pool of the
+    same size and share pywikibot's HTTP session, so connections to a host
+    are kept alive between URLs.
+    """
+
+    name = 'async'
+
+    def __init__(self, *args, **kwargs):
+        """Constructor."""
+        if isinstance(asyncio, ImportError):
+            raise asyncio
+        super(AsyncCheckEngine, self).__init__(*args, **kwargs)
+        self.workers = config.max_external_links
+        self.executor = ThreadPoolExecutor(self.workers)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       name='AsyncCheckEngine')
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self._call(self._start())
+
+    def _call(self, coro, timeout=None):
+        """Run coro in the loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(
+            timeout)
+
+    async def _start(self):
+        """Create the workers inside the loop."""
+        self.stopping = False
+        self.wakeup = asyncio.Event()
+        self.tasks = [self.loop.create_task(self._worker())
+                      for i in range(self.workers)]
+
+    async def _worker(self):
+        """Check URLs from the scheduler until the engine is stopped."""
+        while not self.stopping:
+            if not self.controller.acquire(block=False):
+                await asyncio.sleep(1)
+                continue
+            item = self.scheduler.get(block=False)
+            if item is None:
+                self.controller.release()
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(),
+                                           self.scheduler.waitTime())
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.loop.run_in_executor(self.executor, self.process,
+                                                *item)
+            except Exception as e:
+                pywikibot.error('Checking %s failed: %r' % (item[1], e))
+            finally:
+                self.controller.release()
+
+    def submit(self, page, url):
+        """Queue url found on page, waiting while the queue is full."""
+        super(AsyncCheckEngine, self).submit(page, url)
+        self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def _stop(self):
+        """Stop the workers once their running checks are finished."""
+        self.stopping = True
+        self.wakeup.set()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def stop(self):
+        """Stop the workers and the loop."""
+        try:
+            self._call(self._stop())
+        except KeyboardInterrupt:
+            pywikibot.output(u'Interrupted.')
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+
+
+class JobQueue(object):
+
+    """
+    Links to check shared by several wlc.py processes.
+
+    A coordinator (-coordinator) puts the links of its pages into a job
+    table in an SQLite file in the deadlinks subdirectory. Any number of
+    workers (-worker) claim batches of jobs with a lease, check them and
+    delete them when their results are recorded. Jobs whose lease has
+    expired, because their worker died, are claimed again by another one.
+    A job claimed maxAttempts times without being done is given up and
+    left in the table.
+
+    The coordinator renews a lease of its own while it adds jobs; if it
+    dies, the workers stop waiting for more jobs once that lease expires.
+    """
+
+    maxAttempts = 3
+    coordinatorLease = 5 * 60
+
+    def __init__(self, site):
+        """Constructor."""
+        self.filename = pywikibot.config.datafilepath(
+            'deadlinks', 'jobs-%s-%s.sqlite' % (site.family.name, site.code))
+        self.lock = threading.Lock()
+        # transactions are begun explicitly, so that claims are atomic
+        self.db = sqlite3.connect(self.filename, check_same_thread=False,
+                                  timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                        'id INTEGER PRIMARY KEY, title TEXT, url TEXT, '
+                        'worker TEXT, lease REAL DEFAULT 0, '
+                        'attempts INTEGER DEFAULT 0)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_lease '
+                        'ON jobs (lease)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS state ('
+                        'name TEXT PRIMARY KEY, value)')
+
+    def add(self, links):
+        """Add jobs for a list of (page title, URL)."""
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.executemany('INSERT INTO jobs (title, url) VALUES (?, ?)',
+                                links)
+            self.db.execute('COMMIT')
+
+    def claim(self, worker, size, leaseTime):
+        """
+        Take up to size jobs which are not leased to another worker.
+
+        @rtype: list of (id, page title, URL)
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                jobs = self.db.execute(
+                    'SELECT id, title, url FROM jobs WHERE lease < ? '
+                    'AND attempts < ? ORDER BY id LIMIT ?',
+                    (now, self.maxAttempts, size)).fetchall()
+                self.db.executemany(
+                    'UPDATE jobs SET worker = ?, lease = ?, '
+                    'attempts = attempts + 1 WHERE id = ?',
+                    [(worker, now + leaseTime, job[0]) for job in jobs])
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+            self.db.execute('COMMIT')
+        return jobs
+
+    def renew(self, worker, leaseTime):
+        """Extend the leases of all jobs of worker."""
+        with self.lock:
+            self.db.execute('UPDATE jobs SET lease = ? WHERE worker = ?',
+                            (time.time() + leaseTime, worker))
+
+    def done(self, ids):
+        """Remove finished jobs."""
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.executemany('DELETE FROM jobs WHERE id = ?',
+                                [(i, ) for i in ids])
+            self.db.execute('COMMIT')
+
+    def release(self, ids):
+        """Give up the leases of jobs, so that any worker may claim them."""
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.executemany('UPDATE jobs SET worker = NULL, lease = 0 '
+                                'WHERE id = ?', [(i, ) for i in ids])
+            self.db.execute('COMMIT')
+
+    def failed(self):
+        """Return the number of jobs given up."""
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM jobs '
+                                   'WHERE attempts >= ?',
+                                   (self.maxAttempts, )).fetchone()[0]
+
+    def setEnumerating(self, enumerating):
+        """
+        Record whether the coordinator is still adding jobs.
+
+        While it is, it must call this again within coordinatorLease
+        seconds, or it is taken as dead.
+        """
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                            ('enumerating', time.time()
+                             + self.coordinatorLease if enumerating else 0))
+
+    def finished(self):
+        """Return True if no more jobs will come and all jobs are done."""
+        with self.lock:
+            enumerating = self.db.execute(
+                'SELECT value FROM state WHERE name = ?',
+                ('enumerating', )).fetchone()
+            left = self.db.execute('SELECT COUNT(*) FROM jobs '
+                                   'WHERE attempts < ?',
+                                   (self.maxAttempts, )).fetchone()[0]
+        return not (enumerating and enumerating[0] > time.time()) and not left
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            self.db.close()
+
+
+class JobSubmitter(object):
+
+    """
+    Check engine of the coordinator: it only adds the links to a JobQueue.
+
+    The links are written in batches; inflight() writes the pending batch,
+    so a checkpoint never covers links which are not in the queue yet.
+    """
+
+    name = 'jobs'
+    batch = 500
+
+    def __init__(self, history, HTTPignore, day, **kwargs):
+        """Constructor."""
+        self.history = history
+        self.cache = None
+        self.jobs = JobQueue(history.site)
+        self.jobs.setEnumerating(True)
+        self.links = []
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.stopping = threading.Event()
+        self.heartbeat = threading.Thread(target=self._renew,
+                                          name='JobSubmitter')
+        self.heartbeat.setDaemon(True)
+        self.heartbeat.start()
+
+    def _renew(self):
+        """Renew the lease of the coordinator until shutdown."""
+        while not self.stopping.wait(JobQueue.coordinatorLease / 3):
+            try:
+                self.jobs.setEnumerating(True)
+            except Exception:
+                pywikibot.exception()
+
+    def submit(self, page, url):
+        """Add a job for url found on page."""
+        with self.lock:
+            self.links.append((page.title(), url))
+            self.submitted += 1
+            full = len(self.links) >= self.batch
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write the links not yet in the queue."""
+        with self.lock:
+            links, self.links = self.links, []
+        if links:
+            self.jobs.add(links)
+
+    def inflight(self):
+        """Write the pending links; none are left in flight then."""
+        self.flush()
+        return []
+
+    def pending(self):
+        """Return the number of links not yet written."""
+        return len(self.links)
+
+    def shutdown(self, stall=None):
+        """Write the pending links and tell the workers all are queued."""
+        self.stopping.set()
+        self.heartbeat.join()
+        self.flush()
+        self.jobs.setEnumerating(False)
+        self.summary()
+        self.jobs.close()
+
+    def summary(self):
+        """Log statistics of the run."""
+        pywikibot.output('%i links queued in %s'
+                         % (self.submitted, self.jobs.filename))
+
+
+check_engines = {
+    ThreadCheckEngine.name: ThreadCheckEngine,
+    AsyncCheckEngine.name: AsyncCheckEngine,
+    JobSubmitter.name: JobSubmitter,
+}
+
+
+class DeadLinkEntry(object):
+
+    """
+    One time a URL was found dead: the page title, the date and the error.
+
+    It unpacks and compares like the (title, date, error) tuple which it
+    replaces, without the cost of a tuple and a float object per entry
+    when many of them are held.
+    """
+
+    __slots__ = ('title', 'date', 'error')
+
+    def __init__(self, title, date, error):
+        """Constructor."""
+        self.title = title
+        self.date = date
+        self.error = error
+
+    def __iter__(self):
+        """Iterate over title, date and error."""
+        return iter((self.title, self.date, self.error))
+
+    def __len__(self):
+        """Return 3, as for the tuple."""
+        return 3
+
+    def __getitem__(self, index):
+        """Return title, date or error as for the tuple."""
+        return (self.title, self.date, self.error)[index]
+
+    def __eq__(self, other):
+        """Compare with an entry or a tuple."""
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        """Compare with an entry or a tuple."""
+        return not self == other
+
+    def __hash__(self):
+        """Hash as the tuple."""
+        return hash(tuple(self))
+
+    def __repr__(self):
+        """Return the representation of the tuple."""
+        return '%s%r' % (self.__class__.__name__, tuple(self))
+
+
+class DeadLinkStore(object):
+
+    """
+    Dead link history kept in an SQLite file.
+
+    It replaces the dictionary which used to be pickled to the .dat file:
+    every change is written as its own small transaction, so nothing is
+    lost when the bot dies, and opening the store does not load anything.
+    Each row of the deadlinks table is one time a URL was found dead. Page
+    titles and errors are stored once in tables of their own and the rows
+    refer to them by id. The read methods mimic the old dictionary,
+    mapping a URL to its list of DeadLinkEntry in the order they were
+    added.
+
+    URLs are looked up by canonical_url(), so every spelling of a URL
+    shares its entries. Each row keeps the URL as it was spelled when it
+    was found dead, and items() gives the first spelling of a URL.
+
+    A store opened readonly, e.g. by another script while wlc.py runs, is
+    neither created nor changed.
+    """
+
+    # raise whenever canonical_url() changes, to rebuild the keys
+    keyVersion = 1
+    # URLs read at a time by items()
+    batchSize = 1000
+
+    entryQuery = ('SELECT {0} titles.title, deadlinks.date, errors.error '
+                  'FROM deadlinks '
+                  'LEFT JOIN titles ON titles.id = deadlinks.titleId '
+                  'LEFT JOIN errors ON errors.id = deadlinks.errorId ')
+
+    def __init__(self, filename, readonly=False):
+        """
+        Constructor.
+
+        @raises IOError: readonly and the file does not exist
+        """
+        self.filename = filename
+        self.readonly = readonly
+        self.lock = threading.RLock()
+        self.db = self._connect()
+        if readonly:
+            return
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.create_function('canonical_url', 1, canonical_url)
+        self._create()
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != self.keyVersion:
+            self.db.execute('UPDATE deadlinks SET key = canonical_url(url)')
+            self.db.execute('PRAGMA user_version = %i' % self.keyVersion)
+        self.db.commit()
+
+    def _connect(self):
+        """Return a new connection to the file."""
+        if not self.readonly:
+            return sqlite3.connect(self.filename, check_same_thread=False,
+                                   timeout=60)
+        if not os.path.exists(self.filename):
+            raise IOError('%s does not exist' % self.filename)
+        return sqlite3.connect('file:%s?mode=ro' % urlparse.quote(
+            os.path.abspath(self.filename)), uri=True,
+            check_same_thread=False, timeout=60)
+
+    def _create(self):
+        """Create the tables and indexes which do not exist yet."""
+        self.db.execute('CREATE TABLE IF NOT EXISTS titles ('
+                        'id INTEGER PRIMARY KEY, title TEXT UNIQUE)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS errors ('
+                        'id INTEGER PRIMARY KEY, error TEXT UNIQUE)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS deadlinks ('
+                        'id INTEGER PRIMARY KEY, url TEXT NOT NULL, '
+                        'key TEXT, titleId INTEGER, date REAL, '
+                        'errorId INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS deadlinks_key '
+                        'ON deadlinks (key)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS deadlinks_title '
+                        'ON deadlinks (titleId)')
+
+    def _execute(self, sql, args=()):
+        """Execute a changing statement and commit it."""
+        with self.lock:
+            cursor = self.db.execute(sql, args)
+            self.db.commit()
+        return cursor
+
+    def _query(self, sql, args=()):
+        """Return all rows of a query."""
+        with self.lock:
+            return self.db.execute(sql, args).fetchall()
+
+    def _id(self, table, column, value):
+        """Return the id of value in table, adding it if needed."""
+        row = self.db.execute('SELECT id FROM {0} WHERE {1} = ?'.format(
+            table, column), (value, )).fetchone()
+        if row:
+            return row[0]
+        return self.db.execute('INSERT INTO {0} ({1}) VALUES (?)'.format(
+            table, column), (value, )).lastrowid
+
+    def _insert(self, url, entries, key=None):
+        """Insert entries of url; the lock is held."""
+        key = key or canonical_url(url)
+        self.db.executemany(
+            'INSERT INTO deadlinks (url, key, titleId, date, errorId) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(url, key, self._id('titles', 'title', title), date,
+              self._id('errors', 'error', error))
+             for title, date, error in entries])
+
+    def get(self, url, default=None):
+        """Return the list of DeadLinkEntry of url."""
+        rows = self._query(self.entryQuery.format('')
+                           + 'WHERE deadlinks.key = ? ORDER BY deadlinks.id',
+                           (canonical_url(url), ))
+        return [DeadLinkEntry(*row) for row in rows] or default
+
+    def __getitem__(self, url):
+        """Return the list of DeadLinkEntry of url."""
+        entries = self.get(url)
+        if entries is None:
+            raise KeyError(url)
+        return entries
+
+    def __contains__(self, url):
+        """Return True if url was found dead before."""
+        return bool(self._query('SELECT 1 FROM deadlinks WHERE key = ? '
+                                'LIMIT 1', (canonical_url(url), )))
+
+    def dates(self, url):
+        """
+        Return when url was found dead for the first and the last time.
+
+        @rtype: tuple of (float, float) or None
+        """
+        first, last = self._query('SELECT MIN(date), MAX(date) '
+                                  'FROM deadlinks WHERE key = ?',
+                                  (canonical_url(url), ))[0]
+        return None if first is None else (first, last)
+
+    def append(self, url, entry):
+        """Add a (title, date, error) entry to url."""
+        with self.lock:
+            self._insert(url, [entry])
+            self.db.commit()
+
+    def __setitem__(self, url, entries):
+        """Replace the entries of url."""
+        key = canonical_url(url)
+        with self.lock:
+            self.db.execute('DELETE FROM deadlinks WHERE key = ?', (key, ))
+            self._insert(url, entries, key)
+            self.db.commit()
+
+    def __delitem__(self, url):
+        """Forget url."""
+        if not self._execute('DELETE FROM deadlinks WHERE key = ?',
+                             (canonical_url(url), )).rowcount:
+            raise KeyError(url)
+
+    def __len__(self):
+        """Return the number of URLs."""
+        return self._query('SELECT COUNT(DISTINCT key) FROM deadlinks')[0][0]
+
+    def __bool__(self):
+        """Return True if there is any URL."""
+        return bool(self._query('SELECT 1 FROM deadlinks LIMIT 1'))
+
+    __nonzero__ = __bool__
+
+    def items(self):
+        """
+        Iterate over (url, entries) pairs, sorted by canonical URL.
+
+        The URL is the first spelling found dead. The entries are read
+        batchSize URLs at a time, each batch by a query of its own, so no
+        read transaction stays open while iterating: the store can be
+        changed meanwhile, and the WAL file can be checkpointed.
+        """
+        last = ''
+        while True:
+            keys = self._query('SELECT DISTINCT key FROM deadlinks '
+                               'WHERE key > ? ORDER BY key LIMIT ?',
+                               (last, self.batchSize))
+            if not keys:
+                return
+            rows = self._query(
+                self.entryQuery.format('deadlinks.key, deadlinks.url,')
+                + 'WHERE deadlinks.key > ? AND deadlinks.key <= ? '
+                'ORDER BY deadlinks.key, deadlinks.id',
+                (last, keys[-1][0]))
+            last = keys[-1][0]
+            for key, group in groupby(rows, key=lambda row: row[0]):
+                group = list(group)
+                yield group[0][1], [DeadLinkEntry(*row[2:]) for row in group]
+
+    def keys(self):
+        """Iterate over the URLs."""
+        for url, entries in self.items():
+            yield url
+
+    __iter__ = keys
+
+    def values(self):
+        """Iterate over the lists of entries."""
+        for url, entries in self.items():
+            yield entries
+
+    def spellings(self, url):
+        """
+        Return how url was spelled on the pages where it was found dead.
+
+        @rtype: list of (page title, URL)
+        """
+        return self._query('SELECT DISTINCT titles.title, deadlinks.url '
+                           'FROM deadlinks '
+                           'LEFT JOIN titles ON titles.id = deadlinks.titleId '
+                           'WHERE deadlinks.key = ? ORDER BY deadlinks.id',
+                           (canonical_url(url), ))
+
+    def titles(self):
+        """Return the sorted titles of the pages with dead links."""
+        return [row[0] for row in self._query(
+            'SELECT title FROM titles WHERE id IN '
+            '(SELECT titleId FROM deadlinks) ORDER BY title')]
+
+    def migrate(self, datfilename):
+        """
+        Import a dictionary pickled by former versions of History.
+
+        The .dat file is renamed afterwards so that it is imported once.
+        """
+        pywikibot.output('Migrating %s to %s...'
+                         % (datfilename, self.filename))
+        with open(datfilename, 'rb') as datfile:
+            historyDict = pickle.load(datfile)
+        with self.lock:
+            for url, entries in historyDict.items():
+                self._insert(url, entries)
+            self.db.commit()
+        os.rename(datfilename, datfilename + '.migrated')
+        pywikibot.output('%i URLs migrated' % len(historyDict))
+
+    def sync(self):
+        """Commit pending changes."""
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            self.db.close()
+
+
+class ArchiveCache(object):
+
+    """
+    Archived copies of URLs found by earlier runs.
+
+    The results are stored in an SQLite file in the deadlinks subdirectory,
+    keyed by canonical_url(). A found archive URL is kept for good; that no
+    archived copy exists is remembered for missingTTL seconds only, as the
+    archives keep growing.
+    """
+
+    def __init__(self, missingTTL=7 * 24 * 60 * 60, filename=None):
+        """Constructor."""
+        self.missingTTL = missingTTL
+        self.filename = filename or pywikibot.config.datafilepath(
+            'deadlinks', 'archivecache.sqlite')
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.filename, check_same_thread=False,
+                                  timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS archives ('
+                        'url TEXT PRIMARY KEY, archiveURL TEXT, '
+                        'checked REAL)')
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url):
+        """
+        Return the stored lookup result for url.
+
+        @return: (True, archive URL or None) if there is a valid result,
+            else (False, None)
+        @rtype: tuple
+        """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT archiveURL, checked FROM archives WHERE url = ?',
+                (canonical_url(url), )).fetchone()
+            if row is None or (row[0] is None
+                               and time.time() - row[1] > self.missingTTL):
+                self.misses += 1
+                return False, None
+            self.hits += 1
+        return True, row[0]
+
+    def put(self, url, archiveURL):
+        """Store the result of looking up url, None if nothing was found."""
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO archives VALUES (?, ?, ?)',
+                (canonical_url(url), archiveURL, time.time()))
+            self.db.commit()
+
+    def report(self):
+        """Log the hit rate of the cache."""
+        lookups = self.hits + self.misses
+        pywikibot.output('Archive cache: %i lookups, %i hits (%.1f%%)'
+                         % (lookups, self.hits,
+                            100.0 * self.hits / lookups if lookups else 0))
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            self.db.close()
+
+
+class ArchiveLookup(object):
+
+    """
+    Search archived copies of dead links in the background.
+
+    The Internet Archive and WebCite are asked by a fixed number of worker
+    threads, so a slow archive does not hold up recording check results.
+    When the same URL is asked for while its lookup is running, the caller
+    just waits for that lookup.
+
+    Without pywikibot's weblib the Internet Archive is asked through its
+    availability API and WebCite is not asked. After maxFailures lookups
+    in a row failed, no archive is asked any more in this run.
+    """
+
+    maxFailures = 5
+
+    def __init__(self, workers=4, cache=None):
+        """Constructor."""
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # canonical URL -> callbacks waiting for its lookup
+        self.waiting = {}
+        self.lock = threading.Lock()
+        self.lookups = 0
+        # lookups failed in a row
+        self.failures = 0
+        if isinstance(weblib, ImportError):
+            pywikibot.output('pywikibot has no weblib; the Internet Archive '
+                             'is asked through its availability API')
+
+    def find(self, url):
+        """
+        Ask the archives for a copy of url.
+
+        @return: archive URL or None
+        """
+        return self._find(url)[0]
+
+    def _find(self, url):
+        """
+        Ask the archives for a copy of url.
+
+        @return: archive URL or None, and whether the lookup failed
+        @rtype: tuple of (str or None, bool)
+        """
+        archiveURL = None
+        with self.lock:
+            if self.failures >= self.maxFailures:
+                return None, True
+        failed = False
+        # skip memento search
+        """
+        try:
+            #test output
+            pywikibot.output('setlinkDead: Memento Archive [%s]' % url)
+            archiveURL = get_archive_url(url)
+        except Exception as e:
+            pywikibot.warning(
+                'get_closest_memento_url({0}) failed: {1}'.format(
+                    url, e))
+            archiveURL = None
+        """
+        if archiveURL is None:
+            #test output
+            pywikibot.output('[%s] setlinkDead: InternetArchive [%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), url))
+            try:
+                if isinstance(weblib, ImportError):
+                    archiveURL = get_wayback_url(url)
+                else:
+                    archiveURL = weblib.getInternetArchiveURL(url)
+                with self.lock:
+                    self.failures = 0
+            except:
+                pywikibot.output('[%s] EXCEPTION setlinkDead: InternetArchive [%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), url))
+                failed = True
+                with self.lock:
+                    self.failures += 1
+                    disabled = self.failures == self.maxFailures
+                if disabled:
+                    pywikibot.warning('%i archive lookups failed in a row; '
+                                      'archive lookup is disabled for this '
+                                      'run' % self.maxFailures)
+        if archiveURL is None and not isinstance(weblib, ImportError):
+            #test output
+            pywikibot.output('[%s] setlinkDead: WebCitation [%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),url))
+            try:
+                archiveURL = weblib.getWebCitationURL(url)
+            except:
+                pywikibot.output('[%s] EXCEPTION setlinkDead: WebCitation [%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),url))
+                pass
+        #test output
+        pywikibot.output('[%s] setlinkDead: ArchiveLink received [%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),archiveURL))
+        return archiveURL, failed
+
+    def lookup(self, url, callback):
+        """Call callback with the archive URL of url, or None."""
+        if self.cache:
+            found, archiveURL = self.cache.get(url)
+            if found:
+                callback(archiveURL)
+                return
+        key = canonical_url(url)
+        with self.lock:
+            if key in self.waiting:
+                self.waiting[key].append(callback)
+                return
+            self.waiting[key] = [callback]
+        self.executor.submit(self._run, url)
+
+    def _run(self, url):
+        """Look url up and call everyone waiting for it."""
+        archiveURL = None
+        with self.lock:
+            self.lookups += 1
+        try:
+            archiveURL, failed = self._find(url)
+            # a failed lookup is not remembered as no copy found
+            if self.cache and not failed:
+                self.cache.put(url, archiveURL)
+        finally:
+            with self.lock:
+                callbacks = self.waiting.pop(canonical_url(url), [])
+            for callback in callbacks:
+                try:
+                    callback(archiveURL)
+                except Exception:
+                    pywikibot.exception()
+
+    def shutdown(self):
+        """Wait for the running lookups and log statistics."""
+        if self.waiting:
+            pywikibot.output('Waiting for %i archive lookups, please wait...'
+                             % len(self.waiting))
+        self.executor.shutdown(wait=True)
+        pywikibot.output('%i archive lookups' % self.lookups)
+        if self.cache:
+            self.cache.report()
+            self.cache.close()
+
+
+class History(object):
+
+    """
+    Store previously found dead links.
+
+    The history is a DeadLinkStore which maps URLs to lists of tuples where
+    each tuple represents one time the URL was found dead. Tuples have the
+    form (title, date, error) where title is the wiki page where the URL was
+    found, date is an instance of time, and error is a string with error
+    code and message.
+
+    We assume that the first element in the list represents the first time we
+    found this dead link, and the last element represents the last time.
+
+    Example:
+
+    dict = {
+        'https://www.example.org/page': [
+            ('WikiPageTitle', DATE, '404: File not found'),
+            ('WikiPageName2', DATE, '404: File not found'),
+        ]
+
+    A history pickled to the .dat file by former versions is migrated to the
+    store the first time it is opened.
+    """
+
+    def __init__(self, reportThread, site=None, archive=None):
+        """Constructor."""
+        self.reportThread = reportThread
+        self.archive = archive
+        # without archive, the archives are asked in the thread of the check
+        self.finder = None if archive else ArchiveLookup(workers=1)
+        if not site:
+            self.site = pywikibot.Site()
+        else:
+            self.site = site
+        self.semaphore = threading.Semaphore()
+        # seconds spent waiting for the semaphore and number of waits
+        self.lockWait = 0.0
+        self.lockCount = 0
+        self.datfilename = pywikibot.config.datafilepath(
+            'deadlinks', 'deadlinks-%s-%s.dat' % (self.site.family.name,
+                                                  self.site.code))
+        self.dbfilename = pywikibot.config.datafilepath(
+            'deadlinks', 'deadlinks-%s-%s.sqlite' % (self.site.family.name,
+                                                     self.site.code))
+        # Count the number of logged links, so that we can insert captions
+        # from time to time
+        self.logCount = 0
+        self.historyDict = DeadLinkStore(self.dbfilename)
+        if not self.historyDict and os.path.exists(self.datfilename):
+            self.historyDict.migrate(self.datfilename)
+        pywikibot.output('HISTORY OPENED: %s' % self.dbfilename)
+
+    def acquire(self):
+        """Acquire the semaphore, counting the time spent waiting."""
+        started = time.time()
+        self.semaphore.acquire()
+        self.lockWait += time.time() - started
+        self.lockCount += 1
+
+    def log(self, url, error, containingPage, archiveURL):
+        """Log an error report to a text file in the deadlinks subdirectory."""
+        if archiveURL:
+            errorReport = u'* %s ([%s archiwum])\n' % (url, archiveURL)
+        else:
+            errorReport = u'* %s\n' % url
+        for (pageTitle, date, error) in self.historyDict[url]:
+            # ISO 8601 formulation
+            isoDate = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(date))
+            errorReport += "** In [[%s]] on %s, %s\n" % (pageTitle, isoDate,
+                                                         error)
+        pywikibot.output(u"** Logging link for deletion.")
+        txtfilename = pywikibot.config.datafilepath('deadlinks',
+                                                    'results-%s-%s.txt'
+                                                    % (self.site.family.name,
+                                                       self.site.lang))
+        txtfile = codecs.open(txtfilename, 'a', 'utf-8')
+        self.logCount += 1
+        if self.logCount % 30 == 0:
+            # insert a caption
+            txtfile.write('=== %s ===\n' % containingPage.title()[:3])
+        txtfile.write(errorReport)
+        txtfile.close()
+
+        if self.reportThread and not containingPage.isTalkPage():
+            self.reportThread.report(url, errorReport, containingPage,
+                                     archiveURL)
+
+    def setLinkDead(self, url, error, page, weblink_dead_days):
+        """Add the fact that the link was found dead to the history."""
+        #test output
+        #pywikibot.output('setLinkDead: SEM acquire [%s][%s][%s]' % (url,page.title(),error))
+        self.acquire()
+        #test output
+        #pywikibot.output('[%s] setLinkDead: SEM acc DONE [%s][%s][%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), url, page.title(), error))
+        now = time.time()
+        dates = self.historyDict.dates(url)
+        report = False
+        if dates:
+            timeSinceFirstFound = now - dates[0]
+            timeSinceLastFound = now - dates[1]
+            # if the last time we found this dead link is less than an hour
+            # ago, we won't save it in the history this time.
+            if timeSinceLastFound > 60 * 60:
+                self.historyDict.append(url, (page.title(), now, error))
+            # if the first time we found this link longer than x day ago
+            # (default is a week), it should probably be fixed or removed.
+            # We'll list it in a file so that it can be removed manually.
+            report = timeSinceFirstFound > 60 * 60 * 24 * weblink_dead_days
+        else:
+            self.historyDict.append(url, (page.title(), now, error))
+        #test output
+        #pywikibot.output('[%s] setlinkDead: SEM release [%s][%s][%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),url,page.title(),error))
+        self.semaphore.release()
+        #test output
+        #pywikibot.output('[%s] setlinkDead: SEM rel DONE [%s][%s][%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),url,page.title(),error))
+        if report:
+            # the link is dead for long enough: list it in a file so that it
+            # can be removed manually, once an archived copy is searched for
+            callback = partial(self.logArchived, url, error, page)
+            if self.archive:
+                self.archive.lookup(url, callback)
+            else:
+                callback(self.finder.find(url))
+
+    def logArchived(self, url, error, containingPage, archiveURL):
+        """Log an error report when the archive lookup has finished."""
+        self.acquire()
+        try:
+            self.log(url, error, containingPage, archiveURL)
+        finally:
+            self.semaphore.release()
+
+    def setLinkAlive(self, url):
+        """
+        Record that the link is now alive.
+
+        If link was previously found dead, remove it from the history.
+
+        @return: True if previously found dead, else returns False.
+        """
+        if url in self.historyDict:
+            #test output
             #pywikibot.output('[%s] setLinkAlive: SEM acquire [%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),url))
-            self.semaphore.acquire()
+            self.acquire()
             try:
                 del self.historyDict[url]
             except KeyError:
@@ -2365,11 +5147,13 @@ class History(object):
             return False
 
     def save(self):
-        """Save the .dat file to disk."""
-        #test output
-        pywikibot.output('PICKLING %s records at %s' % (len(self.historyDict),datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        with open(self.datfilename, 'wb') as f:
-            pickle.dump(self.historyDict, f, protocol=config.pickle_protocol)
+        """
+        Make sure the history is on disk.
+
+        Every change is already written when it is made; this only commits
+        what may still be pending.
+        """
+        self.historyDict.sync()
 
 
 class DeadLinkReportThread(threading.Thread):
@@ -2377,112 +5161,259 @@ class DeadLinkReportThread(threading.Thread):
     """
     A Thread that is responsible for posting error reports on talk pages.
 
-    There is only one DeadLinkReportThread, and it is using a semaphore to make
-    sure that two LinkCheckerThreads can not access the queue at the same time.
+    There is only one DeadLinkReportThread. Reports wait in a queue; they
+    are collected for up to delay seconds, then the talk pages of the
+    collected reports are preloaded together and every talk page gets all
+    of its reports in a single edit.
     """
 
-    def __init__(self):
+    def __init__(self, delay=30, groupsize=50):
         """Constructor."""
         threading.Thread.__init__(self)
-        self.semaphore = threading.Semaphore()
-        self.queue = []
+        self.queue = queue.Queue()
+        self.delay = delay
+        self.groupsize = groupsize
         self.finishing = False
         self.killed = False
 
     def report(self, url, errorReport, containingPage, archiveURL):
         """Report error on talk page of the page containing the dead link."""
-        self.semaphore.acquire()
-        self.queue.append((url, errorReport, containingPage, archiveURL))
-        self.semaphore.release()
+        self.queue.put((url, errorReport, containingPage, archiveURL))
 
     def shutdown(self):
         """Finish thread."""
         self.finishing = True
+        # wake the thread up if it is waiting for reports
+        self.queue.put(None)
 
     def kill(self):
         """Kill thread."""
         # TODO: remove if unneeded
         self.killed = True
+        self.queue.put(None)
+
+    @staticmethod
+    def _add(batch, item):
+        """Add a queued report to the reports of its talk page."""
+        url, errorReport, containingPage, archiveURL = item
+        talkPage = containingPage.toggleTalkPage()
+        batch.setdefault(talkPage.title(), (talkPage, []))[1].append(
+            (url, errorReport, archiveURL))
+
+    def collect(self):
+        """
+        Wait for reports and group them by talk page.
+
+        @return: talk page title -> (talk page, list of reports), in the
+            order the talk pages were first reported
+        @rtype: OrderedDict
+        """
+        batch = OrderedDict()
+        item = self.queue.get()
+        deadline = time.time() + self.delay
+        while True:
+            if item is not None:
+                self._add(batch, item)
+            if (self.finishing or self.killed
+                    or len(batch) >= self.groupsize):
+                break
+            try:
+                item = self.queue.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                break
+        if self.finishing:
+            # nothing is reported any more; take the rest in one go
+            while not self.killed:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    self._add(batch, item)
+        return batch
+
+    def put_reports(self, talkPage, reports):
+        """Add all reports for one talk page in one edit."""
+        pywikibot.output(color_format(
+            '{lightaqua}** Reporting {0} dead link(s) on {1}...{default}',
+            len(reports), talkPage.title(asLink=True)))
+        try:
+            content = talkPage.get() + "\n"
+        except (pywikibot.NoPage, pywikibot.IsRedirectPage):
+            content = u''
+
+        urls = []
+        for url, errorReport, archiveURL in reports:
+            if url in content:
+                pywikibot.output(color_format(
+                    '{lightaqua}** Dead link {0} seems to have already '
+                    'been reported on {1}{default}',
+                    url, talkPage.title(asLink=True)))
+                continue
+            # archiveMsg used to be the i18n 'weblinkchecker-archive_msg'
+            archiveMsg = archiveURL or u''
+            # new code: use polish template
+            content += u'{{Martwy link dyskusja\n | link=' + errorReport + u'\n | IA=' + archiveMsg + u'\n}}'
+            urls.append(url)
+        if not urls:
+            return
+
+        if len(urls) == 1:
+            comment = u'[[%s]] Robot zgłasza niedostępny link zewnętrzny: %s' % \
+                      (talkPage.title(), urls[0])
+        else:
+            comment = u'[[%s]] Robot zgłasza niedostępne linki zewnętrzne: %s' % \
+                      (talkPage.title(), ', '.join(urls))
+        try:
+            talkPage.put(content, comment)
+        except pywikibot.SpamfilterError as error:
+            pywikibot.output(color_format(
+                '{lightaqua}** SpamfilterError while trying to '
+                'change {0}: {1}{default}',
+                talkPage.title(asLink=True), error.url))
 
     def run(self):
         """Run thread."""
         while not self.killed:
-            if len(self.queue) == 0:
-                if self.finishing:
+            if self.finishing and self.queue.empty():
+                break
+            batch = self.collect()
+            if not batch:
+                continue
+            talkPages = [talkPage for talkPage, reports in batch.values()]
+            # load the texts of all talk pages of the batch at once
+            for talkPage in pagegenerators.PreloadingGenerator(
+                    talkPages, groupsize=self.groupsize):
+                pass
+            for talkPage, reports in batch.values():
+                if self.killed:
                     break
-                else:
-                    time.sleep(0.1)
+                self.put_reports(talkPage, reports)
+
+
+class Checkpoint(object):
+
+    """
+    Where a run has got to, so that it can be resumed with -resume.
+
+    The title of the last page whose links have all been submitted and the
+    URLs whose check has not been recorded yet are written to a JSON file
+    in the deadlinks subdirectory every interval seconds, after the history
+    has been committed. The file is removed when the run has finished.
+    """
+
+    def __init__(self, site, interval=60):
+        """Constructor."""
+        self.filename = pywikibot.config.datafilepath(
+            'deadlinks', 'checkpoint-%s-%s.json' % (site.family.name,
+                                                    site.code))
+        self.interval = interval
+        self.title = None
+        # (page title, URL) whose check was not recorded
+        self.urls = []
+        self.engine = None
+        self.history = None
+        self.saved = time.time()
+        self.complete = False
+
+    def load(self):
+        """
+        Read the checkpoint of an earlier run.
+
+        @return: whether there is one
+        @rtype: bool
+        """
+        if not os.path.exists(self.filename):
+            return False
+        with codecs.open(self.filename, 'r', 'utf-8') as f:
+            data = json.load(f)
+        self.title = data['title']
+        self.urls = [tuple(item) for item in data['urls']]
+        if self.title is None:
+            # no page was finished before the checkpoint
+            pywikibot.output('[%s] Resuming from the beginning with %i '
+                             'unfinished URLs from %s'
+                             % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(self.urls), data['saved']))
+        else:
+            pywikibot.output('[%s] Resuming after [[%s]] with %i unfinished '
+                             'URLs from %s'
+                             % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), self.title, len(self.urls),
+                                data['saved']))
+        return True
+
+    def save(self):
+        """Commit the history and write the checkpoint."""
+        urls = self.engine.inflight() if self.engine else []
+        if self.history:
+            self.history.save()
+        data = {
+            'title': self.title,
+            'urls': urls,
+            'saved': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with codecs.open(self.filename + '.tmp', 'w', 'utf-8') as f:
+            json.dump(data, f)
+        os.replace(self.filename + '.tmp', self.filename)
+        self.saved = time.time()
+
+    def skip(self, generator):
+        """
+        Yield the pages of generator after the checkpoint page.
+
+        All pages are yielded if there is no checkpoint page. If it is not
+        found, e.g. because it was deleted or the page source differs from
+        the one of the run resumed, a warning says so.
+        """
+        skipping = self.title is not None
+        skipped = 0
+        for page in generator:
+            if skipping:
+                skipping = page.title() != self.title
+                skipped += 1
             else:
-                self.semaphore.acquire()
-                (url, errorReport, containingPage, archiveURL) = self.queue[0]
-                #test output
-                #pywikibot.output('[%s] DeadLinkReportThread: SEM acquire [%s][%s][%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),url,containingPage.title(),errorReport))
-                self.queue = self.queue[1:]
-                talkPage = containingPage.toggleTalkPage()
-                pywikibot.output(color_format(
-                    '{lightaqua}** Reporting dead link on {0}...{default}',
-                    talkPage.title(asLink=True)))
-                try:
-                    content = talkPage.get() + "\n"
-                    if url in content:
-                        pywikibot.output(color_format(
-                            '{lightaqua}** Dead link seems to have already '
-                            'been reported on {0}{default}',
-                            talkPage.title(asLink=True)))
-                        #test output
-                        #pywikibot.output('[%s] DeadLinkReportThread: SEM release [%s][%s][%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),url,containingPage.title(),errorReport))
-                        self.semaphore.release()
-                        continue
-                except (pywikibot.NoPage, pywikibot.IsRedirectPage):
-                    content = u''
-
-                if archiveURL:
-                # removed original code using i18n
-
-                #    archiveMsg = u'\n' + \
-                #                 i18n.twtranslate(containingPage.site,
-                #                                  'weblinkchecker-archive_msg',
-                #                                  {'URL': archiveURL})
-                    archiveMsg = archiveURL
-                else:
-                    archiveMsg = u''
-                # The caption will default to "Dead link". But if there is
-                # already such a caption, we'll use "Dead link 2",
-                # "Dead link 3", etc.
-                caption = u'Martwy link'
-                #caption = i18n.twtranslate(containingPage.site,
-                #                           'weblinkchecker-caption')
-                i = 1
-                count = u''
-                # Check if there is already such a caption on the talk page.
-                #while re.search('= *%s%s *=' % (caption, count),
-                #                content) is not None:
-                #    i += 1
-                #    count = u' ' + str(i)
-                #caption += count
-                #content += '== %s ==\n\n%s\n\n%s%s\n--~~~~' % \
-                #           (caption,
-                #            i18n.twtranslate(containingPage.site,
-                #                             'weblinkchecker-report'),
-                #            errorReport,
-                #            archiveMsg)
-                # new code: use polish template
-                content += u'{{Martwy link dyskusja\n | link=' + errorReport + u'\n | IA=' + archiveMsg + u'\n}}'
-
-                comment = u'[[%s]] Robot zgłasza niedostępny link zewnętrzny: %s' % \
-                          (talkPage.title(), url)
-                           #i18n.twtranslate(containingPage.site,
-                           #                 'weblinkchecker-summary'))
-                try:
-                    talkPage.put(content, comment)
-                except pywikibot.SpamfilterError as error:
-                    pywikibot.output(color_format(
-                        '{lightaqua}** SpamfilterError while trying to '
-                        'change {0}: {1}{default}',
-                        talkPage.title(asLink=True), error.url))
-                #test output
-                #pywikibot.output('[%s] DeadLinkReportThread: SEM release [%s][%s][%s]' % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),url,containingPage.title(),errorReport))
-                self.semaphore.release()
+                yield page
+        if skipping:
+            pywikibot.warning(
+                'The checkpoint page [[%s]] was not found among %i pages, so '
+                'none of them was checked. Run without -resume to check '
+                'them from the beginning.' % (self.title, skipped))
+
+    def skipFirst(self, items, title):
+        """
+        Yield items, leaving out the first one if it is the checkpoint page.
+
+        For generators which start at the checkpoint page, like -start: and
+        -xmlstart; that page was done before the checkpoint was written.
+
+        @param title: function returning the page title of an item
+        """
+        first = True
+        for item in items:
+            if not (first and title(item) == self.title):
+                yield item
+            first = False
+
+    def track(self, items, title):
+        """
+        Yield items, marking each one done when the next one is asked for.
+
+        @param title: function returning the page title of an item
+        """
+        for item in items:
+            yield item
+            self.title = title(item)
+            if time.time() - self.saved > self.interval:
+                self.save()
+        self.complete = True
+
+    def finish(self):
+        """Remove the checkpoint if the run is complete, else write it."""
+        if self.complete and not (self.engine and self.engine.inflight()):
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+        else:
+            self.save()
+            pywikibot.output('Checkpoint written; continue with -resume')
 
 
 class WeblinkCheckerRobot(SingleSiteBot, ExistingPageBot):
@@ -2490,12 +5421,13 @@ class WeblinkCheckerRobot(SingleSiteBot, ExistingPageBot):
     """
     Bot which will search for dead weblinks.
 
-    It uses several LinkCheckThreads at once to process pages from generator.
+    It checks the links of the pages from generator with a check engine,
+    which runs several checks at once.
     """
 
-    killing = False
-
-    def __init__(self, generator, HTTPignore=None, day=7, site=True):
+    def __init__(self, generator, HTTPignore=None, day=7, site=True,
+                 engine='thread', maxPerHost=4, cache=None, method='get',
+                 archive=None, breaker=None, metrics=None, adaptive=True):
         """Constructor."""
         super(WeblinkCheckerRobot, self).__init__(
             generator=generator, site=site)
@@ -2508,12 +5440,21 @@ class WeblinkCheckerRobot(SingleSiteBot, ExistingPageBot):
             reportThread.start()
         else:
             reportThread = None
-        self.history = History(reportThread, site=self.site)
+        self.history = History(reportThread, site=self.site, archive=archive)
         if HTTPignore is None:
             self.HTTPignore = []
         else:
             self.HTTPignore = HTTPignore
         self.day = day
+        self.engine = check_engines[engine](self.history, self.HTTPignore,
+                                            self.day, maxPerHost=maxPerHost,
+                                            cache=cache, method=method,
+                                            breaker=breaker,
+                                            adaptive=adaptive)
+        self.metrics = metrics
+        self.engine.metrics = metrics
+        if metrics:
+            metrics.start(self.engine, self.history)
 
     def treat_page(self):
         """Process one page."""
@@ -2527,55 +5468,344 @@ class WeblinkCheckerRobot(SingleSiteBot, ExistingPageBot):
         except:
             pass
 
-        #self.killing = False
         for url in weblinksIn(text):
-            ignoreUrl = False
-            for ignoreR in ignorelist:
-                if ignoreR.match(url):
-                    ignoreUrl = True
-            if not ignoreUrl:
-                # Limit the number of threads started at the same time. Each
-                # thread will check one page, then die.
-                #test output
-                pywikibot.output(u'STARTING thread #%i' % threading.activeCount())
-                while threading.activeCount() >= config.max_external_links:
-                    #test output
-                    pywikibot.output(u'WAIT %s for thread #%i' % (config.retry_wait,threading.activeCount()))
-                    time.sleep(config.retry_wait)
-                thread = LinkCheckThread(page, url, self.history,
-                                         self.HTTPignore, self.day)
-                # thread dies when program terminates
-                thread.setDaemon(True)
-                try:
-                    thread.start()
-                except (threading.ThreadError,thread.error):
-                    pywikibot.warning(
-                        "Can't start a new thread.\nPlease decrease "
-                        "max_external_links in your user-config.py or use\n"
-                        "'-max_external_links:' option with a smaller value. "
-                        "Default is 50.")
-                    raise
-                except request.data:
-                    pywikibot.warning('*** NO DATA received')
-                    pywikibot.output('*** NO DATA received')
-                    raise
-                finally:
-                    pywikibot.output(u'Finally: thread error...')
-                    if not self.killing:
-                        pywikibot.output(u'Saving history on thread error...')
-                        #self.history.save()
-                        self.killing = True
-                    return
+            if not ignore_matcher.match(url):
+                self.engine.submit(page, url)
+        if self.metrics:
+            self.metrics.page()
+
+    def check_history(self):
+        """Check again the dead links stored in the history."""
+        self.engine.confirm = DeadLinkConfirmer(self.history)
+        for url, entries in self.history.historyDict.items():
+            if ignore_matcher.match(url):
+                continue
+            for title in sorted(set(entry[0] for entry in entries)):
+                self.engine.submit(pywikibot.Page(self.site, title), url)
+
+    def check_extlinks(self, batches):
+        """
+        Check the links of batches of pages as given by prop=extlinks.
+
+        The pages are not loaded, except those whose archived citations
+        have to be left out; see api_weblinks.
+        """
+        for pages in batches:
+            links = api_weblinks(self.site, [page.title() for page in pages],
+                                 groupsize=len(pages))
+            if self.metrics:
+                self.metrics.page(len(pages))
+            for title, urls in links.items():
+                if not urls:
+                    continue
+                page = pywikibot.Page(self.site, title)
+                pywikibot.output(u'P:%s >>>%s' % (title, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+                for url in urls:
+                    if not ignore_matcher.match(url):
+                        self.engine.submit(page, url)
+
+    def work(self, jobs, size=None, leaseTime=10 * 60):
+        """
+        Check the links of a JobQueue until all are done.
+
+        New jobs are claimed whenever less than half a batch of them is
+        left, and the leases of the claimed jobs are renewed while they
+        wait for their hosts. Jobs whose check raised an exception, and
+        all unfinished ones when the work stops, are released for another
+        attempt.
+        """
+        worker = '%s:%i' % (socket.gethostname(), os.getpid())
+        size = size or config.max_external_links * 2
+        lock = threading.Lock()
+        # (page title, canonical URL) -> ids of its jobs
+        claimed = {}
+        finished = []
+        failed = []
+
+        def recorded(page, url):
+            with lock:
+                finished.extend(claimed.pop(
+                    (page.title(), canonical_url(url)), []))
+
+        def checkFailed(page, url):
+            with lock:
+                failed.extend(claimed.pop(
+                    (page.title(), canonical_url(url)), []))
+
+        self.engine.recorded = recorded
+        self.engine.failed = checkFailed
+        renewed = time.time()
+        pywikibot.output('[%s] Worker %s working on %s'
+                         % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), worker, jobs.filename))
+        try:
+            while True:
+                with lock:
+                    done, finished[:] = finished[:], []
+                    released, failed[:] = failed[:], []
+                    left = len(claimed)
+                if done:
+                    jobs.done(done)
+                if released:
+                    jobs.release(released)
+                if left < size // 2:
+                    links = jobs.claim(worker, size - left, leaseTime)
+                    for jobId, title, url in links:
+                        page = pywikibot.Page(self.site, title)
+                        key = (page.title(), canonical_url(url))
+                        with lock:
+                            new = key not in claimed
+                            claimed.setdefault(key, []).append(jobId)
+                        if new:
+                            self.engine.submit(page, url)
+                    if not links:
+                        if not left and jobs.finished():
+                            break
+                        time.sleep(5)
+                else:
+                    time.sleep(1)
+                if time.time() - renewed > leaseTime / 3:
+                    jobs.renew(worker, leaseTime)
+                    renewed = time.time()
+        finally:
+            with lock:
+                done = finished[:]
+                released = failed[:] + [jobId for ids in claimed.values()
+                                        for jobId in ids]
+                claimed.clear()
+            if done:
+                jobs.done(done)
+            if released:
+                jobs.release(released)
+                pywikibot.output('[%s] %i unfinished jobs released'
+                                 % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(released)))
+        given = jobs.failed()
+        if given:
+            pywikibot.output('%i jobs given up after %i attempts are left in '
+                             '%s' % (given, jobs.maxAttempts, jobs.filename))
+
+    def check_dump(self, scanner):
+        """Check the links found by a DumpLinkScanner."""
+        for title, urls in scanner:
+            page = pywikibot.Page(self.site, title)
+            pywikibot.output(u'P:%s >>>%s' % (title, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            for url in urls:
+                self.engine.submit(page, url)
+            if self.metrics:
+                self.metrics.page()
+
+
+# hosts of web archives; links to them come with the archived link
+archiveHosts = (
+    'archive.org', 'archive.is', 'archive.today', 'archive.ph',
+    'webcitation.org',
+)
+
+
+def is_archive_url(url):
+    """Return True if url points to a web archive."""
+    host = urlparse.urlsplit(url).hostname or ''
+    return any(host == archiveHost or host.endswith('.' + archiveHost)
+               for archiveHost in archiveHosts)
+
+
+def api_weblinks(site, titles, groupsize=50):
+    """
+    Get the links to check of pages from prop=extlinks.
+
+    Only pages which link to a web archive are loaded, to leave out the
+    links of their archived citations as weblinksIn does.
+
+    @return: page title -> list of URLs, or None for a missing page
+    @rtype: OrderedDict
+    """
+    links = OrderedDict()
+    for i in range(0, len(titles), groupsize):
+        gen = api.PropertyGenerator(
+            'extlinks', site=site,
+            parameters={'titles': titles[i:i + groupsize],
+                        'ellimit': 'max'})
+        for pagedata in gen:
+            title = pagedata['title']
+            if 'missing' in pagedata or 'invalid' in pagedata:
+                links[title] = None
+                continue
+            urls = links.setdefault(title, [])
+            for link in pagedata.get('extlinks', []):
+                url = link.get('url', link.get('*'))
+                if url.startswith(('http://', 'https://')) and url not in urls:
+                    urls.append(url)
+
+    archivePages = []
+    for title, urls in links.items():
+        if urls and any(is_archive_url(url) for url in urls):
+            archivePages.append(pywikibot.Page(site, title))
+    for page in pagegenerators.PreloadingGenerator(archivePages,
+                                                   groupsize=groupsize):
+        try:
+            urls, archived = scan_weblinks(page.text)
+        except (pywikibot.NoPage, pywikibot.IsRedirectPage):
+            continue
+        links[page.title()] = [url for url in links[page.title()]
+                               if url not in archived]
+    return links
+
+
+class ExtLinkStore(object):
+
+    """
+    The external links of every page as seen when it was last changed.
+
+    Kept in an SQLite file in the deadlinks subdirectory, together with the
+    high-water mark of the recent changes read.
+    """
+
+    def __init__(self, filename):
+        """Constructor."""
+        self.filename = filename
+        self.db = sqlite3.connect(filename, check_same_thread=False,
+                                  timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS links ('
+                        'title TEXT, url TEXT, PRIMARY KEY (title, url))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS state ('
+                        'name TEXT PRIMARY KEY, value)')
+        self.db.commit()
+
+    def get(self, title):
+        """Return the stored links of title."""
+        return set(url for url, in self.db.execute(
+            'SELECT url FROM links WHERE title = ?', (title, )))
+
+    def update(self, title, urls):
+        """
+        Store the links of title.
+
+        @return: the links which were not stored before
+        @rtype: set
+        """
+        old = self.get(title)
+        urls = set(urls or [])
+        self.db.executemany('DELETE FROM links WHERE title = ? AND url = ?',
+                            [(title, url) for url in old - urls])
+        self.db.executemany('INSERT INTO links VALUES (?, ?)',
+                            [(title, url) for url in urls - old])
+        return urls - old
+
+    def move(self, title, newTitle):
+        """Store the links of title under newTitle."""
+        self.db.execute('UPDATE OR REPLACE links SET title = ? '
+                        'WHERE title = ?', (newTitle, title))
+
+    def mark(self):
+        """Return the stored high-water mark as (rcid, timestamp)."""
+        state = dict(self.db.execute('SELECT name, value FROM state'))
+        return state.get('rcid', 0), state.get('timestamp')
+
+    def setMark(self, rcid, timestamp):
+        """Store the high-water mark and commit."""
+        self.db.executemany('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                            [('rcid', rcid), ('timestamp', timestamp)])
+        self.db.commit()
+
+    def close(self):
+        """Close the database."""
+        self.db.close()
+
+
+class RecentChangesFollower(object):
+
+    """
+    Check the links added by recent changes, for as long as it runs.
+
+    Every interval seconds the recent changes since the high-water mark
+    are read. The links of the changed pages are compared with the stored
+    ones: added links are submitted to the check engine, and so are links
+    whose result in the URL cache is out of date. Deleted and moved pages
+    are taken from the log entries.
+    """
+
+    def __init__(self, bot, namespaces=None, interval=60):
+        """Constructor."""
+        self.bot = bot
+        self.site = bot.site
+        self.namespaces = namespaces or [0]
+        self.interval = interval
+        self.store = ExtLinkStore(pywikibot.config.datafilepath(
+            'deadlinks', 'extlinks-%s-%s.sqlite' % (self.site.family.name,
+                                                     self.site.code)))
+        self.added = 0
+        self.rechecked = 0
+
+    def changes(self, rcid, timestamp):
+        """Return the titles changed since the mark and the new mark."""
+        titles = OrderedDict()
+        for change in self.site.recentchanges(start=timestamp, reverse=True,
+                                              namespaces=self.namespaces):
+            if change['rcid'] <= rcid:
+                continue
+            rcid, timestamp = change['rcid'], change['timestamp']
+            if change['type'] != 'log':
+                titles[change['title']] = True
+            elif change.get('logtype') == 'move':
+                params = change.get('logparams', {})
+                newTitle = params.get('target_title',
+                                      params.get('new_title'))
+                if newTitle:
+                    self.store.move(change['title'], newTitle)
+                    titles[newTitle] = True
+            elif change.get('logtype') == 'delete':
+                titles[change['title']] = True
+        return list(titles), rcid, timestamp
+
+    def treat(self, titles):
+        """Submit the new and out of date links of titles."""
+        cache = self.bot.engine.cache
+        for title, urls in api_weblinks(self.site, titles).items():
+            new = self.store.update(title, urls)
+            if not urls:
+                continue
+            page = pywikibot.Page(self.site, title)
+            for url in urls:
+                if ignore_matcher.match(url):
+                    continue
+                if url in new:
+                    self.added += 1
+                elif cache and cache.get(url) is None:
+                    self.rechecked += 1
+                else:
+                    continue
+                self.bot.engine.submit(page, url)
+
+    def run(self):
+        """Follow the recent changes until interrupted."""
+        rcid, timestamp = self.store.mark()
+        if timestamp is None:
+            timestamp = datetime.datetime.utcnow().strftime(
+                '%Y-%m-%dT%H:%M:%SZ')
+        pywikibot.output('[%s] Following recent changes since %s'
+                         % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), timestamp))
+        try:
+            while True:
+                started = time.time()
+                titles, rcid, timestamp = self.changes(rcid, timestamp)
+                if titles:
+                    self.treat(titles)
+                self.store.setMark(rcid, timestamp)
+                pywikibot.output('[%s] %i pages changed; %i new links and '
+                                 '%i out of date links submitted so far'
+                                 % (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), len(titles), self.added,
+                                    self.rechecked))
+                time.sleep(max(0, self.interval - (time.time() - started)))
+        except KeyboardInterrupt:
+            pywikibot.output('Stopped following recent changes.')
+        finally:
+            self.store.close()
 
 
 def RepeatPageGenerator():
     """Generator for pages in History."""
     history = History(None)
-    pageTitles = set()
-    for value in history.historyDict.values():
-        for entry in value:
-            pageTitles.add(entry[0])
-    for pageTitle in sorted(pageTitles):
+    for pageTitle in history.historyDict.titles():
         page = pywikibot.Page(pywikibot.Site(), pageTitle)
         yield page
 
@@ -2611,8 +5841,24 @@ def main(*args):
     @type args: list of unicode
     """
     gen = None
+    scanner = None
+    repeatURLs = False
+    rcFollow = False
+    useExtlinks = False
+    worker = False
+    metricsFile = None
     xmlFilename = None
+    xmlProcesses = 1
     HTTPignore = []
+    engine = 'thread'
+    maxPerHost = 4
+    method = 'get'
+    adaptive = True
+    breakerThreshold = 3
+    coolOff = 10
+    useCache = True
+    aliveTTL = 7
+    deadTTL = 24
 
     if isinstance(memento_client, ImportError):
         warn('memento_client not imported: %s' % memento_client, ImportWarning)
@@ -2621,17 +5867,72 @@ def main(*args):
     local_args = pywikibot.handle_args(args)
     genFactory = pagegenerators.GeneratorFactory()
 
+    checkpoint = Checkpoint(pywikibot.Site())
+    resume = '-resume' in local_args and checkpoint.load()
+    if '-resume' in local_args and not resume:
+        pywikibot.output('No checkpoint found; starting from the beginning')
+    startReplaced = False
+
     for arg in local_args:
-        if arg == '-talk':
+        if arg == '-resume':
+            continue
+        elif (resume and checkpoint.title is not None
+                and arg.startswith('-start:')):
+            # allpages can start at the checkpoint page straight away
+            genFactory.handleArg('-start:' + checkpoint.title)
+            startReplaced = True
+        elif arg == '-talk':
             config.report_dead_links_on_talk = True
         elif arg == '-notalk':
             config.report_dead_links_on_talk = False
         elif arg == '-repeat':
             gen = RepeatPageGenerator()
+        elif arg == '-repeaturls':
+            repeatURLs = True
+        elif arg == '-rcfollow':
+            rcFollow = True
+        elif arg == '-extlinks':
+            useExtlinks = True
+        elif arg == '-coordinator':
+            engine = JobSubmitter.name
+        elif arg == '-worker':
+            worker = True
+        elif arg.startswith('-metrics:'):
+            metricsFile = arg[9:]
         elif arg.startswith('-ignore:'):
             HTTPignore.append(int(arg[8:]))
         elif arg.startswith('-day:'):
             config.weblink_dead_days = int(arg[5:])
+        elif arg.startswith('-engine:'):
+            engine = arg[8:]
+            if engine not in check_engines:
+                pywikibot.bot.suggest_help(
+                    additional_text='Unknown engine %s; use one of: %s'
+                                    % (engine, ', '.join(check_engines)))
+                return False
+        elif arg.startswith('-perhost:'):
+            maxPerHost = int(arg[9:])
+        elif arg == '-fixed':
+            adaptive = False
+        elif arg.startswith('-method:'):
+            method = arg[8:]
+            if method not in ('get', 'head'):
+                pywikibot.bot.suggest_help(
+                    additional_text='Unknown method %s; use get or head'
+                                    % method)
+                return False
+        elif arg.startswith('-breaker:'):
+            breakerThreshold = int(arg[9:])
+        elif arg.startswith('-cooloff:'):
+            coolOff = float(arg[9:])
+        elif arg == '-nocache':
+            useCache = False
+        elif arg.startswith('-cachealive:'):
+            aliveTTL = float(arg[12:])
+        elif arg.startswith('-cachedead:'):
+            deadTTL = float(arg[11:])
+        elif arg.startswith('-xmlprocs:'):
+            xmlProcesses = int(arg[10:])
         elif arg.startswith('-xmlstart'):
             if len(arg) == 9:
                 xmlStart = pywikibot.input(
@@ -2651,40 +5952,83 @@ def main(*args):
             xmlStart
         except NameError:
             xmlStart = None
-        gen = XmlDumpPageGenerator(xmlFilename, xmlStart,
-                                   genFactory.namespaces)
+        if resume and checkpoint.title is not None:
+            xmlStart = checkpoint.title
+            startReplaced = True
+        if xmlProcesses > 1:
+            scanner = DumpLinkScanner(xmlFilename, xmlStart,
+                                      genFactory.namespaces, xmlProcesses)
+        else:
+            gen = XmlDumpPageGenerator(xmlFilename, xmlStart,
+                                       genFactory.namespaces)
 
-    if not gen:
+    if not (gen or scanner or repeatURLs or rcFollow or worker):
         gen = genFactory.getCombinedGenerator()
-    if gen:
-        if not genFactory.nopreload:
+        if gen and resume and not startReplaced:
+            gen = checkpoint.skip(gen)
+    if startReplaced:
+        # the generators start at the checkpoint page, which is done
+        if gen:
+            gen = checkpoint.skipFirst(gen, lambda page: page.title())
+        if scanner:
+            scanner = checkpoint.skipFirst(scanner, lambda item: item[0])
+    if gen or scanner or repeatURLs or rcFollow or worker:
+        if gen and useExtlinks:
+            # 50 pages per request; a batch is done as a whole
+            gen = checkpoint.track(itergroup(gen, 50),
+                                   lambda pages: pages[-1].title())
+        elif gen and not genFactory.nopreload:
             # fetch at least 240 pages simultaneously from the wiki, but more
             # if a high thread number is set.
             pageNumber = max(30, config.max_external_links * 2)
             pywikibot.output("Fetch %i pages." % pageNumber)
             gen = pagegenerators.PreloadingGenerator(gen, groupsize=pageNumber)
-        gen = pagegenerators.RedirectFilterPageGenerator(gen)
-        bot = WeblinkCheckerRobot(gen, HTTPignore, config.weblink_dead_days)
+        if gen and not useExtlinks:
+            gen = pagegenerators.RedirectFilterPageGenerator(gen)
+            gen = checkpoint.track(gen, lambda page: page.title())
+        if scanner:
+            scanner = checkpoint.track(scanner, lambda item: item[0])
+        cache = None
+        if useCache:
+            cache = URLCheckCache(aliveTTL * 24 * 60 * 60,
+                                  deadTTL * 60 * 60)
+        bot = WeblinkCheckerRobot(gen, HTTPignore, config.weblink_dead_days,
+                                  engine=engine, maxPerHost=maxPerHost,
+                                  cache=cache, method=method,
+                                  archive=ArchiveLookup(cache=ArchiveCache()),
+                                  breaker=HostBreaker(breakerThreshold,
+                                                      coolOff * 60)
+                                  if breakerThreshold else None,
+                                  metrics=Metrics(metricsFile)
+                                  if metricsFile else None,
+                                  adaptive=adaptive)
+        checkpoint.engine = bot.engine
+        checkpoint.history = bot.history
+        for title, url in checkpoint.urls:
+            bot.engine.submit(pywikibot.Page(bot.site, title), url)
         try:
-            bot.run()
-        finally:
-            waitTime = 0
-            # Don't wait longer than 30 seconds for threads to finish.
-            while countLinkCheckThreads() > 0 and waitTime < 30:
+            if scanner:
+                bot.check_dump(scanner)
+            elif repeatURLs:
+                bot.check_history()
+            elif rcFollow:
+                RecentChangesFollower(bot, genFactory.namespaces).run()
+            elif useExtlinks:
+                bot.check_extlinks(gen)
+            elif worker:
+                jobs = JobQueue(bot.site)
                 try:
-                    pywikibot.output(u"Waiting for remaining %i threads to "
-                                     u"finish, please wait..."
-                                     % countLinkCheckThreads())
-                    # wait 1 second
-                    time.sleep(1)
-                    waitTime += 1
-                except KeyboardInterrupt:
-                    pywikibot.output(u'Interrupted.')
-                    break
-            if countLinkCheckThreads() > 0:
-                pywikibot.output(u'Remaining %i threads will be killed.'
-                                 % countLinkCheckThreads())
-                # Threads will die automatically because they are daemonic.
+                    bot.work(jobs)
+                finally:
+                    jobs.close()
+            else:
+                bot.run()
+        finally:
+            bot.engine.shutdown()
+            if bot.metrics:
+                bot.metrics.stop()
+            # dead links are reported when their archive lookup is done
+            bot.history.archive.shutdown()
             if bot.history.reportThread:
                 bot.history.reportThread.shutdown()
                 # wait until the report thread is shut down; the user can
@@ -2697,6 +6041,10 @@ def main(*args):
                     bot.history.reportThread.kill()
             pywikibot.output(u'Saving history...')
             bot.history.save()
+            if not (repeatURLs or rcFollow or worker):
+                checkpoint.finish()
+            if cache:
+                cache.close()
         return True
     else:
         pywikibot.bot.suggest_help(missing_generator=True)